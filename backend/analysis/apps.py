@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_save, pre_delete
 
 
 class AnalysisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analysis'
+
+    def ready(self):
+        from .ingest import MODES, story_created
+        from .vocabulary import story_deleted, story_saved
+
+        if settings.ANALYZE_ON_INGEST not in MODES:
+            raise ImproperlyConfigured(f"ANALYZE_ON_INGEST must be one of {', '.join(MODES)}")
+        post_save.connect(story_created, sender='stories.Story', dispatch_uid='analysis.ingest.story_created')
+        post_save.connect(story_saved, sender='stories.Story', dispatch_uid='analysis.vocabulary.story_saved')
+        pre_delete.connect(story_deleted, sender='stories.Story', dispatch_uid='analysis.vocabulary.story_deleted')
@@ -0,0 +1,251 @@
+"""
+Process pool for the CPU-bound NLP work behind the analysis endpoints.
+
+Tokenising, POS tagging and scoring a story holds the GIL for a long
+time, so running it on the request thread (or worse, the event loop)
+stalls every other request in the process. The async analysis views hand
+it to a bounded ProcessPoolExecutor instead and await the result.
+
+At most ANALYSIS_POOL_WORKERS jobs run at once and at most
+ANALYSIS_QUEUE_LIMIT more wait for a free worker; past that submit()
+raises PoolBusy straight away so the view can answer 503 instead of
+piling up work nobody will wait for. ANALYSIS_POOL_WORKERS=0 runs jobs
+on a thread in this process (handy for tests and tiny deployments).
+
+Pools are spawned by default. Under gunicorn each worker forks its pool
+right after it is itself forked (pool.start('fork') in gunicorn.conf.py),
+so the pool processes share the models the master warmed up.
+"""
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from stories.dedup import content_hash
+
+# Bump these whenever analysis.py changes what a job returns (tokenisation,
+# features, thresholds...). Stored rows carry the version that produced
+# them, and `manage.py analyze_stories` redoes the ones that are behind.
+STYLOMETRY_VERSION = 1
+AUTHORSHIP_VERSION = 1
+
+# Analyzers are built once per worker process, on first use
+_analyzers = {}
+
+
+def _get_analyzer(name):
+    if name not in _analyzers:
+        # Imported lazily: the module pulls in nltk/sklearn and may try to
+        # download NLTK data, which the web process itself never needs
+        from .analysis import AuthorshipDetector, StylometricAnalyzer
+        _analyzers['stylometry'] = StylometricAnalyzer()
+        _analyzers['authorship'] = AuthorshipDetector()
+    return _analyzers[name]
+
+
+WARM_UP_TEXT = 'The little fox ran home. It was happy to see its family again!'
+
+
+def warm_up():
+    """
+    Build the analyzers and run them once so NLTK's punkt tokenizer and
+    POS tagger (loaded lazily on first call) are in memory before the
+    first real job. Used as the pool initializer and by gunicorn.conf.py.
+    """
+    _get_analyzer('stylometry').analyze_text(WARM_UP_TEXT)
+    _get_analyzer('authorship').predict_authorship(WARM_UP_TEXT)
+
+
+# Handlers a forked pool process may have inherited from gunicorn
+_INHERITED_SIGNALS = ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT', 'SIGUSR1', 'SIGUSR2', 'SIGTTIN', 'SIGTTOU', 'SIGWINCH')
+
+
+def _init_worker():
+    for name in _INHERITED_SIGNALS:
+        signal.signal(getattr(signal, name), signal.SIG_DFL)
+    try:
+        # Nearly free when forked from a process that already warmed up
+        warm_up()
+    except LookupError:
+        # Missing NLTK data: let the jobs themselves report it rather than
+        # marking the whole pool broken
+        pass
+
+
+def _timed(job, text, submitted_at):
+    started = time.time()
+    result = job(text)
+    return result, {
+        'queued': round(started - submitted_at, 4),
+        'compute': round(time.time() - started, 4),
+    }
+
+
+def _stylometry_job(text):
+    return _get_analyzer('stylometry').analyze_text(text)
+
+
+def _authorship_job(text):
+    return _get_analyzer('authorship').predict_authorship(text)
+
+
+def analyze_text(text, submitted_at):
+    """Worker entry point: stylometric analysis of one story"""
+    return _timed(_stylometry_job, text, submitted_at)
+
+
+def detect_authorship(text, submitted_at):
+    """Worker entry point: AI/Human prediction for one story"""
+    return _timed(_authorship_job, text, submitted_at)
+
+
+def analyze_batch(stories):
+    """
+    Worker entry point for analysis.ingest: both analyses for a batch of
+    (story_id, text) pairs in one round trip. Returns
+    [(story_id, input_hash, stylometry, authorship, error)]; a story that
+    fails gets its error message instead of failing the whole batch.
+    """
+    results = []
+    for story_id, text in stories:
+        # Hash of the text actually analysed, so an edit made meanwhile
+        # still shows up as stale afterwards
+        input_hash = content_hash(text)
+        try:
+            results.append((story_id, input_hash, _stylometry_job(text), _authorship_job(text), None))
+        except Exception as exc:
+            # One line, however chatty the exception (NLTK's are a page long)
+            message = ' '.join(str(exc).replace('*', ' ').split())[:300]
+            results.append((story_id, input_hash, None, None, f'{type(exc).__name__}: {message}'))
+    return results
+
+
+def make_executor(workers, start_method='spawn'):
+    # spawn unless told otherwise: forking a threaded server process can
+    # copy held locks, and the workers don't need Django state anyway
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(start_method),
+        initializer=_init_worker,
+    )
+
+
+def _ping(_):
+    return os.getpid()
+
+
+class PoolBusy(Exception):
+    """Raised when the pool and its queue are full"""
+
+
+class AnalysisPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.in_flight = 0
+        self.rejected = 0
+
+    @property
+    def workers(self):
+        return getattr(settings, 'ANALYSIS_POOL_WORKERS', os.cpu_count() or 1)
+
+    @property
+    def queue_limit(self):
+        return getattr(settings, 'ANALYSIS_QUEUE_LIMIT', 32)
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = make_executor(self.workers)
+        return self.executor
+
+    def start(self, start_method='spawn'):
+        """
+        Create the executor and its processes now rather than on the first
+        job. With 'fork' call it before the process starts any threads.
+        """
+        workers = self.workers
+        if workers <= 0:
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = make_executor(workers, start_method)
+            executor = self.executor
+        # A ProcessPoolExecutor only starts its processes once work arrives
+        list(executor.map(_ping, range(workers)))
+
+    async def submit(self, func, text):
+        """Run ``func(text, submitted_at)`` on the pool and return its result"""
+        workers = self.workers
+        with self.lock:
+            if self.in_flight >= max(workers, 1) + self.queue_limit:
+                self.rejected += 1
+                raise PoolBusy()
+            self.in_flight += 1
+            if workers > 0:
+                executor = self.get_executor()
+        try:
+            loop = asyncio.get_running_loop()
+            if workers <= 0:
+                return await loop.run_in_executor(None, func, text, time.time())
+            return await loop.run_in_executor(executor, func, text, time.time())
+        except BrokenProcessPool:
+            self.discard(executor)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def submit_counted(self, executor, func, *args):
+        """
+        ``executor.submit(func, *args)``, counted as in flight until it ends:
+        for work sent straight to shared_executor() (background ingest)
+        """
+        with self.lock:
+            self.in_flight += 1
+        try:
+            future = executor.submit(func, *args)
+        except BaseException:
+            self._finished(None)
+            raise
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self.lock:
+            self.in_flight -= 1
+
+    def shared_executor(self):
+        """The pool's executor for callers outside submit() (None when running in-process)"""
+        with self.lock:
+            return self.get_executor() if self.workers > 0 else None
+
+    def discard(self, executor):
+        # A worker died (e.g. OOM killed); start a fresh pool next time
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+
+    def stats(self):
+        workers = self.workers
+        return {
+            'workers': workers,
+            'inFlight': self.in_flight,
+            'queued': max(0, self.in_flight - workers),
+            'queueLimit': self.queue_limit,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+pool = AnalysisPool()
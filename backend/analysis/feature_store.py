@@ -0,0 +1,238 @@
+"""
+Column-oriented, memory-mapped snapshot of every story's numeric features.
+
+Corpus-wide work (aggregates, similarity, model training, percentiles)
+otherwise re-queries StoryAnalysis / AuthorshipDetection and re-decodes
+their JSON for every row. ``manage.py build_feature_store`` writes one
+``.npy`` file per column instead - story ids, age group and source codes,
+the analysis metrics and the authorship features - into
+FEATURE_STORE_DIR. Readers np.load() them with mmap_mode='r', so every
+worker process shares the same pages from the OS cache and nothing is
+parsed.
+
+Each build writes a new generation directory and then switches the
+``CURRENT`` file to it, so readers never see half-written columns.
+Builds are incremental: the previous generation is kept except for
+stories that changed (story, analysis or authorship updated_at) or were
+deleted since it was built; only those rows are queried and decoded.
+"Since" reaches FEATURE_STORE_OVERLAP seconds further back, for writes
+whose transaction committed after the previous build had read the table
+(their updated_at is older than its built_at) and for clock skew between
+the app servers and the builder.
+Deleting just an analysis row (not the story) leaves no trace to notice,
+so it shows up after the next ``--full`` build.
+
+Reading::
+
+    snapshot = feature_store.load()
+    mask = snapshot.mask(age_group='7-12', source='AI')
+    grades = snapshot.column('flesch_kincaid_grade')[mask]
+    matrix = snapshot.matrix(['ttr', 'sentiment_score'])
+    features = snapshot.row(story_id)
+
+Stories without an analysis (or authorship row) have NaN in those columns.
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from stories.models import Story
+
+AGE_GROUPS = [code for code, _ in Story.AGE_CHOICES]
+SOURCES = [code for code, _ in Story.SOURCE_CHOICES]
+
+ANALYSIS_COLUMNS = [
+    'word_count', 'sentence_count', 'ttr', 'flesch_kincaid_grade', 'ari_score', 'sentiment_score',
+]
+AUTHORSHIP_FEATURES = [
+    'avg_word_length', 'avg_sentence_length', 'punctuation_ratio', 'repetition_score', 'complexity_score',
+]
+FLOAT_COLUMNS = ANALYSIS_COLUMNS + ['predicted_ai', 'confidence_score'] + AUTHORSHIP_FEATURES
+
+COLUMNS = {
+    'story_id': np.int64,
+    'age_group': np.int8,   # index into AGE_GROUPS, -1 if unknown
+    'source': np.int8,      # index into SOURCES, -1 if unknown
+    **{name: np.float32 for name in FLOAT_COLUMNS},
+}
+
+# Generations kept on disk: the current one, and the previous one for
+# readers that still have it open
+KEEP_GENERATIONS = 2
+
+
+def store_dir():
+    return Path(settings.FEATURE_STORE_DIR)
+
+
+def _code(choices, value):
+    return choices.index(value) if value in choices else -1
+
+
+def _fetch(queryset):
+    """Column arrays for the stories in ``queryset``"""
+    fields = [
+        'id', 'age_group', 'source',
+        *[f'analysis__{name}' for name in ANALYSIS_COLUMNS],
+        'authorship__predicted_source', 'authorship__confidence_score', 'authorship__features',
+    ]
+    columns = {name: [] for name in COLUMNS}
+    for story_id, age_group, source, *rest in queryset.order_by('id').values_list(*fields).iterator(chunk_size=2000):
+        analysis, (predicted, confidence, features) = rest[:len(ANALYSIS_COLUMNS)], rest[len(ANALYSIS_COLUMNS):]
+        columns['story_id'].append(story_id)
+        columns['age_group'].append(_code(AGE_GROUPS, age_group))
+        columns['source'].append(_code(SOURCES, source))
+        for name, value in zip(ANALYSIS_COLUMNS, analysis):
+            columns[name].append(np.nan if value is None else value)
+        columns['predicted_ai'].append(np.nan if predicted is None else float(predicted == 'AI'))
+        columns['confidence_score'].append(np.nan if confidence is None else confidence)
+        features = features if isinstance(features, dict) else {}
+        for name in AUTHORSHIP_FEATURES:
+            value = features.get(name)
+            columns[name].append(np.nan if value is None else value)
+    return {name: np.array(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+
+
+def _write_generation(columns, built_at, previous):
+    directory = store_dir()
+    generation = (previous.generation + 1) if previous else 1
+    target = directory / f'gen-{generation:06d}'
+    if target.exists():
+        shutil.rmtree(target)
+    target.mkdir(parents=True)
+    for name, array in columns.items():
+        np.save(target / f'{name}.npy', array)
+    (target / 'manifest.json').write_text(json.dumps({
+        'generation': generation,
+        'rows': int(len(columns['story_id'])),
+        'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+        'built_at': built_at.isoformat(),
+    }))
+    # Switch readers over in one step
+    pointer = directory / 'CURRENT.tmp'
+    pointer.write_text(target.name)
+    os.replace(pointer, directory / 'CURRENT')
+
+    for old in sorted(directory.glob('gen-*'))[:-KEEP_GENERATIONS]:
+        # Readers that still map these files keep them alive until closed
+        shutil.rmtree(old, ignore_errors=True)
+    return generation
+
+
+def build(full=False):
+    """
+    Write a new generation and return {'generation', 'rows', 'updated', 'removed'}.
+    Incremental unless ``full`` or there is nothing to start from.
+    """
+    # Taken before reading, so anything written during the build is picked
+    # up again next time
+    built_at = timezone.now()
+    previous = None if full else load()
+    if previous is not None and any(name not in previous.columns for name in COLUMNS):
+        previous = None  # built with an older column set
+
+    if previous is None:
+        columns = _fetch(Story.objects.all())
+        generation = _write_generation(columns, built_at, load())
+        return {'generation': generation, 'rows': len(columns['story_id']),
+                'updated': len(columns['story_id']), 'removed': 0}
+
+    since = previous.built_at - timedelta(seconds=getattr(settings, 'FEATURE_STORE_OVERLAP', 300))
+    changed = _fetch(Story.objects.filter(
+        Q(updated_at__gte=since) | Q(analysis__updated_at__gte=since) | Q(authorship__updated_at__gte=since)
+    ))
+    existing = np.fromiter(Story.objects.values_list('id', flat=True).iterator(chunk_size=10000), dtype=np.int64)
+    old_ids = np.asarray(previous.ids)
+    keep = np.isin(old_ids, existing) & ~np.isin(old_ids, changed['story_id'])
+    removed = int((~np.isin(old_ids, existing)).sum())
+
+    merged = {}
+    for name in COLUMNS:
+        merged[name] = np.concatenate([np.asarray(previous.columns[name])[keep], changed[name]])
+    order = np.argsort(merged['story_id'], kind='stable')
+    merged = {name: array[order] for name, array in merged.items()}
+    generation = _write_generation(merged, built_at, previous)
+    return {'generation': generation, 'rows': len(merged['story_id']),
+            'updated': len(changed['story_id']), 'removed': removed}
+
+
+class Snapshot:
+    """One generation of the store, every column memory mapped"""
+
+    def __init__(self, path):
+        self.path = path
+        manifest = json.loads((path / 'manifest.json').read_text())
+        self.generation = manifest['generation']
+        self.built_at = datetime.fromisoformat(manifest['built_at'])
+        self.columns = {
+            name: np.load(path / f'{name}.npy', mmap_mode='r')
+            for name in manifest['columns']
+        }
+        self.ids = self.columns['story_id']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def matrix(self, names):
+        """(rows, len(names)) float array of the given columns"""
+        return np.column_stack([self.columns[name] for name in names])
+
+    def mask(self, age_group=None, source=None):
+        """Boolean row mask for an age group and/or source"""
+        selected = np.ones(len(self), dtype=bool)
+        if age_group is not None:
+            selected &= self.columns['age_group'] == _code(AGE_GROUPS, age_group)
+        if source is not None:
+            selected &= self.columns['source'] == _code(SOURCES, source)
+        return selected
+
+    def index_of(self, story_id):
+        """Row of a story (ids are sorted), or None"""
+        position = int(np.searchsorted(self.ids, story_id))
+        if position < len(self.ids) and self.ids[position] == story_id:
+            return position
+        return None
+
+    def row(self, story_id):
+        """{column: value} for one story, or None"""
+        position = self.index_of(story_id)
+        if position is None:
+            return None
+        row = {name: self.columns[name][position].item() for name in FLOAT_COLUMNS if name in self.columns}
+        age_group, source = int(self.columns['age_group'][position]), int(self.columns['source'][position])
+        row['story_id'] = story_id
+        row['age_group'] = AGE_GROUPS[age_group] if age_group >= 0 else None
+        row['source'] = SOURCES[source] if source >= 0 else None
+        return row
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def load():
+    """The current snapshot (reopened when a build has switched generations), or None before the first build"""
+    global _current
+    try:
+        name = (store_dir() / 'CURRENT').read_text().strip()
+    except FileNotFoundError:
+        return None
+    path = store_dir() / name
+    with _lock:
+        if _current is None or _current.path != path:
+            try:
+                _current = Snapshot(path)
+            except FileNotFoundError:
+                return None
+        return _current
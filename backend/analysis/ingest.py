@@ -0,0 +1,267 @@
+"""
+Analyze-on-ingest.
+
+New stories used to arrive without a StoryAnalysis / AuthorshipDetection
+row, so whoever opened a story first paid for the NLP. analyze_stories()
+fills both in for a set of stories: the texts go to worker processes in
+batches (executor.analyze_batch does both analyses per story in one
+round trip) and each batch comes back as one bulk upsert.
+
+The same machinery keeps results current. Every row records the analyzer
+version (executor.STYLOMETRY_VERSION / AUTHORSHIP_VERSION) and the hash
+of the text it was computed from; a row is stale when either no longer
+matches, and stale_story_ids() finds those in one query. So after
+changing analysis.py (and bumping the version) or editing stories,
+``manage.py analyze_stories`` only redoes what is out of date.
+
+load_stories runs it as a stage after loading. Every other way a story
+gets created is covered by the post_save hook below, which runs once the
+creating transaction commits and is controlled by ANALYZE_ON_INGEST:
+
+- ``background``: queued for a daemon thread in this process, so the
+  request that created the story doesn't wait for the analysis
+- ``sync``: analysed right away, before the commit returns
+- ``off``: left to the analysis endpoints and ``manage.py analyze_stories``
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+
+from beyond_words.metrics import registry
+from stories.dedup import backfill_content_hashes
+from stories.models import AuthorshipDetection, Story, StoryAnalysis
+from .executor import AUTHORSHIP_VERSION, STYLOMETRY_VERSION, analyze_batch, make_executor, pool
+
+logger = logging.getLogger(__name__)
+
+MODES = ('background', 'sync', 'off')
+
+ANALYSIS_FIELDS = [
+    'word_count', 'sentence_count', 'ttr', 'flesch_kincaid_grade', 'ari_score',
+    'sentiment_label', 'sentiment_score', 'pos_distribution',
+    'analyzer_version', 'input_hash', 'updated_at',
+]
+AUTHORSHIP_FIELDS = [
+    'predicted_source', 'confidence_score', 'features',
+    'analyzer_version', 'input_hash', 'updated_at',
+]
+
+_hook_suppressed = ContextVar('ingest_hook_suppressed', default=False)
+
+
+STALE_REASONS = {
+    'missing': lambda: Q(analysis__isnull=True) | Q(authorship__isnull=True),
+    'old_version': lambda: (
+        ~Q(analysis__analyzer_version=STYLOMETRY_VERSION) | ~Q(authorship__analyzer_version=AUTHORSHIP_VERSION)
+    ),
+    'text_changed': lambda: (
+        ~Q(analysis__input_hash=F('content_hash')) | ~Q(authorship__input_hash=F('content_hash'))
+    ),
+}
+
+
+def stale_filter():
+    """Stories missing either result row, or with one from older code or older text"""
+    condition = Q()
+    for reason in STALE_REASONS.values():
+        condition |= reason()
+    return condition
+
+
+def stale_counts():
+    """How many stories are stale for each reason (a story can count for several)"""
+    return {name: Story.objects.filter(reason()).count() for name, reason in STALE_REASONS.items()}
+
+
+def stale_story_ids(story_ids=None):
+    """Ids of stories whose results are missing or stale, optionally limited to ``story_ids``"""
+    stories = Story.objects.filter(stale_filter())
+    if story_ids is not None:
+        stories = stories.filter(id__in=story_ids)
+    return list(stories.order_by('id').values_list('id', flat=True))
+
+
+def _texts(story_ids):
+    return list(Story.objects.filter(id__in=story_ids).values_list('id', 'story'))
+
+
+def save_results(results):
+    """Upsert the rows for one analyze_batch() result; returns the failures"""
+    analyses, authorships, failed = [], [], []
+    for story_id, input_hash, stylometry, authorship, error in results:
+        if error:
+            failed.append((story_id, error))
+            continue
+        analyses.append(StoryAnalysis(
+            story_id=story_id, analyzer_version=STYLOMETRY_VERSION, input_hash=input_hash, **stylometry,
+        ))
+        authorships.append(AuthorshipDetection(
+            story_id=story_id,
+            predicted_source=authorship['prediction'],
+            confidence_score=authorship['confidence'],
+            features=authorship['features'],
+            analyzer_version=AUTHORSHIP_VERSION,
+            input_hash=input_hash,
+        ))
+    if analyses:
+        with transaction.atomic():
+            StoryAnalysis.objects.bulk_create(
+                analyses, update_conflicts=True, unique_fields=['story'], update_fields=ANALYSIS_FIELDS,
+            )
+            AuthorshipDetection.objects.bulk_create(
+                authorships, update_conflicts=True, unique_fields=['story'], update_fields=AUTHORSHIP_FIELDS,
+            )
+    registry.inc('analysis_ingest_total', len(analyses), result='analyzed')
+    if failed:
+        registry.inc('analysis_ingest_total', len(failed), result='failed')
+    return failed
+
+
+def analyze_stories(story_ids=None, workers=None, batch_size=None, executor=None, only_stale=True):
+    """
+    Analyse ``story_ids`` (default: every story with missing or stale
+    results) in parallel batches and store the results. With
+    ``only_stale`` off the given stories are redone regardless.
+
+    Batches run on ``executor`` when one is given, otherwise on a process
+    pool of ``workers`` (default ANALYSIS_POOL_WORKERS) that lives for
+    this call. With no workers, or only one batch, they run in this
+    process. Only a few batches are in flight at a time, so memory stays
+    flat however many stories there are.
+
+    Returns {'analyzed': count, 'failed': [(story_id, error)]}.
+    """
+    # Stories that were bulk created have no hash yet to compare against
+    backfill_content_hashes()
+    ids = stale_story_ids(story_ids) if only_stale else sorted(story_ids)
+    batch_size = batch_size or settings.ANALYZE_ON_INGEST_BATCH_SIZE
+    batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+    workers = pool.workers if workers is None else workers
+    summary = {'analyzed': 0, 'failed': []}
+
+    def record(results):
+        failed = save_results(results)
+        summary['analyzed'] += len(results) - len(failed)
+        summary['failed'].extend(failed)
+
+    if executor is None and (workers <= 0 or len(batches) <= 1):
+        for batch in batches:
+            record(analyze_batch(_texts(batch)))
+        return summary
+
+    own_executor = executor is None
+    if own_executor:
+        executor = make_executor(min(workers, len(batches)))
+    try:
+        in_flight = set()
+        for batch in batches:
+            if len(in_flight) >= 2 * max(workers, 1):
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future.result())
+            if own_executor:
+                future = executor.submit(analyze_batch, _texts(batch))
+            else:
+                # The endpoints' pool: count the batch against their queue limit
+                future = pool.submit_counted(executor, analyze_batch, _texts(batch))
+            in_flight.add(future)
+        for future in wait(in_flight).done:
+            record(future.result())
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return summary
+
+
+class IngestQueue:
+    """Daemon thread that analyses newly created stories in batches"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, story_ids):
+        for story_id in story_ids:
+            self.queue.put(story_id)
+        with self.lock:
+            # Started lazily, so gunicorn workers forked from a preloaded
+            # master each get their own thread
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='analysis-ingest', daemon=True)
+                self.thread.start()
+
+    def join(self):
+        """Wait until everything queued so far has been processed"""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            story_ids = [self.queue.get()]
+            # Whatever else arrived meanwhile goes into the same batch
+            while len(story_ids) < settings.ANALYZE_ON_INGEST_BATCH_SIZE:
+                try:
+                    story_ids.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._process(story_ids)
+
+    def _process(self, story_ids):
+        executor = None
+        try:
+            # Shares the analysis endpoints' worker processes
+            executor = pool.shared_executor()
+            summary = analyze_stories(story_ids, executor=executor)
+            for story_id, error in summary['failed']:
+                logger.warning('Analysis of story %s failed: %s', story_id, error)
+        except BrokenProcessPool:
+            pool.discard(executor)
+            logger.exception('Analysis pool broke while analysing stories %s', story_ids)
+        except Exception:
+            logger.exception('Could not analyse stories %s', story_ids)
+        finally:
+            # This thread's own connection; don't keep it open between batches
+            connection.close()
+            for _ in story_ids:
+                self.queue.task_done()
+
+
+ingest_queue = IngestQueue()
+
+
+def schedule(story_ids, mode=None):
+    """Analyse ``story_ids`` the way ANALYZE_ON_INGEST (or ``mode``) says"""
+    mode = mode or settings.ANALYZE_ON_INGEST
+    if mode == 'sync':
+        analyze_stories(story_ids)
+    elif mode == 'background':
+        ingest_queue.put(story_ids)
+
+
+@contextmanager
+def batch_ingest():
+    """
+    Switch the per-story hook off, for code that creates many stories and
+    then analyses them as one batch (load_stories)
+    """
+    token = _hook_suppressed.set(True)
+    try:
+        yield
+    finally:
+        _hook_suppressed.reset(token)
+
+
+def story_created(sender, instance, created, raw=False, using=None, **kwargs):
+    """post_save hook for Story (connected in AnalysisConfig.ready)"""
+    if not created or raw or _hook_suppressed.get() or settings.ANALYZE_ON_INGEST == 'off':
+        return
+    story_id = instance.pk
+    transaction.on_commit(lambda: schedule([story_id]), using=using)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from analysis.ingest import analyze_stories, stale_counts, stale_story_ids
+from stories.dedup import backfill_content_hashes
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = ('Compute the analysis and authorship prediction of stories that have none yet, '
+            'or whose results came from an older analyzer version or an older text')
+
+    def add_arguments(self, parser):
+        parser.add_argument('story_ids', nargs='*', type=int, help='Only these stories (default: all)')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute current results too')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many stories are stale and why')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default ANALYSIS_POOL_WORKERS, 0 = in this process)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Stories sent to a worker at once (default ANALYZE_ON_INGEST_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        story_ids = options['story_ids'] or None
+
+        if options['dry_run']:
+            backfill_content_hashes()
+            counts = ', '.join(f'{count} {reason}' for reason, count in stale_counts().items())
+            self.stdout.write(f'{len(stale_story_ids(story_ids))} stale stories ({counts})')
+            return
+
+        if options['all'] and story_ids is None:
+            story_ids = list(Story.objects.values_list('id', flat=True))
+
+        summary = analyze_stories(
+            story_ids,
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            only_stale=not options['all'],
+        )
+        for story_id, error in summary['failed']:
+            self.stdout.write(self.style.WARNING(f'Story {story_id} failed: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Analysed {summary['analyzed']} stories ({len(summary['failed'])} failed)"
+        ))
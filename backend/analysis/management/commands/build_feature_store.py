@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from analysis import feature_store
+
+
+class Command(BaseCommand):
+    help = 'Write the memory-mapped feature columns for every story, reusing the previous build where nothing changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild from scratch instead of updating the last build')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = feature_store.build(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Generation {result['generation']}: {result['rows']} stories, "
+            f"{result['updated']} updated, {result['removed']} removed "
+            f"in {time.perf_counter() - started:.2f}s ({feature_store.store_dir()})"
+        ))
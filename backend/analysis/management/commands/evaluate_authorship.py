@@ -0,0 +1,139 @@
+import json
+import multiprocessing
+import os
+import subprocess
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sklearn.model_selection import StratifiedKFold
+
+from analysis import evaluation
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = ('Stratified k-fold cross-validation of the authorship detectors over the labelled stories, '
+            'reporting accuracy, precision/recall, calibration and per-document latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folds', type=int, default=5, help='Number of folds')
+        parser.add_argument('--methods', default='viewset,logistic',
+                            help=f"Comma separated, from {', '.join(evaluation.METHODS)} "
+                                 '(analyzer needs NLTK data)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default: one per job up to the CPU count, 0 = in this process)')
+        parser.add_argument('--seed', type=int, default=42, help='Seed for the fold shuffle')
+        parser.add_argument('--age-group', choices=[code for code, _ in Story.AGE_CHOICES],
+                            help='Only stories of this age group')
+        parser.add_argument('--json', dest='json_path', help='Write the report to this file')
+        parser.add_argument('--append', dest='append_path',
+                            help='Append the report as one line to this JSONL file, for tracking trends')
+
+    def handle(self, *args, **options):
+        methods = [name.strip() for name in options['methods'].split(',') if name.strip()]
+        unknown = [name for name in methods if name not in evaluation.METHODS]
+        if unknown or not methods:
+            raise CommandError(f"Unknown method(s): {', '.join(unknown) or '(none)'}. "
+                               f"Choose from {', '.join(evaluation.METHODS)}")
+
+        stories = Story.objects.filter(source__in=['AI', 'Human']).order_by('id')
+        if options['age_group']:
+            stories = stories.filter(age_group=options['age_group'])
+        texts, labels = [], []
+        for text, source in stories.values_list('story', 'source').iterator(chunk_size=500):
+            texts.append(text)
+            labels.append(source)
+
+        folds = options['folds']
+        counts = Counter(labels)
+        if folds < 2:
+            raise CommandError('--folds must be at least 2')
+        if len(counts) < 2 or min(counts.values()) < folds:
+            raise CommandError(f'Need at least {folds} AI and {folds} Human stories, found '
+                               f"{counts['AI']} AI and {counts['Human']} Human")
+
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=options['seed'])
+        jobs = []
+        for fold, (train, test) in enumerate(splitter.split(texts, labels)):
+            for method in methods:
+                jobs.append((
+                    method, fold,
+                    [texts[i] for i in train], [labels[i] for i in train],
+                    [texts[i] for i in test], [labels[i] for i in test],
+                ))
+
+        workers = options['workers']
+        if workers is None:
+            workers = min(len(jobs), os.cpu_count() or 1)
+        started = time.perf_counter()
+        if workers <= 0:
+            results = [evaluation.run_fold(*job) for job in jobs]
+        else:
+            # spawn, like the analysis pool: the jobs don't need Django
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = list(pool.map(evaluation.run_fold, *zip(*jobs)))
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'commit': self.git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'folds': folds,
+            'seed': options['seed'],
+            'workers': workers,
+            'age_group': options['age_group'],
+            'stories': {'total': len(labels), 'AI': counts['AI'], 'Human': counts['Human']},
+            'duration_s': round(elapsed, 2),
+            # Held-out predictions per second across all workers, fitting included
+            'docs_per_second': round(len(labels) * len(methods) / elapsed, 1) if elapsed > 0 else None,
+            'methods': evaluation.summarize(results),
+        }
+        self.print_report(report)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Report written to {options['json_path']}")
+        if options['append_path']:
+            with open(options['append_path'], 'a') as file:
+                file.write(json.dumps(report) + '\n')
+            self.stdout.write(f"Report appended to {options['append_path']}")
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_report(self, report):
+        stories = report['stories']
+        self.stdout.write(
+            f"{stories['total']} stories ({stories['AI']} AI, {stories['Human']} Human), "
+            f"{report['folds']} folds, {report['workers']} workers, {report['duration_s']}s"
+        )
+        header = (f"{'method':<10}{'accuracy':>16}{'prec AI':>9}{'rec AI':>8}{'prec H':>8}{'rec H':>7}"
+                  f"{'brier':>8}{'ECE':>7}{'p50 ms':>9}{'p95 ms':>9}{'docs/s':>9}")
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for method, result in report['methods'].items():
+            if 'error' in result:
+                self.stdout.write(self.style.ERROR(f"{method:<10}failed: {result['error']}"))
+                continue
+            pooled, latency = result['pooled'], result['latency']
+
+            def cell(value, width):
+                return f'{value:>{width}.3f}' if value is not None else f"{'-':>{width}}"
+
+            accuracy = f"{result['accuracy_mean']:.3f} ± {result['accuracy_std']:.3f}"
+            self.stdout.write(
+                f"{method:<10}{accuracy:>16}{cell(pooled['precision_ai'], 9)}{cell(pooled['recall_ai'], 8)}"
+                f"{cell(pooled['precision_human'], 8)}{cell(pooled['recall_human'], 7)}"
+                f"{cell(pooled['brier'], 8)}{cell(pooled['ece'], 7)}"
+                f"{cell(latency['p50_ms'], 9)}{cell(latency['p95_ms'], 9)}{latency['docs_per_second']:>9}"
+            )
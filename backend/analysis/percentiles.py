@@ -0,0 +1,150 @@
+"""
+Percentile ranks of a story's metrics within its age group.
+
+Every process keeps, per (age_group, source), one sorted NumPy array per
+metric, built from StoryAnalysis. A story's rank is then a binary search
+(np.searchsorted) per metric - microseconds, no queries.
+
+The arrays are brought up to date at most every
+PERCENTILE_REFRESH_SECONDS. A refresh is one aggregate query plus the
+rows (analysis or story) updated since the newest one already seen, minus
+PERCENTILE_REFRESH_OVERLAP seconds for transactions that committed late;
+only the groups those rows belong to are re-sorted. Deleted
+rows show up as a count mismatch and trigger a full rebuild. A story the
+arrays don't know yet forces a refresh, but only once a single indexed
+lookup has shown it actually has an analysis.
+"""
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Q
+
+from stories.models import StoryAnalysis
+
+METRICS = [
+    'flesch_kincaid_grade', 'ari_score', 'ttr', 'sentiment_score', 'word_count', 'sentence_count',
+]
+
+# Group key for "same age group, any source"
+ALL_SOURCES = '*'
+
+
+class PercentileIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}    # story_id -> (age_group, source, metric values)
+        self.members = {}   # group key -> story ids
+        self.groups = {}    # group key -> array (len(METRICS), n), each row sorted
+        self.watermark = None
+        self.checked_at = None
+
+    @property
+    def refresh_seconds(self):
+        return getattr(settings, 'PERCENTILE_REFRESH_SECONDS', 60)
+
+    @property
+    def overlap(self):
+        return getattr(settings, 'PERCENTILE_REFRESH_OVERLAP', 300)
+
+    def refresh(self, force=False):
+        if not force and self.checked_at is not None and time.monotonic() - self.checked_at < self.refresh_seconds:
+            return
+        with self.lock:
+            # Someone else may have refreshed while we waited
+            if not force and self.checked_at is not None and time.monotonic() - self.checked_at < self.refresh_seconds:
+                return
+            state = StoryAnalysis.objects.aggregate(
+                count=Count('id'), analysis=Max('updated_at'), story=Max('story__updated_at'),
+            )
+            latest = max(filter(None, [state['analysis'], state['story']]), default=None)
+            if self.watermark is None:
+                self._load(StoryAnalysis.objects.all(), latest)
+            elif latest is not None and (latest > self.watermark or self.overlap):
+                # A late commit doesn't move Max(updated_at), so the overlap
+                # window is re-read even when nothing looks newer
+                since = self.watermark - timedelta(seconds=self.overlap)
+                changed = StoryAnalysis.objects.filter(
+                    Q(updated_at__gte=since) | Q(story__updated_at__gte=since)
+                )
+                self._apply(changed, max(latest, self.watermark))
+            if len(self.values) != state['count']:
+                # Rows were deleted: start over
+                self.values, self.members, self.groups = {}, {}, {}
+                self._load(StoryAnalysis.objects.all(), latest)
+            self.checked_at = time.monotonic()
+
+    def _rows(self, queryset):
+        return queryset.values_list('story_id', 'story__age_group', 'story__source', *METRICS).iterator(chunk_size=2000)
+
+    def _load(self, queryset, latest):
+        self._apply(queryset, latest, rebuild_all=True)
+
+    def _apply(self, queryset, latest, rebuild_all=False):
+        dirty = set()
+        for story_id, age_group, source, *metrics in self._rows(queryset):
+            previous = self.values.get(story_id)
+            if previous is not None:
+                for key in ((previous[0], previous[1]), (previous[0], ALL_SOURCES)):
+                    self.members[key].discard(story_id)
+                    dirty.add(key)
+            self.values[story_id] = (age_group, source, np.array(metrics, dtype=float))
+            for key in ((age_group, source), (age_group, ALL_SOURCES)):
+                self.members.setdefault(key, set()).add(story_id)
+                dirty.add(key)
+        for key in (set(self.members) if rebuild_all else dirty):
+            self._sort_group(key)
+        self.watermark = latest
+
+    def _sort_group(self, key):
+        story_ids = self.members.get(key)
+        if not story_ids:
+            self.members.pop(key, None)
+            self.groups.pop(key, None)
+            return
+        matrix = np.array([self.values[story_id][2] for story_id in story_ids])
+        # Swapped in whole, so readers never see a half-built array
+        self.groups[key] = np.sort(matrix.T, axis=1)
+
+    def ranks(self, story_id, all_sources=False):
+        """
+        {'age_group', 'source', 'group_size', 'metrics': {name: {'value', 'percentile'}}}
+        or None when the story has no analysis
+        """
+        self.refresh()
+        entry = self.values.get(story_id)
+        if entry is None:
+            # Maybe analysed since the last refresh. Check before paying for a
+            # forced refresh, or every request for an unknown id would cost one
+            if not StoryAnalysis.objects.filter(story_id=story_id).exists():
+                return None
+            self.refresh(force=True)
+            entry = self.values.get(story_id)
+            if entry is None:
+                return None
+
+        age_group, source, row = entry
+        columns = self.groups.get((age_group, ALL_SOURCES if all_sources else source))
+        if columns is None:
+            return None  # caught in the middle of a full rebuild
+        size = columns.shape[1]
+        metrics = {}
+        for column, name, value in zip(columns, METRICS, row):
+            below = np.searchsorted(column, value, side='left')
+            up_to = np.searchsorted(column, value, side='right')
+            # Ties count half, so a corpus of identical values ranks 50
+            metrics[name] = {
+                'value': float(value),
+                'percentile': round(100 * (below + (up_to - below) / 2) / size, 1),
+            }
+        return {
+            'age_group': age_group,
+            'source': ALL_SOURCES if all_sources else source,
+            'group_size': size,
+            'metrics': metrics,
+        }
+
+
+percentile_index = PercentileIndex()
@@ -0,0 +1,127 @@
+"""
+Sentiment arc: how sentiment moves through a story, sentence by sentence.
+
+Scoring every sentence with VADER's polarity_scores() would re-tokenise
+each sentence and walk its rule set word by word. Here the story is
+tokenised once - a single regex pass yields the words and, from the
+sentence punctuation between them, which sentence each word belongs to -
+and valences come from VADER's lexicon, looked up once per distinct word
+through a cache shared by all stories. Sentence totals are then a single
+np.bincount, and windowing and smoothing are array operations on those.
+
+It keeps the parts of VADER that matter at sentence level (lexicon
+valence, negation in the three words before, the compound normalisation)
+and leaves out the finer rules (capitals, boosters, "but", punctuation
+emphasis), so scores track polarity_scores() closely without matching it
+exactly. The per-sentence scores are stored in SentimentArc; later
+requests only redo the cheap windowing and smoothing.
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# Bump when the scoring below changes; stored arcs from older code are redone
+SENTIMENT_ARC_VERSION = 1
+
+# VADER's compound normalisation constant and negation scalar
+ALPHA = 15
+NEGATION_SCALAR = -0.74
+NEGATION_REACH = 3
+
+DEFAULT_POINTS = 20
+MAX_POINTS = 200
+
+_token_re = re.compile(r"[\w']+|[.!?]+")
+
+
+@lru_cache(maxsize=None)
+def _lexicon():
+    # Imported lazily, like the analyzers in executor.py
+    from vaderSentiment.vaderSentiment import NEGATE, SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer().lexicon, frozenset(NEGATE)
+
+
+@lru_cache(maxsize=65536)
+def _word_score(word):
+    """(valence, is a negation) for one lower-cased word"""
+    lexicon, negations = _lexicon()
+    return lexicon.get(word, 0.0), word in negations or "n't" in word
+
+
+def tokenize(text):
+    """Words, the sentence index of each word, and the character offset each sentence starts at"""
+    words, sentence_ids, starts = [], [], []
+    sentence, in_sentence = 0, False
+    for match in _token_re.finditer(text):
+        token = match.group()
+        if token[0] in '.!?':
+            if in_sentence:
+                sentence += 1
+                in_sentence = False
+            continue
+        if not in_sentence:
+            starts.append(match.start())
+            in_sentence = True
+        words.append(token.lower())
+        sentence_ids.append(sentence)
+    return words, np.array(sentence_ids, dtype=np.intp), starts
+
+
+def sentence_scores(text):
+    """Compound score (-1..1) of every sentence, and where each sentence starts"""
+    words, sentence_ids, starts = tokenize(text)
+    if not words:
+        return [], []
+
+    # Each distinct word is looked up once
+    vocabulary = {}
+    word_ids = np.fromiter((vocabulary.setdefault(word, len(vocabulary)) for word in words),
+                           dtype=np.intp, count=len(words))
+    table = np.array([_word_score(word) for word in vocabulary], dtype=float).reshape(-1, 2)
+    valence = table[word_ids, 0]
+    negation = table[word_ids, 1].astype(bool)
+
+    # A negation up to NEGATION_REACH words earlier in the same sentence
+    # flips and damps the valence
+    negated = np.zeros(len(words), dtype=bool)
+    for shift in range(1, NEGATION_REACH + 1):
+        negated[shift:] |= negation[:-shift] & (sentence_ids[shift:] == sentence_ids[:-shift])
+    valence = np.where(negated, valence * NEGATION_SCALAR, valence)
+
+    totals = np.bincount(sentence_ids, weights=valence, minlength=len(starts))
+    compound = totals / np.sqrt(totals * totals + ALPHA)
+    return np.round(compound, 4).tolist(), starts
+
+
+def windowed(scores, starts, window):
+    """Mean score of each run of ``window`` sentences, as chart points"""
+    scores = np.asarray(scores, dtype=float)
+    firsts = np.arange(0, len(scores), window)
+    if not len(firsts):
+        return []
+    sizes = np.diff(np.append(firsts, len(scores)))
+    means = np.add.reduceat(scores, firsts) / sizes
+    return [
+        {'sentence': int(first), 'offset': starts[first], 'score': round(float(mean), 4)}
+        for first, mean in zip(firsts, means)
+    ]
+
+
+def smoothed(values, points=DEFAULT_POINTS):
+    """
+    Moving average over roughly a tenth of the series, resampled to
+    ``points`` evenly spaced positions (0 = start of the story, 1 = end)
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return []
+    width = max(1, len(values) // 10) | 1  # odd, so the average is centred
+    padded = np.pad(values, width // 2, mode='edge')
+    average = np.convolve(padded, np.ones(width) / width, mode='valid')
+    source = np.linspace(0, 1, len(average)) if len(average) > 1 else np.zeros(1)
+    positions = np.linspace(0, 1, points)
+    return [
+        {'position': round(float(position), 4), 'score': round(float(score), 4)}
+        for position, score in zip(positions, np.interp(positions, source, average))
+    ]
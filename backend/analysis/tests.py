@@ -1,3 +1,625 @@
-from django.test import TestCase
+"""
+Tests for the analysis routes and the machinery behind them: access and
+rate limits, ingest, percentiles, the feature store, vocabulary and
+evaluation. Route query counts are checked against a small and a large
+dataset. The NLP itself is replaced with canned results (it needs NLTK
+data and is slow); what is checked is the work around it.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.authentication import user_cache
+from authentication.models import CustomUser
+from stories.models import AuthorshipDetection, SentimentArc, Story, StoryAnalysis, StoryTerms, Term
+from stories.tests import LARGE_DATASET, SMALL_DATASET, seed_stories
+from . import evaluation, executor, feature_store, ingest, percentiles, sentiment_arc, views, vocabulary
+
+
+class FakeStylometricAnalyzer:
+    def analyze_text(self, text):
+        return {
+            'word_count': 3, 'sentence_count': 1, 'ttr': 1.0, 'flesch_kincaid_grade': 2.0,
+            'ari_score': 1.0, 'sentiment_label': 'neutral', 'sentiment_score': 0.0,
+            'pos_distribution': [],
+        }
+
+
+class FakeAuthorshipDetector:
+    def predict_authorship(self, text):
+        return {'prediction': 'AI', 'confidence': 0.8, 'features': {'avg_word_length': 4.0}}
+
+
+def use_fake_analyzers(test):
+    """Canned analyzers, run on a thread instead of a spawned pool"""
+    inline = override_settings(ANALYSIS_POOL_WORKERS=0)
+    inline.enable()
+    test.addCleanup(inline.disable)
+    patcher = mock.patch.dict(executor._analyzers, {
+        'stylometry': FakeStylometricAnalyzer(),
+        'authorship': FakeAuthorshipDetector(),
+    })
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def log_in(test):
+    """
+    Send a JWT for a fresh user with every request. The user is put in the
+    JWT user cache up front, so query counts only show the route's own work.
+    """
+    user = CustomUser.objects.create_user(username=f'reader-{CustomUser.objects.count()}', email='reader@example.com', password='pw')
+    token = RefreshToken.for_user(user).access_token
+    user_cache.set(user.pk, token['jti'], user, 300)
+    test.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return user
+
+
+class AnalysisRouteQueries:
+    dataset_size = SMALL_DATASET
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.story_ids = seed_stories(cls.dataset_size)
+
+    def setUp(self):
+        use_fake_analyzers(self)
+        log_in(self)
+
+    def test_root(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/analysis/').status_code, 200)
+
+    def test_detailed_analysis(self):
+        # A current stored row is served as is: one query for the story and its analysis
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/analysis/detailed/{self.story_ids[0]}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['cached'])
+        self.assertEqual(response.json()['analysis']['word_count'], 160)
+
+        # Stale (other text): story lookup + update_or_create (savepoint, select, update, release)
+        StoryAnalysis.objects.filter(story_id=self.story_ids[0]).update(input_hash='')
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/analysis/detailed/{self.story_ids[0]}/')
+        self.assertFalse(response.json()['cached'])
+        self.assertEqual(StoryAnalysis.objects.get(story_id=self.story_ids[0]).word_count, 3)
+
+    def test_authorship_detection(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/analysis/authorship/{self.story_ids[0]}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['confidence'], 0.7)
+
+        # Stale (older analyzer version)
+        AuthorshipDetection.objects.filter(story_id=self.story_ids[0]).update(analyzer_version=0)
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/analysis/authorship/{self.story_ids[0]}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AuthorshipDetection.objects.get(story_id=self.story_ids[0]).confidence_score, 0.8)
+
+    def test_missing_story(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/analysis/detailed/999999/').status_code, 404)
+
+    def test_busy_pool_is_rejected_before_any_work(self):
+        StoryAnalysis.objects.filter(story_id=self.story_ids[0]).update(input_hash='')
+        with mock.patch.object(executor.pool, 'in_flight', 10 ** 6):
+            response = self.client.get(f'/api/analysis/detailed/{self.story_ids[0]}/')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+
+class SmallDatasetAnalysisQueryTests(AnalysisRouteQueries, TestCase):
+    dataset_size = SMALL_DATASET
+
+
+class LargeDatasetAnalysisQueryTests(AnalysisRouteQueries, TestCase):
+    dataset_size = LARGE_DATASET
+
+
+class AnalysisAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.story_id = seed_stories(1)[0]
+
+    def setUp(self):
+        cache.clear()
+        use_fake_analyzers(self)
+
+    def test_login_required(self):
+        for route in ('detailed', 'authorship', 'sentiment-arc', 'percentiles', 'keywords'):
+            with self.subTest(route=route), self.assertNumQueries(0):
+                self.assertEqual(self.client.get(f'/api/analysis/{route}/{self.story_id}/').status_code, 401)
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer not-a-token'
+        self.assertEqual(self.client.get(f'/api/analysis/detailed/{self.story_id}/').status_code, 401)
+        self.assertFalse(StoryAnalysis.objects.filter(story_id=self.story_id, word_count=3).exists())
+
+    def test_session_login_works_too(self):
+        self.client.force_login(CustomUser.objects.create_user(username='reader', email='reader@example.com', password='pw'))
+        self.assertEqual(self.client.get(f'/api/analysis/detailed/{self.story_id}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/analysis/sentiment-arc/{self.story_id}/').status_code, 200)
+
+    @override_settings(ANALYSIS_RATE_LIMIT=2)
+    def test_rate_limit_per_user(self):
+        log_in(self)
+        url = f'/api/analysis/authorship/{self.story_id}/'
+        self.assertEqual([self.client.get(url).status_code for _ in range(2)], [200, 200])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        # Someone else still gets through
+        log_in(self)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+def new_story(title, text='The little fox ran home through the forest.', source='AI'):
+    return Story.objects.create(title=title, story=text, source=source, age_group='7-12')
+
+
+@override_settings(ANALYZE_ON_INGEST_BATCH_SIZE=2)
+class IngestTests(TestCase):
+    def setUp(self):
+        use_fake_analyzers(self)
+
+    def test_only_stories_without_analysis_are_analyzed(self):
+        analysed = seed_stories(2)
+        with ingest.batch_ingest():
+            fresh = [new_story(f'New {i}').id for i in range(3)]
+        self.assertEqual(ingest.stale_story_ids(), fresh)
+
+        # Hash backfill and stale ids, then per batch of two: the texts and
+        # a transaction with both upserts
+        with self.assertNumQueries(2 + 2 * 5):
+            summary = ingest.analyze_stories()
+        self.assertEqual(summary, {'analyzed': 3, 'failed': []})
+        self.assertEqual(ingest.stale_story_ids(), [])
+        self.assertEqual(StoryAnalysis.objects.get(story_id=fresh[0]).word_count, 3)
+        self.assertEqual(AuthorshipDetection.objects.get(story_id=fresh[0]).confidence_score, 0.8)
+        # Existing rows are left alone
+        self.assertEqual(StoryAnalysis.objects.get(story_id=analysed[0]).word_count, 160)
+
+    def test_recompute_updates_existing_rows(self):
+        story_ids = seed_stories(2)
+        summary = ingest.analyze_stories(story_ids, only_stale=False)
+        self.assertEqual(summary['analyzed'], 2)
+        self.assertEqual(StoryAnalysis.objects.filter(word_count=3).count(), 2)
+        self.assertEqual(StoryAnalysis.objects.count(), 2)
+
+    def test_only_stale_rows_are_recomputed(self):
+        current, old_version, edited, bulk_created = seed_stories(4)
+        StoryAnalysis.objects.filter(story_id=old_version).update(analyzer_version=0)
+        story = Story.objects.get(id=edited)
+        story.story += ' The end.'
+        story.save()
+        # bulk_create skips save(), so this one has no hash until the backfill
+        Story.objects.filter(id=bulk_created).update(content_hash='')
+
+        summary = ingest.analyze_stories()
+        self.assertEqual(summary['analyzed'], 2)
+        rows = dict(StoryAnalysis.objects.values_list('story_id', 'word_count'))
+        self.assertEqual(rows, {current: 160, old_version: 3, edited: 3, bulk_created: 160})
+        self.assertEqual(ingest.stale_story_ids(), [])
+        self.assertEqual(ingest.stale_counts(), {'missing': 0, 'old_version': 0, 'text_changed': 0})
+        analysis = StoryAnalysis.objects.get(story_id=edited)
+        self.assertEqual(analysis.analyzer_version, executor.STYLOMETRY_VERSION)
+        self.assertEqual(analysis.input_hash, Story.objects.get(id=edited).content_hash)
+
+    def test_failures_are_reported_per_story(self):
+        with ingest.batch_ingest():
+            good, bad = new_story('Good').id, new_story('Bad', 'broken').id
+
+        def analyze_text(text):
+            if text == 'broken':
+                raise LookupError('punkt not found')
+            return FakeStylometricAnalyzer().analyze_text(text)
+
+        with mock.patch.object(executor._analyzers['stylometry'], 'analyze_text', analyze_text):
+            summary = ingest.analyze_stories()
+        self.assertEqual(summary['analyzed'], 1)
+        self.assertEqual(summary['failed'], [(bad, 'LookupError: punkt not found')])
+        self.assertEqual(ingest.stale_story_ids(), [bad])
+        self.assertTrue(StoryAnalysis.objects.filter(story_id=good).exists())
+
+    def test_shared_executor_jobs_count_as_in_flight(self):
+        with ingest.batch_ingest():
+            story_ids = [new_story(f'New {i}').id for i in range(3)]
+        seen = []
+
+        def analyze_batch(stories):
+            seen.append(executor.pool.in_flight)
+            return real_batch(stories)
+
+        real_batch = ingest.analyze_batch
+        before = executor.pool.in_flight
+        with ThreadPoolExecutor(max_workers=1) as shared, \
+                mock.patch.object(ingest, 'analyze_batch', analyze_batch):
+            summary = ingest.analyze_stories(story_ids, executor=shared, workers=1)
+        self.assertEqual(summary['analyzed'], 3)
+        # Background batches take up room in the endpoints' queue while they run
+        self.assertTrue(all(count > before for count in seen))
+        self.assertEqual(executor.pool.in_flight, before)
+
+    @override_settings(ANALYZE_ON_INGEST='sync')
+    def test_new_story_is_analyzed_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            story = new_story('Fresh')
+        self.assertTrue(StoryAnalysis.objects.filter(story=story).exists())
+        self.assertTrue(AuthorshipDetection.objects.filter(story=story).exists())
+
+    @override_settings(ANALYZE_ON_INGEST='background')
+    def test_new_story_is_queued_in_background_mode(self):
+        with mock.patch.object(ingest.ingest_queue, 'put') as put:
+            with self.captureOnCommitCallbacks(execute=True):
+                story = new_story('Fresh')
+        put.assert_called_once_with([story.id])
+        self.assertFalse(StoryAnalysis.objects.filter(story=story).exists())
+
+    @override_settings(ANALYZE_ON_INGEST='sync')
+    def test_hook_skips_updates_and_batch_ingest(self):
+        with mock.patch.object(ingest, 'schedule') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                with ingest.batch_ingest():
+                    story = new_story('Fresh')
+                story.title = 'Renamed'
+                story.save()
+        schedule.assert_not_called()
+
+
+class SentimentArcTests(TestCase):
+    text = 'The fox was happy. He was not happy at all! The storm destroyed his home. Then friends came and he smiled.'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.story = new_story('Arc', cls.text)
+
+    def setUp(self):
+        log_in(self)
+
+    def test_scores_follow_the_story(self):
+        scores, starts = sentiment_arc.sentence_scores(self.text)
+        self.assertEqual(starts, [0, 19, 44, 74])
+        self.assertEqual([score > 0 for score in scores], [True, False, False, True])
+
+    def test_arc_is_computed_once_then_served_from_the_table(self):
+        url = f'/api/analysis/sentiment-arc/{self.story.id}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['sentences'], 4)
+        self.assertEqual(len(data['series']), 4)
+        self.assertEqual(len(data['arc']), sentiment_arc.DEFAULT_POINTS)
+
+        with self.assertNumQueries(1):
+            again = self.client.get(url, {'window': 2, 'points': 5}).json()
+        self.assertEqual([point['sentence'] for point in again['series']], [0, 2])
+        self.assertEqual(len(again['arc']), 5)
+
+    def test_edited_text_is_rescored(self):
+        self.client.get(f'/api/analysis/sentiment-arc/{self.story.id}/')
+        self.story.story = 'A sad day.'
+        self.story.save()
+        data = self.client.get(f'/api/analysis/sentiment-arc/{self.story.id}/').json()
+        self.assertEqual(data['sentences'], 1)
+        self.assertEqual(SentimentArc.objects.get(story=self.story).input_hash, self.story.content_hash)
+
+    def test_bad_parameters(self):
+        for params in ({'window': 0}, {'points': 1}, {'window': 'x'}):
+            response = self.client.get(f'/api/analysis/sentiment-arc/{self.story.id}/', params)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/analysis/sentiment-arc/999999/').status_code, 404)
+
+
+class PercentileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.story_ids = seed_stories(12)
+        # Grades 0..11 across the corpus
+        for grade, story_id in enumerate(cls.story_ids):
+            StoryAnalysis.objects.filter(story_id=story_id).update(flesch_kincaid_grade=grade)
+
+    def setUp(self):
+        log_in(self)
+        self.index = percentiles.PercentileIndex()
+        patcher = mock.patch.object(views, 'percentile_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def group_grades(self, story_id, all_sources=False):
+        story = Story.objects.get(id=story_id)
+        stories = Story.objects.filter(age_group=story.age_group)
+        if not all_sources:
+            stories = stories.filter(source=story.source)
+        return sorted(stories.values_list('analysis__flesch_kincaid_grade', flat=True))
+
+    def test_ranks_within_age_group_and_source(self):
+        story_id = self.story_ids[5]
+        grades = self.group_grades(story_id)
+        response = self.client.get(f'/api/analysis/percentiles/{story_id}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['group_size'], len(grades))
+        expected = 100 * (grades.index(5) + 0.5) / len(grades)
+        self.assertAlmostEqual(data['metrics']['flesch_kincaid_grade']['percentile'], expected, places=1)
+        # Every story has the same word count
+        self.assertEqual(data['metrics']['word_count']['percentile'], 50.0)
+
+        everyone = self.client.get(f'/api/analysis/percentiles/{story_id}/', {'all_sources': 'true'}).json()
+        self.assertEqual(everyone['group_size'], len(self.group_grades(story_id, all_sources=True)))
+
+    def test_lookups_between_refreshes_are_free(self):
+        self.index.refresh()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f'/api/analysis/percentiles/{self.story_ids[0]}/').status_code, 200)
+
+    @override_settings(PERCENTILE_REFRESH_SECONDS=0, PERCENTILE_REFRESH_OVERLAP=0)
+    def test_incremental_refresh(self):
+        self.index.refresh()
+        story_id = self.story_ids[0]
+        analysis = StoryAnalysis.objects.get(story_id=story_id)
+        analysis.flesch_kincaid_grade = 100
+        analysis.save()
+        ranks = self.index.ranks(story_id)
+        self.assertGreater(ranks['metrics']['flesch_kincaid_grade']['percentile'], 50)
+
+        # Nothing changed: a single aggregate query
+        with self.assertNumQueries(1):
+            self.index.refresh()
+
+        Story.objects.filter(id=self.story_ids[1]).delete()
+        self.index.refresh()
+        self.assertNotIn(self.story_ids[1], self.index.values)
+        self.assertEqual(len(self.index.values), 11)
+
+    @override_settings(PERCENTILE_REFRESH_SECONDS=0)
+    def test_late_commits_are_picked_up(self):
+        self.index.refresh()
+        # Written before the newest update the index has seen, committed after it
+        story_id = self.story_ids[0]
+        StoryAnalysis.objects.filter(story_id=story_id).update(
+            flesch_kincaid_grade=100, updated_at=self.index.watermark - timedelta(seconds=30),
+        )
+        with override_settings(PERCENTILE_REFRESH_OVERLAP=0):
+            self.index.refresh()
+        self.assertEqual(self.index.values[story_id][2][0], 0)
+
+        with override_settings(PERCENTILE_REFRESH_OVERLAP=60):
+            self.index.refresh()
+        self.assertEqual(self.index.values[story_id][2][0], 100)
+        self.assertGreater(self.index.ranks(story_id)['metrics']['flesch_kincaid_grade']['percentile'], 50)
+
+    def test_story_without_analysis(self):
+        story = new_story('Unanalysed')
+        response = self.client.get(f'/api/analysis/percentiles/{story.id}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_ids_do_not_force_refreshes(self):
+        self.index.refresh()
+        # One existence check each, never the aggregate and reload
+        for story_id in (999999, 1000000):
+            with self.assertNumQueries(1):
+                self.assertIsNone(self.index.ranks(story_id))
+
+        # A story analysed since the last refresh is still picked up
+        story = Story.objects.create(title='New', story='Fox ran home.', source='AI', age_group='7-12')
+        StoryAnalysis.objects.create(
+            story=story, word_count=3, sentence_count=1, ttr=1.0, flesch_kincaid_grade=50,
+            ari_score=1.0, sentiment_label='neutral', sentiment_score=0.0, pos_distribution=[],
+        )
+        self.assertIsNotNone(self.index.ranks(story.id))
+
+
+class FeatureStoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.story_ids = seed_stories(6)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        # No overlap, so "updated" counts only what the test changed
+        store = override_settings(FEATURE_STORE_DIR=directory, FEATURE_STORE_OVERLAP=0)
+        store.enable()
+        self.addCleanup(store.disable)
+
+    def test_build_and_query(self):
+        self.assertIsNone(feature_store.load())
+        result = feature_store.build()
+        self.assertEqual((result['rows'], result['updated']), (6, 6))
+
+        snapshot = feature_store.load()
+        self.assertIsInstance(snapshot.column('ttr'), np.memmap)
+        self.assertEqual(list(snapshot.ids), sorted(self.story_ids))
+        expected = Story.objects.filter(age_group='7-12', source='AI').count()
+        self.assertEqual(int(snapshot.mask(age_group='7-12', source='AI').sum()), expected)
+        self.assertEqual(snapshot.matrix(['word_count', 'confidence_score']).shape, (6, 2))
+
+        row = snapshot.row(self.story_ids[0])
+        self.assertEqual(row['word_count'], 160)
+        self.assertEqual(row['predicted_ai'], 1.0)
+        self.assertAlmostEqual(row['confidence_score'], 0.7, places=5)
+        self.assertIsNone(snapshot.row(999999))
+
+    def test_incremental_build_only_reads_changes(self):
+        feature_store.build()
+        first, deleted = self.story_ids[:2]
+        AuthorshipDetection.objects.filter(story_id=first).delete()
+        analysis = StoryAnalysis.objects.get(story_id=first)
+        analysis.word_count = 999
+        analysis.save()
+        Story.objects.filter(id=deleted).delete()
+        fresh = new_story('Fresh').id
+
+        result = feature_store.build()
+        self.assertEqual((result['generation'], result['rows']), (2, 6))
+        self.assertEqual((result['updated'], result['removed']), (2, 1))
+
+        snapshot = feature_store.load()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual(snapshot.row(first)['word_count'], 999)
+        self.assertTrue(np.isnan(snapshot.row(first)['confidence_score']))
+        self.assertIsNone(snapshot.row(deleted))
+        self.assertTrue(np.isnan(snapshot.row(fresh)['ttr']))
+
+        # Nothing changed: the next generation is a straight copy
+        self.assertEqual(feature_store.build()['updated'], 0)
+        self.assertEqual(len(list(feature_store.store_dir().glob('gen-*'))), feature_store.KEEP_GENERATIONS)
+
+    def test_late_commits_are_picked_up(self):
+        feature_store.build()
+        built_at = feature_store.load().built_at
+        # Written before that build started, but committed after it read the table
+        story_id = self.story_ids[0]
+        StoryAnalysis.objects.filter(story_id=story_id).update(
+            word_count=777, updated_at=built_at - timedelta(seconds=30),
+        )
+        self.assertEqual(feature_store.build()['updated'], 0)
+        self.assertEqual(feature_store.load().row(story_id)['word_count'], 160)
+
+        with override_settings(FEATURE_STORE_OVERLAP=60):
+            result = feature_store.build()
+        self.assertGreaterEqual(result['updated'], 1)
+        self.assertEqual(feature_store.load().row(story_id)['word_count'], 777)
+
+
+class VocabularyTests(TestCase):
+    texts = [
+        'The fox found a lantern in the snowy forest.',
+        'The fox and the owl shared a lantern.',
+        'A dragon guarded the mountain treasure.',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stories = [new_story(f'Story {i}', text) for i, text in enumerate(cls.texts)]
+
+    def setUp(self):
+        cache.clear()
+        vocabulary.rebuild()
+        log_in(self)
+
+    def frequency(self, term):
+        return Term.objects.get(term=term).document_frequency
+
+    def test_rebuild_counts_documents(self):
+        self.assertEqual(self.frequency('fox'), 2)
+        self.assertEqual(self.frequency('dragon'), 1)
+        self.assertFalse(Term.objects.filter(term='the').exists())
+        self.assertEqual(StoryTerms.objects.get(story=self.stories[0]).counts['lantern'], 1)
+
+    def test_keywords_prefer_distinctive_terms(self):
+        url = f'/api/analysis/keywords/{self.stories[0].id}/'
+        self.client.get(url)
+        # Cached corpus size: the story's counts and its terms' frequencies
+        with self.assertNumQueries(2):
+            data = self.client.get(url, {'limit': 3}).json()
+        terms = [keyword['term'] for keyword in data['keywords']]
+        self.assertEqual(len(terms), 3)
+        self.assertNotIn('fox', terms)  # shared with another story
+        self.assertIn('snowy', terms)
+
+    def test_text_changes_move_frequencies(self):
+        story = self.stories[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            story.story = 'The dragon and the owl.'
+            story.save()
+        self.assertEqual(self.frequency('fox'), 1)
+        self.assertEqual(self.frequency('dragon'), 2)
+        self.assertEqual(self.frequency('lantern'), 1)
+
+        # Saving without touching the text does nothing
+        with self.captureOnCommitCallbacks() as callbacks:
+            story.title = 'Renamed'
+            story.save()
+        self.assertEqual(callbacks, [])
+
+        story.delete()
+        self.assertEqual(self.frequency('dragon'), 1)
+        self.assertEqual(self.frequency('owl'), 0)
+
+    def test_unindexed_story_is_indexed_on_request(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            story = new_story('Late', 'A whale sang to the fox.')
+        response = self.client.get(f'/api/analysis/keywords/{story.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.frequency('whale'), 1)
+        self.assertEqual(self.frequency('fox'), 3)
+        self.assertEqual(self.client.get('/api/analysis/keywords/999999/').status_code, 404)
+
+    def test_first_index_locks_the_story(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            story = new_story('Late', 'A whale sang to the fox.')
+        select_for_update = QuerySet.select_for_update
+        locked = []
+
+        def recording(queryset, *args, **kwargs):
+            locked.append(queryset.model)
+            return select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', recording):
+            vocabulary.index_story(story.id, story.story)
+            # A second index of the same text (the loser of a race) adds nothing
+            vocabulary.index_story(story.id, story.story)
+        # Before anything else (update_or_create locks StoryTerms itself later on)
+        self.assertEqual(locked[0], Story)
+        self.assertEqual(locked.count(Story), 2)
+        self.assertEqual(self.frequency('whale'), 1)
+        self.assertEqual(self.frequency('fox'), 3)
+
+    def test_index_after_delete_changes_nothing(self):
+        story = self.stories[2]
+        text = story.story
+        story.delete()
+        self.assertIsNone(vocabulary.index_story(story.id, text))
+        self.assertEqual(self.frequency('dragon'), 0)
+
+
+class EvaluationTests(TestCase):
+    def test_metrics(self):
+        metrics = evaluation.classification_metrics(['AI', 'AI', 'Human', 'Human'], [0.9, 0.4, 0.2, 0.7])
+        self.assertEqual(metrics['accuracy'], 0.5)
+        self.assertEqual(metrics['confusion'], {'tp': 1, 'fp': 1, 'tn': 1, 'fn': 1})
+        self.assertEqual(metrics['precision_ai'], 0.5)
+        self.assertEqual(metrics['recall_human'], 0.5)
+        self.assertEqual(metrics['brier'], round((0.01 + 0.36 + 0.04 + 0.49) / 4, 4))
+        # Confidence 0.9 and 0.8 were right, 0.6 and 0.7 were wrong
+        self.assertEqual(metrics['ece'], round((0.1 + 0.2 + 0.6 + 0.7) / 4, 4))
+
+    def test_command_writes_report(self):
+        for i in range(6):
+            new_story(f'AI {i}', 'The gentle river carried a lantern past the quiet village. ' * (20 + i), source='AI')
+            new_story(f'Human {i}', f'Fox ran. Owl {i} hooted!', source='Human')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.json')
+            call_command('evaluate_authorship', folds=3, workers=0, methods='viewset,logistic',
+                         json_path=path, stdout=io.StringIO())
+            with open(path) as file:
+                report = json.load(file)
+
+        self.assertEqual(report['stories'], {'total': 12, 'AI': 6, 'Human': 6})
+        logistic = report['methods']['logistic']
+        self.assertEqual(logistic['pooled']['documents'], 12)
+        self.assertEqual(len(logistic['folds']), 3)
+        self.assertEqual(logistic['pooled']['accuracy'], 1.0)
+        self.assertGreater(logistic['latency']['docs_per_second'], 0)
+        self.assertEqual(report['methods']['viewset']['pooled']['documents'], 12)
+
+    def test_too_few_labelled_stories(self):
+        new_story('Only', 'Just one story.', source='AI')
+        with self.assertRaises(CommandError):
+            call_command('evaluate_authorship', workers=0, stdout=io.StringIO())
@@ -5,4 +5,7 @@ urlpatterns = [
     path('', views.analysis_root, name='analysis_root'),  # Add this line
     path('detailed/<int:story_id>/', views.detailed_analysis, name='detailed_analysis'),
     path('authorship/<int:story_id>/', views.authorship_detection, name='authorship_detection'),
+    path('sentiment-arc/<int:story_id>/', views.sentiment_arc, name='sentiment_arc'),
+    path('percentiles/<int:story_id>/', views.percentiles, name='percentiles'),
+    path('keywords/<int:story_id>/', views.story_keywords, name='story_keywords'),
 ]
\ No newline at end of file
@@ -1,6 +1,77 @@
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
-from stories.models import Story
+import asyncio
+import functools
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, JsonResponse
+from authentication.authentication import request_user
+from beyond_words.metrics import registry
+from stories.dedup import content_hash
+from stories.models import AuthorshipDetection, SentimentArc, Story, StoryAnalysis, StoryTerms
+from . import vocabulary
+from .executor import (
+    AUTHORSHIP_VERSION, STYLOMETRY_VERSION, PoolBusy, analyze_text, detect_authorship, pool,
+)
+from .percentiles import percentile_index
+from .sentiment_arc import (
+    DEFAULT_POINTS, MAX_POINTS, SENTIMENT_ARC_VERSION, sentence_scores, smoothed, windowed,
+)
+
+# Seconds a client is asked to wait when the analysis pool is saturated
+RETRY_AFTER = 5
+
+# Per-user request budget for the endpoints below, per RATE_WINDOW seconds
+RATE_WINDOW = 60
+
+def _check_access(request):
+    """None when the request may go ahead, else the 401 / 429 response"""
+    user = request_user(request)
+    if user is None:
+        return JsonResponse({
+            'message': 'Authentication credentials were not provided.'
+        }, status=401)
+
+    limit = getattr(settings, 'ANALYSIS_RATE_LIMIT', 60)
+    if limit > 0:
+        window = int(time.time() // RATE_WINDOW)
+        key = f'analysis-rate:{user.pk}:{window}'
+        cache.add(key, 0, RATE_WINDOW * 2)
+        try:
+            count = cache.incr(key)
+        except ValueError:  # evicted in between
+            count = 1
+        if count > limit:
+            registry.inc('analysis_rejected_total', job='rate_limit')
+            response = JsonResponse({
+                'message': 'Too many analysis requests, try again shortly'
+            }, status=429)
+            response['Retry-After'] = str(RATE_WINDOW - int(time.time()) % RATE_WINDOW)
+            return response
+    return None
+
+def api_endpoint(view):
+    """
+    Require a logged in user (JWT or session) and apply ANALYSIS_RATE_LIMIT.
+    These are plain Django views - the async ones can't be DRF views - so
+    DRF's IsAuthenticated default doesn't reach them.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            denied = await sync_to_async(_check_access)(request)
+            if denied is not None:
+                return denied
+            return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            denied = _check_access(request)
+            if denied is not None:
+                return denied
+            return view(request, *args, **kwargs)
+    return wrapper
 
 def analysis_root(request):
     """Root endpoint for analysis API"""
@@ -9,24 +80,212 @@ def analysis_root(request):
         'endpoints': {
             'detailed_analysis': '/api/analysis/detailed/{story_id}/',
             'authorship_detection': '/api/analysis/authorship/{story_id}/',
-        }
+            'sentiment_arc': '/api/analysis/sentiment-arc/{story_id}/?window=1&points=20',
+            'percentiles': '/api/analysis/percentiles/{story_id}/?all_sources=false',
+            'keywords': '/api/analysis/keywords/{story_id}/?limit=10',
+        },
+        'pool': pool.stats(),
+    })
+
+# StoryAnalysis columns that hold an analyze_text() result
+STYLOMETRY_FIELDS = (
+    'word_count', 'sentence_count', 'ttr', 'flesch_kincaid_grade', 'ari_score',
+    'sentiment_label', 'sentiment_score', 'pos_distribution',
+)
+
+async def _get_story(story_id, related):
+    """The story with its stored ``related`` row (analysis / authorship), if any"""
+    try:
+        return await Story.objects.select_related(related).only(
+            'id', 'title', 'story', 'content_hash',
+        ).aget(id=story_id)
+    except Story.DoesNotExist:
+        raise Http404('Story not found')
+
+def _current_row(story, related, version):
+    """The stored result when it was made from this text by this analyzer version, else None"""
+    row = getattr(story, related, None)
+    text_hash = story.content_hash or content_hash(story.story)
+    if row is None or row.analyzer_version != version or row.input_hash != text_hash:
+        return None
+    return row
+
+def _record_timings(job, timings):
+    for stage in ('queued', 'compute'):
+        registry.observe('analysis_stage_duration_seconds', timings[stage], job=job, stage=stage)
+
+def _busy_response(job):
+    registry.inc('analysis_rejected_total', job=job)
+    response = JsonResponse({
+        'message': 'Analysis is busy, try again shortly'
+    }, status=503)
+    response['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+@api_endpoint
+async def detailed_analysis(request, story_id):
+    story = await _get_story(story_id, 'analysis')
+    # Ingest (or an earlier request) usually got here first
+    stored = _current_row(story, 'analysis', STYLOMETRY_VERSION)
+    if stored is not None:
+        return JsonResponse({
+            'story_id': story_id,
+            'title': story.title,
+            'analysis': {name: getattr(stored, name) for name in STYLOMETRY_FIELDS},
+            'timings': None,
+            'cached': True,
+        })
+
+    # The NLP runs in the process pool; this coroutine just waits for it
+    try:
+        result, timings = await pool.submit(analyze_text, story.story)
+    except PoolBusy:
+        return _busy_response('stylometry')
+    _record_timings('stylometry', timings)
+
+    await StoryAnalysis.objects.aupdate_or_create(story_id=story.id, defaults={
+        **result,
+        'analyzer_version': STYLOMETRY_VERSION,
+        'input_hash': content_hash(story.story),
+    })
+    return JsonResponse({
+        'story_id': story_id,
+        'title': story.title,
+        'analysis': result,
+        'timings': timings,
+        'cached': False,
     })
 
-def detailed_analysis(request, story_id):
-    story = get_object_or_404(Story, id=story_id)
-    # Your analysis logic here
+@api_endpoint
+async def authorship_detection(request, story_id):
+    story = await _get_story(story_id, 'authorship')
+    stored = _current_row(story, 'authorship', AUTHORSHIP_VERSION)
+    if stored is not None:
+        return JsonResponse({
+            'story_id': story_id,
+            'title': story.title,
+            'authorship': stored.predicted_source,
+            'confidence': stored.confidence_score,
+            'features': stored.features,
+            'timings': None,
+            'cached': True,
+        })
+
+    try:
+        result, timings = await pool.submit(detect_authorship, story.story)
+    except PoolBusy:
+        return _busy_response('authorship')
+    _record_timings('authorship', timings)
+
+    await AuthorshipDetection.objects.aupdate_or_create(story_id=story.id, defaults={
+        'predicted_source': result['prediction'],
+        'confidence_score': result['confidence'],
+        'features': result['features'],
+        'analyzer_version': AUTHORSHIP_VERSION,
+        'input_hash': content_hash(story.story),
+    })
     return JsonResponse({
         'story_id': story_id,
         'title': story.title,
-        'analysis': 'Detailed analysis results for this story...'
+        'authorship': result['prediction'],
+        'confidence': result['confidence'],
+        'features': result['features'],
+        'timings': timings,
+        'cached': False,
     })
 
-def authorship_detection(request, story_id):
-    story = get_object_or_404(Story, id=story_id)
-    # Your authorship detection logic here
+def _int_param(request, name, default, low, high):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    value = int(value)  # ValueError handled by the caller
+    if not low <= value <= high:
+        raise ValueError(name)
+    return value
+
+@api_endpoint
+def sentiment_arc(request, story_id):
+    """Per-sentence (or per-window) sentiment through a story, plus a smoothed arc"""
+    try:
+        window = _int_param(request, 'window', 1, 1, 1000)
+        points = _int_param(request, 'points', DEFAULT_POINTS, 2, MAX_POINTS)
+    except ValueError:
+        return JsonResponse({
+            'message': f'window must be 1-1000 and points 2-{MAX_POINTS}'
+        }, status=400)
+
+    try:
+        # The text itself is deferred: it's only read when the arc is (re)computed
+        story = Story.objects.select_related('sentiment_arc').only(
+            'id', 'title', 'content_hash',
+            'sentiment_arc__sentence_scores', 'sentiment_arc__sentence_starts',
+            'sentiment_arc__analyzer_version', 'sentiment_arc__input_hash',
+        ).get(id=story_id)
+    except Story.DoesNotExist:
+        raise Http404('Story not found')
+
+    arc = getattr(story, 'sentiment_arc', None)
+    text_hash = story.content_hash or content_hash(story.story)
+    if arc is None or arc.analyzer_version != SENTIMENT_ARC_VERSION or arc.input_hash != text_hash:
+        # Computed once per text and version; every later request reuses it
+        scores, starts = sentence_scores(story.story)
+        arc, _ = SentimentArc.objects.update_or_create(story_id=story.id, defaults={
+            'sentence_scores': scores,
+            'sentence_starts': starts,
+            'analyzer_version': SENTIMENT_ARC_VERSION,
+            'input_hash': text_hash,
+        })
+
+    series = windowed(arc.sentence_scores, arc.sentence_starts, window)
     return JsonResponse({
         'story_id': story_id,
         'title': story.title,
-        'authorship': 'Human',  # or 'AI'
-        'confidence': 0.85
-    })
\ No newline at end of file
+        'sentences': len(arc.sentence_scores),
+        'window': window,
+        'series': series,
+        'arc': smoothed([point['score'] for point in series], points),
+    })
+
+@api_endpoint
+def percentiles(request, story_id):
+    """Where a story's readability, TTR, sentiment and length rank among stories of its age group (and source)"""
+    all_sources = request.GET.get('all_sources', '').lower() in ('1', 'true', 'yes')
+    ranks = percentile_index.ranks(story_id, all_sources=all_sources)
+    if ranks is None:
+        return JsonResponse({
+            'message': 'This story has not been analysed yet'
+        }, status=404)
+    return JsonResponse({'story_id': story_id, **ranks})
+
+@api_endpoint
+def story_keywords(request, story_id):
+    """A story's most distinctive words by TF-IDF against the corpus vocabulary"""
+    try:
+        limit = _int_param(request, 'limit', vocabulary.DEFAULT_KEYWORDS, 1, vocabulary.MAX_KEYWORDS)
+    except ValueError:
+        return JsonResponse({
+            'message': f'limit must be 1-{vocabulary.MAX_KEYWORDS}'
+        }, status=400)
+
+    terms = StoryTerms.objects.select_related('story').only(
+        'story__id', 'story__title', 'counts', 'token_count',
+    ).filter(story_id=story_id).first()
+    if terms is not None:
+        title = terms.story.title
+    else:
+        # Not indexed yet (created before the vocabulary was built)
+        story = Story.objects.only('id', 'title', 'story').filter(id=story_id).first()
+        if story is None:
+            raise Http404('Story not found')
+        title = story.title
+        terms = vocabulary.index_story(story.id, story.story)
+        if terms is None:
+            raise Http404('Story not found')  # deleted just now
+
+    return JsonResponse({
+        'story_id': story_id,
+        'title': title,
+        'distinct_terms': len(terms.counts),
+        'tokens': terms.token_count,
+        'keywords': vocabulary.keywords(terms, limit),
+    })
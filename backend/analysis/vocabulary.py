@@ -0,0 +1,189 @@
+"""
+Corpus vocabulary and document frequencies, for TF-IDF keywords.
+
+Each story's text is tokenised once into {term: count} (StoryTerms) and
+the Term table holds, for every term, how many stories use it. Keywords
+for a story then only need its own counts, the document frequencies of
+those terms and the corpus size - nothing is re-tokenised.
+
+``manage.py build_vocabulary`` fills both tables in one streaming pass
+over the stories. After that they are kept current from Story signals:
+when a story's text changes only the terms it gained or lost have their
+document frequency adjusted, and a deleted story takes its terms with it.
+"""
+import math
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from stories.dedup import content_hash
+from stories.models import Story, StoryTerms, Term
+
+MIN_TERM_LENGTH = 3
+MAX_TERM_LENGTH = 64
+DEFAULT_KEYWORDS = 10
+MAX_KEYWORDS = 50
+
+# Stories in the corpus, cached briefly: it only feeds the idf
+DOCUMENTS_CACHE_KEY = 'vocabulary:documents'
+DOCUMENTS_CACHE_TTL = 60
+
+# Terms per IN (...) clause, well under SQLite's variable limit
+CHUNK_SIZE = 500
+
+STOPWORDS = frozenset('''
+a about above after again against all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further had has
+have having he her here hers herself him himself his how i if in into is it its itself just me more
+most my myself no nor not now of off on once only or other our ours ourselves out over own said same
+she should so some such than that the their theirs them themselves then there these they this those
+through to too under until up upon very was we were what when where which while who whom why will
+with would you your yours yourself yourselves one two it's i'm don't didn't can't
+'''.split())
+
+_term_re = re.compile(r"[a-z][a-z']*[a-z]|[a-z]")
+
+
+def term_counts(text):
+    """{term: occurrences} for a text: lower-cased words, minus stopwords and very short words"""
+    return dict(Counter(
+        term for term in _term_re.findall(text.lower())
+        if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH and term not in STOPWORDS
+    ))
+
+
+def _chunks(items):
+    items = list(items)
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
+
+
+def _adjust(terms, delta):
+    for chunk in _chunks(terms):
+        if delta > 0:
+            Term.objects.bulk_create([Term(term=term) for term in chunk], ignore_conflicts=True)
+        Term.objects.filter(term__in=chunk).update(document_frequency=F('document_frequency') + delta)
+
+
+def _lock_story(story_id):
+    """Serialise index/unindex of one story until the transaction ends. False if it doesn't exist"""
+    return Story.objects.select_for_update().filter(id=story_id).values_list('id', flat=True).first() is not None
+
+
+def index_story(story_id, text):
+    """Store the story's term counts and move document frequencies by what changed"""
+    counts = term_counts(text)
+    text_hash = content_hash(text)
+    with transaction.atomic():
+        # Lock the story, not its StoryTerms row: on a first index there is no
+        # such row to lock, and two concurrent first indexes would both +1
+        # every term
+        if not _lock_story(story_id):
+            return None  # deleted in the meantime
+        existing = StoryTerms.objects.filter(story_id=story_id).first()
+        if existing is not None and existing.input_hash == text_hash:
+            return existing
+        old_terms = set(existing.counts) if existing is not None else set()
+        _adjust(set(counts) - old_terms, +1)
+        _adjust(old_terms - set(counts), -1)
+        terms, created = StoryTerms.objects.update_or_create(story_id=story_id, defaults={
+            'counts': counts,
+            'token_count': sum(counts.values()),
+            'input_hash': text_hash,
+        })
+    if created:
+        cache.delete(DOCUMENTS_CACHE_KEY)
+    return terms
+
+
+def unindex_story(story_id):
+    """Take a story's terms out of the document frequencies (before it is deleted)"""
+    with transaction.atomic():
+        _lock_story(story_id)
+        counts = StoryTerms.objects.filter(story_id=story_id).values_list('counts', flat=True).first()
+        if counts:
+            _adjust(counts, -1)
+    cache.delete(DOCUMENTS_CACHE_KEY)
+
+
+def rebuild(batch_size=500):
+    """
+    Recompute both tables from scratch in one pass over the stories.
+    Only the running document frequency counter is held in memory.
+    Returns (stories, terms).
+    """
+    frequencies = Counter()
+    stories = 0
+    with transaction.atomic():
+        StoryTerms.objects.all().delete()
+        batch = []
+        texts = Story.objects.order_by('id').values_list('id', 'story')
+        for story_id, text in texts.iterator(chunk_size=batch_size):
+            counts = term_counts(text)
+            frequencies.update(counts.keys())
+            batch.append(StoryTerms(
+                story_id=story_id, counts=counts,
+                token_count=sum(counts.values()), input_hash=content_hash(text),
+            ))
+            if len(batch) >= batch_size:
+                StoryTerms.objects.bulk_create(batch)
+                stories += len(batch)
+                batch = []
+        StoryTerms.objects.bulk_create(batch)
+        stories += len(batch)
+
+        Term.objects.all().delete()
+        Term.objects.bulk_create(
+            (Term(term=term, document_frequency=count) for term, count in frequencies.items()),
+            batch_size=1000,
+        )
+    cache.delete(DOCUMENTS_CACHE_KEY)
+    return stories, len(frequencies)
+
+
+def document_count():
+    return cache.get_or_set(DOCUMENTS_CACHE_KEY, StoryTerms.objects.count, DOCUMENTS_CACHE_TTL)
+
+
+def keywords(terms, limit=DEFAULT_KEYWORDS):
+    """Top ``limit`` terms of a StoryTerms row by TF-IDF, as [{term, count, document_frequency, score}]"""
+    if not terms.counts or not terms.token_count:
+        return []
+    documents = document_count()
+    frequencies = {}
+    for chunk in _chunks(terms.counts):
+        frequencies.update(Term.objects.filter(term__in=chunk).values_list('term', 'document_frequency'))
+
+    scored = []
+    for term, count in terms.counts.items():
+        frequency = frequencies.get(term, 0)
+        # Smoothed idf, as in scikit-learn's TfidfTransformer
+        idf = math.log((1 + documents) / (1 + frequency)) + 1
+        scored.append((count / terms.token_count * idf, term, count, frequency))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [
+        {'term': term, 'count': count, 'document_frequency': frequency, 'score': round(score, 5)}
+        for score, term, count, frequency in scored[:limit]
+    ]
+
+
+# Signal receivers, connected in AnalysisConfig.ready
+
+def story_saved(sender, instance, created, raw=False, update_fields=None, using=None, **kwargs):
+    if raw or (update_fields is not None and 'story' not in update_fields):
+        return
+    text = instance.__dict__.get('story')
+    if text is None:
+        return  # text not loaded, so it can't have changed
+    # Story.save() only moves _loaded_story forward after this signal
+    if not created and getattr(instance, '_loaded_story', None) == text:
+        return
+    story_id = instance.pk
+    transaction.on_commit(lambda: index_story(story_id, text), using=using)
+
+
+def story_deleted(sender, instance, using=None, **kwargs):
+    unindex_story(instance.pk)
@@ -1,14 +1,28 @@
+import csv
 from django.contrib import admin
+from django.contrib.admin.models import LogEntry
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db.models import Count
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from beyond_words.metrics import registry
+from beyond_words.streaming import streaming_body
+from stories.models import Story
+from .authentication import invalidate_all_users, user_cache_stats
 from .models import CustomUser
-from .serializers import UserLoginSerializer
+from .serializers import AdminUserSerializer, UserLoginSerializer
 
 # Django Admin Interface Registration
 @admin.register(CustomUser)
@@ -54,6 +68,68 @@ class CustomUserAdmin(BaseUserAdmin):
 def is_super_admin(user):
     return user.is_authenticated and user.is_superuser
 
+class AdminUserPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+def _parse_bool(value):
+    lowered = value.strip().lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValidationError('Expected true or false')
+
+def _parse_datetime(value):
+    """Accept either a full ISO datetime or a plain date"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError('Expected an ISO date or datetime')
+        parsed = datetime.combine(day, time.min)
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+def filter_admin_users(params):
+    """
+    CustomUser queryset narrowed by the admin listing filters:
+    ?q= (username/email/name search), ?age_group=, ?is_active=,
+    ?created_after= and ?created_before= (ISO date or datetime).
+    Raises ValidationError with the offending parameter on bad input.
+    """
+    users = CustomUser.objects.all()
+    errors = {}
+
+    query = params.get('q', '').strip()
+    if query:
+        users = users.filter(
+            Q(email__icontains=query) | Q(username__icontains=query) |
+            Q(first_name__icontains=query) | Q(last_name__icontains=query) |
+            Q(name__icontains=query)
+        )
+
+    if params.get('age_group'):
+        users = users.filter(age_group=params['age_group'])
+
+    converters = {
+        'is_active': ('is_active', _parse_bool),
+        'created_after': ('created_at__gte', _parse_datetime),
+        'created_before': ('created_at__lt', _parse_datetime),
+    }
+    for param, (lookup, convert) in converters.items():
+        if params.get(param):
+            try:
+                users = users.filter(**{lookup: convert(params[param])})
+            except ValidationError as exc:
+                errors[param] = exc.detail
+
+    if errors:
+        raise ValidationError(errors)
+    return users
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def admin_users_list(request):
@@ -62,15 +138,54 @@ def admin_users_list(request):
             'message': 'Permission denied. Super admin access required.'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    users = CustomUser.objects.all().order_by('-created_at')
-    serializer = UserLoginSerializer(users, many=True)
+    # Only the columns the serializer needs, one cursor page at a time
+    users = filter_admin_users(request.query_params).only(*AdminUserSerializer.Meta.fields)
+    paginator = AdminUserPagination()
+    page = paginator.paginate_queryset(users, request)
+    serializer = AdminUserSerializer(page, many=True)
     
     return Response({
         'message': 'Users retrieved successfully',
-        'count': users.count(),
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
         'users': serializer.data
     }, status=status.HTTP_200_OK)
 
+class _Echo:
+    """File-like object whose write() just hands the line back to csv.writer"""
+
+    def write(self, value):
+        return value
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def admin_users_export(request):
+    """Stream the (filtered) user list as CSV without loading it into memory"""
+    if not is_super_admin(request.user):
+        return Response({
+            'message': 'Permission denied. Super admin access required.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    columns = AdminUserSerializer.Meta.fields
+    rows = (
+        filter_admin_users(request.query_params)
+        .order_by('-created_at', '-id')
+        .values_list(*columns)
+        .iterator(chunk_size=2000)
+    )
+    writer = csv.writer(_Echo())
+
+    def generate():
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(row)
+
+    # Under ASGI the rows are fetched on the thread-sensitive thread, which
+    # owns the database connection the cursor was opened on
+    response = StreamingHttpResponse(streaming_body(request, generate()), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="users.csv"'
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def admin_user_detail(request, user_id):
@@ -168,6 +283,157 @@ def admin_delete_user(request, user_id):
             'message': 'User not found'
         }, status=status.HTTP_404_NOT_FOUND)
 
+# Keys accepted in a bulk action's {"filter": {...}}
+BULK_FILTER_KEYS = ('q', 'age_group', 'is_active', 'created_after', 'created_before')
+
+def bulk_target_users(request):
+    """
+    Users a bulk action applies to, from a body of either {"ids": [...]}
+    or {"filter": {...}} (same keys as the listing's query params).
+    Unknown filter keys and filters that constrain nothing are rejected,
+    so a typo can't select every account. Superusers and the requesting
+    admin are excluded in the query itself - callers run their UPDATE or
+    DELETE straight on the returned queryset.
+    """
+    ids = request.data.get('ids')
+    filters = request.data.get('filter')
+
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValidationError({'ids': 'Expected a non-empty list of user ids'})
+        try:
+            ids = [int(user_id) for user_id in ids]
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': 'User ids must be integers'})
+        users = CustomUser.objects.filter(pk__in=ids)
+    elif isinstance(filters, dict) and filters:
+        unknown = sorted(key for key in filters if key not in BULK_FILTER_KEYS)
+        if unknown:
+            raise ValidationError({
+                'filter': f"Unknown key(s): {', '.join(unknown)}. Allowed: {', '.join(BULK_FILTER_KEYS)}"
+            })
+        # JSON booleans/numbers -> the strings the query param parsers expect
+        params = {key: str(value).strip() for key, value in filters.items() if value is not None}
+        params = {key: value for key, value in params.items() if value}
+        if not params:
+            raise ValidationError({'filter': 'The filter must constrain at least one field'})
+        users = filter_admin_users(params)
+    else:
+        raise ValidationError({'message': 'Provide "ids" or a non-empty "filter"'})
+
+    return users.exclude(is_superuser=True).exclude(pk=request.user.pk)
+
+def _bulk_set_active(request, is_active):
+    if not is_super_admin(request.user):
+        return Response({
+            'message': 'Permission denied. Super admin access required.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    # One UPDATE, only touching rows that actually change
+    updated = bulk_target_users(request).exclude(is_active=is_active).update(is_active=is_active)
+    if updated:
+        # update() sends no signals and doesn't say which rows it changed
+        invalidate_all_users()
+
+    action = 'activated' if is_active else 'deactivated'
+    return Response({
+        'message': f'{updated} users {action}',
+        'updated': updated,
+    }, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def admin_bulk_activate(request):
+    return _bulk_set_active(request, True)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def admin_bulk_deactivate(request):
+    return _bulk_set_active(request, False)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def admin_bulk_delete(request):
+    if not is_super_admin(request.user):
+        return Response({
+            'message': 'Permission denied. Super admin access required.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    users = bulk_target_users(request)
+    targets = users.values('pk')
+    with transaction.atomic():
+        # What the delete cascade would do, one statement per table instead
+        # of collecting the users first (the post_delete receiver forces it)
+        CustomUser.groups.through.objects.filter(customuser__in=targets).delete()
+        CustomUser.user_permissions.through.objects.filter(customuser__in=targets).delete()
+        LogEntry.objects.filter(user__in=targets).delete()
+        OutstandingToken.objects.filter(user__in=targets).update(user=None)
+        deleted = users._raw_delete(users.db)
+        if deleted:
+            # No signals per row: drop everyone from the JWT user cache, and
+            # again once committed in case a request cached them in between
+            invalidate_all_users()
+            transaction.on_commit(invalidate_all_users)
+
+    return Response({
+        'message': f'{deleted} users deleted',
+        'deleted': deleted,
+    }, status=status.HTTP_200_OK)
+
+ADMIN_STATS_CACHE_KEY = 'admin-stats-snapshot'
+
+def build_admin_stats():
+    """
+    User, story and analysis counts for the SuperAdmin dashboard.
+    One conditional aggregate per table, with the date windows expressed as
+    created_at ranges so the created_at index can be used.
+    """
+    now = timezone.localtime() if settings.USE_TZ else timezone.now()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_ago = today_start - timedelta(days=7)
+    month_ago = today_start - timedelta(days=30)
+
+    users = CustomUser.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        inactive=Count('id', filter=Q(is_active=False)),
+        super_admins=Count('id', filter=Q(is_superuser=True)),
+        today=Count('id', filter=Q(created_at__gte=today_start)),
+        week=Count('id', filter=Q(created_at__gte=week_ago)),
+        month=Count('id', filter=Q(created_at__gte=month_ago)),
+    )
+
+    age_groups = [code for code, _ in Story.AGE_CHOICES]
+    stories = Story.objects.aggregate(
+        total=Count('id'),
+        ai=Count('id', filter=Q(source='AI')),
+        human=Count('id', filter=Q(source='Human')),
+        safety_flagged=Count('id', filter=Q(safety_present=True)),
+        bias_flagged=Count('id', filter=Q(bias_present=True)),
+        analyzed=Count('analysis'),
+        authorship=Count('authorship'),
+        **{f'age_{index}': Count('id', filter=Q(age_group=code)) for index, code in enumerate(age_groups)},
+    )
+
+    return {
+        'totalUsers': users['total'],
+        'activeUsers': users['active'],
+        'inactiveUsers': users['inactive'],
+        'superAdmins': users['super_admins'],
+        'newUsersToday': users['today'],
+        'newUsersThisWeek': users['week'],
+        'newUsersThisMonth': users['month'],
+        'totalStories': stories['total'],
+        'aiStories': stories['ai'],
+        'humanStories': stories['human'],
+        'storiesByAgeGroup': {code: stories[f'age_{index}'] for index, code in enumerate(age_groups)},
+        'safetyFlaggedStories': stories['safety_flagged'],
+        'biasFlaggedStories': stories['bias_flagged'],
+        'analyzedStories': stories['analyzed'],
+        'authorshipDetections': stories['authorship'],
+        'lastUpdated': timezone.now().isoformat()
+    }
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def admin_stats(request):
@@ -176,35 +442,35 @@ def admin_stats(request):
             'message': 'Permission denied. Super admin access required.'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    total_users = CustomUser.objects.count()
-    today = timezone.now().date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-    
-    new_users_today = CustomUser.objects.filter(created_at__date=today).count()
-    new_users_week = CustomUser.objects.filter(created_at__date__gte=week_ago).count()
-    new_users_month = CustomUser.objects.filter(created_at__date__gte=month_ago).count()
-    
-    active_users = CustomUser.objects.filter(is_active=True).count()
-    inactive_users = CustomUser.objects.filter(is_active=False).count()
-    super_admins = CustomUser.objects.filter(is_superuser=True).count()
-    
-    stats = {
-        'totalUsers': total_users,
-        'activeUsers': active_users,
-        'inactiveUsers': inactive_users,
-        'superAdmins': super_admins,
-        'newUsersToday': new_users_today,
-        'newUsersThisWeek': new_users_week,
-        'newUsersThisMonth': new_users_month,
-        'lastUpdated': timezone.now().isoformat()
-    }
+    # Served from a short-lived snapshot so dashboard refreshes stay cheap;
+    # ?refresh=1 forces a recount
+    stats = None
+    if request.query_params.get('refresh') not in ('1', 'true'):
+        stats = cache.get(ADMIN_STATS_CACHE_KEY)
+        registry.inc('cache_requests_total', cache='admin_stats', result='miss' if stats is None else 'hit')
+    if stats is None:
+        stats = build_admin_stats()
+        cache.set(ADMIN_STATS_CACHE_KEY, stats, settings.ADMIN_STATS_CACHE_TTL)
     
     return Response({
         'message': 'Stats retrieved successfully',
         'stats': stats
     }, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def admin_auth_cache_stats(request):
+    """Hit rate of the per-token user cache (for this worker process)"""
+    if not is_super_admin(request.user):
+        return Response({
+            'message': 'Permission denied. Super admin access required.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    return Response({
+        'message': 'Auth cache stats retrieved successfully',
+        'stats': user_cache_stats()
+    }, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def debug_users_table(request):
@@ -214,21 +480,21 @@ def debug_users_table(request):
             'message': 'Permission denied. Super admin access required.'
         }, status=status.HTTP_403_FORBIDDEN)
     
+    users = filter_admin_users(request.query_params).values(
+        'id', 'username', 'email', 'is_active', 'is_superuser', 'password', 'created_at', 'last_login'
+    )
+    paginator = AdminUserPagination()
+    page = paginator.paginate_queryset(users, request)
+
     users_data = []
-    for user in CustomUser.objects.all():
-        users_data.append({
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'is_active': user.is_active,
-            'is_superuser': user.is_superuser,
-            'password_hash': user.password[:50] + "..." if user.password else None,
-            'created_at': user.created_at,
-            'last_login': user.last_login
-        })
+    for user in page:
+        password = user.pop('password')
+        user['password_hash'] = password[:50] + "..." if password else None
+        users_data.append(user)
     
     return Response({
         'message': 'Debug data retrieved',
-        'total_count': len(users_data),
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
         'users': users_data
     }, status=status.HTTP_200_OK)
@@ -1,6 +1,33 @@
 from django.apps import AppConfig
 
 
+def auth_cache_metrics():
+    """JWT user cache and blacklist Bloom filter lookups, for /metrics/"""
+    from .authentication import stats
+    from .blacklist import blacklist_filter
+
+    bloom = blacklist_filter.stats()
+    return [
+        ('cache_requests_total', {'cache': 'jwt_user', 'result': 'hit'}, stats.hits),
+        ('cache_requests_total', {'cache': 'jwt_user', 'result': 'miss'}, stats.misses),
+        # A Bloom "hit" is a check answered from memory without the database
+        ('cache_requests_total', {'cache': 'token_blacklist_bloom', 'result': 'hit'},
+         bloom['checks'] - bloom['databaseChecks']),
+        ('cache_requests_total', {'cache': 'token_blacklist_bloom', 'result': 'miss'}, bloom['databaseChecks']),
+    ]
+
+
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from beyond_words.metrics import register_collector
+        from .authentication import user_changed
+        from .models import CustomUser
+
+        register_collector(auth_cache_metrics)
+        # Deactivations, password and profile changes, deletions - from any code path
+        post_save.connect(user_changed, sender=CustomUser, dispatch_uid='auth-user-cache-save')
+        post_delete.connect(user_changed, sender=CustomUser, dispatch_uid='auth-user-cache-delete')
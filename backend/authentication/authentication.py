@@ -0,0 +1,238 @@
+"""
+JWT authentication that remembers the user behind each access token.
+
+simplejwt's JWTAuthentication loads the CustomUser row on every request.
+CachedJWTAuthentication keeps the resolved user per token id (jti),
+either in the Django cache named by JWT_USER_CACHE_ALIAS so all workers
+share it (until the token expires), or in a bounded in-process LRU (the
+default).
+
+Saving or deleting a user invalidates its entries through the post_save /
+post_delete receivers below; code that bypasses signals (queryset
+update()) must call invalidate_user() or invalidate_all_users() itself. That only reaches this
+process's LRU, so its entries also expire after JWT_USER_CACHE_TTL
+seconds: another worker serves a deactivated user for at most that long.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+class LRUUserCache:
+    """Bounded, thread-safe in-process cache of (user_id, jti) -> user"""
+
+    backend = 'lru'
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.keys_by_user = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id, jti):
+        with self.lock:
+            entry = self.entries.get(jti)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(jti, user.pk)
+                return None
+            self.entries.move_to_end(jti)
+        # Hand out a copy so one request can't mutate another's request.user
+        return copy.copy(user)
+
+    def set(self, user_id, jti, user, timeout):
+        with self.lock:
+            self.entries[jti] = (user, time.time() + min(timeout, self.ttl))
+            self.entries.move_to_end(jti)
+            self.keys_by_user.setdefault(user_id, set()).add(jti)
+            while len(self.entries) > self.max_size:
+                old_jti, (old_user, _) = self.entries.popitem(last=False)
+                self._forget_key(old_user.pk, old_jti)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            for jti in self.keys_by_user.pop(user_id, ()):
+                self.entries.pop(jti, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_user.clear()
+
+    def size(self):
+        return len(self.entries)
+
+    def _remove(self, jti, user_id):
+        self.entries.pop(jti, None)
+        self._forget_key(user_id, jti)
+
+    def _forget_key(self, user_id, jti):
+        keys = self.keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(jti)
+            if not keys:
+                del self.keys_by_user[user_id]
+
+
+class SharedUserCache:
+    """
+    Users cached in a Django cache backend. Each user has a generation
+    counter; invalidating bumps it, which orphans every cached token entry
+    for that user without having to know their jtis. A global generation
+    does the same for everyone at once.
+    """
+
+    backend = 'django-cache'
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    global_generation_key = 'jwt-user-gen:*'
+
+    def _keys(self, user_id, jti):
+        return f'jwt-user:{jti}', f'jwt-user-gen:{user_id}'
+
+    def _generations(self, found, generation_key):
+        return found.get(generation_key, 0), found.get(self.global_generation_key, 0)
+
+    def get(self, user_id, jti):
+        entry_key, generation_key = self._keys(user_id, jti)
+        found = self.cache.get_many([entry_key, generation_key, self.global_generation_key])
+        entry = found.get(entry_key)
+        if entry is None:
+            return None
+        generations, user = entry
+        if generations != self._generations(found, generation_key):
+            return None
+        return user
+
+    def set(self, user_id, jti, user, timeout):
+        entry_key, generation_key = self._keys(user_id, jti)
+        found = self.cache.get_many([generation_key, self.global_generation_key])
+        self.cache.set(entry_key, (self._generations(found, generation_key), user), timeout)
+
+    def _bump(self, key):
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # No counter yet: start one that outlives any token issued now
+            self.cache.set(key, 1, timeout=None)
+
+    def invalidate(self, user_id):
+        self._bump(self._keys(user_id, '')[1])
+
+    def clear(self):
+        self._bump(self.global_generation_key)
+
+    def size(self):
+        return None
+
+
+class UserCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def _build_user_cache():
+    alias = getattr(settings, 'JWT_USER_CACHE_ALIAS', '')
+    if alias:
+        return SharedUserCache(alias)
+    return LRUUserCache(
+        getattr(settings, 'JWT_USER_CACHE_SIZE', 10000),
+        getattr(settings, 'JWT_USER_CACHE_TTL', 30),
+    )
+
+
+user_cache = _build_user_cache()
+stats = UserCacheStats()
+
+
+def invalidate_user(user_id):
+    """Drop cached copies of a user after their account changed"""
+    user_cache.invalidate(user_id)
+
+
+def invalidate_all_users():
+    """Drop every cached user, for bulk changes that don't say which rows they hit"""
+    user_cache.clear()
+
+
+def user_changed(sender, instance, using=None, **kwargs):
+    """post_save / post_delete receiver, connected in AuthenticationConfig.ready"""
+    user_id = instance.pk
+    invalidate_user(user_id)
+    # Again once committed: a request in between may have cached the old row
+    transaction.on_commit(lambda: invalidate_user(user_id), using=using)
+
+
+def user_cache_stats():
+    total = stats.hits + stats.misses
+    return {
+        'backend': user_cache.backend,
+        'hits': stats.hits,
+        'misses': stats.misses,
+        'hitRate': round(stats.hits / total, 4) if total else None,
+        'size': user_cache.size(),
+    }
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        expires_at = validated_token.get('exp')
+        if user_id is None or jti is None or expires_at is None:
+            return super().get_user(validated_token)
+
+        user = user_cache.get(user_id, jti)
+        stats.record(hit=user is not None)
+        if user is not None:
+            return user
+
+        # Raises AuthenticationFailed for missing/inactive users - not cached
+        user = super().get_user(validated_token)
+        timeout = expires_at - time.time()
+        if timeout > 0:
+            user_cache.set(user_id, jti, user, timeout)
+        return user
+
+
+def request_user(request):
+    """
+    The authenticated user behind a plain Django view's request (JWT bearer
+    token first, then the session), or None. Sync only - async views call
+    it through sync_to_async.
+    """
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    if result is not None:
+        return result[0]
+    user = getattr(request, 'user', None)
+    return user if user is not None and user.is_authenticated else None
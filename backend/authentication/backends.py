@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticate with email + password.
+
+    One indexed lookup on email and exactly one password hash per attempt:
+    unknown emails still run the hasher once (against a throwaway user) so a
+    failed login takes the same time whether or not the account exists.
+    """
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+
+        user = UserModel._default_manager.filter(email=email).order_by('pk').first()
+        if user is None:
+            # Run the default password hasher once to keep timing constant
+            UserModel().set_password(password)
+            return None
+
+        if not user.check_password(password):
+            return None
+        if self.user_can_authenticate(user):
+            return user
+
+        # Right password but deactivated account: let the caller say so
+        # without another lookup or hash
+        if request is not None:
+            request.inactive_user = True
+        return None
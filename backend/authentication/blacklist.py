@@ -0,0 +1,192 @@
+"""
+In-memory Bloom filter in front of simplejwt's refresh token blacklist.
+
+Every refresh/logout used to ask the database whether the token's jti is
+blacklisted. Almost none are, so a Bloom filter over the blacklisted jtis
+answers "definitely not blacklisted" from memory and only possible hits
+(real ones plus ~TOKEN_BLACKLIST_BLOOM_ERROR_RATE false positives) fall
+through to the database.
+
+The filter is built from the database on first use in each process and
+updated locally on logout. Tokens blacklisted by *other* workers are
+picked up by an incremental sync: rows blacklisted since the newest one
+already seen, minus TOKEN_BLACKLIST_BLOOM_SYNC_OVERLAP seconds for rows
+whose transaction committed late (ids and timestamps are not committed
+in order).
+
+The filter needs TOKEN_BLACKLIST_EPOCH_CACHE: a cache all workers share.
+Every blacklisting bumps a counter there, and a worker that sees a new
+value syncs before answering, so a token revoked on one worker is refused
+on the others straight away. Without a shared cache a miss couldn't be
+trusted, so the filter is switched off entirely: checks go straight to
+the database, as in plain simplejwt, with no filter builds or syncs on top.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        # Double hashing: k positions from two independent 64-bit hashes
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+EPOCH_KEY = 'token-blacklist:epoch'
+
+
+class BlacklistFilter:
+    """Per-process Bloom filter of blacklisted refresh token jtis"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.watermark = None  # blacklisted_at of the newest row loaded
+        self.epoch = None
+        self.last_sync = 0.0
+        self.checks = 0
+        self.database_checks = 0
+
+    @property
+    def sync_interval(self):
+        return getattr(settings, 'TOKEN_BLACKLIST_BLOOM_SYNC_SECONDS', 5)
+
+    @property
+    def epoch_cache(self):
+        alias = getattr(settings, 'TOKEN_BLACKLIST_EPOCH_CACHE', '')
+        return caches[alias] if alias else None
+
+    @property
+    def authoritative(self):
+        """Whether a miss can be trusted without asking the database"""
+        return self.epoch_cache is not None
+
+    def current_epoch(self):
+        epoch_cache = self.epoch_cache
+        return epoch_cache.get(EPOCH_KEY, 0) if epoch_cache is not None else None
+
+    def bump_epoch(self):
+        epoch_cache = self.epoch_cache
+        if epoch_cache is None:
+            return
+        try:
+            epoch_cache.incr(EPOCH_KEY)
+        except ValueError:
+            epoch_cache.set(EPOCH_KEY, 1, timeout=None)
+
+    def _add(self, bloom, jti):
+        # Syncs overlap, so the same jti comes by more than once
+        if jti not in bloom:
+            bloom.add(jti)
+
+    def rebuild(self):
+        """Load every blacklisted jti from the database into a fresh filter"""
+        with self.lock:
+            # Read first: a bump during the load makes the next check sync again
+            epoch = self.current_epoch()
+            total = BlacklistedToken.objects.count()
+            capacity = max(getattr(settings, 'TOKEN_BLACKLIST_BLOOM_CAPACITY', 100000), total * 2)
+            bloom = BloomFilter(capacity, getattr(settings, 'TOKEN_BLACKLIST_BLOOM_ERROR_RATE', 0.001))
+            watermark = None
+            rows = BlacklistedToken.objects.order_by('id').values_list('blacklisted_at', 'token__jti')
+            for blacklisted_at, jti in rows.iterator(chunk_size=5000):
+                self._add(bloom, jti)
+                watermark = blacklisted_at if watermark is None else max(watermark, blacklisted_at)
+            self.bloom, self.watermark, self.epoch = bloom, watermark, epoch
+            self.last_sync = time.monotonic()
+
+    def sync(self):
+        """Add jtis blacklisted since the last sync (e.g. by other workers)"""
+        with self.lock:
+            epoch = self.current_epoch()
+            rows = BlacklistedToken.objects.all()
+            if self.watermark is not None:
+                overlap = timedelta(seconds=getattr(settings, 'TOKEN_BLACKLIST_BLOOM_SYNC_OVERLAP', 60))
+                rows = rows.filter(blacklisted_at__gte=self.watermark - overlap)
+            for blacklisted_at, jti in rows.values_list('blacklisted_at', 'token__jti'):
+                self._add(self.bloom, jti)
+                self.watermark = blacklisted_at if self.watermark is None else max(self.watermark, blacklisted_at)
+            self.epoch = epoch
+            self.last_sync = time.monotonic()
+            overfull = self.bloom.count > self.bloom.capacity
+        if overfull:
+            self.rebuild()
+
+    def is_stale(self):
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            return True
+        return self.authoritative and self.current_epoch() != self.epoch
+
+    def might_contain(self, jti):
+        if self.bloom is None:
+            self.rebuild()
+        elif self.is_stale():
+            self.sync()
+        self.checks += 1
+        return jti in self.bloom
+
+    def add(self, jti):
+        if not self.authoritative:
+            return
+        with self.lock:
+            # Not built yet: the build will read the row from the database
+            if self.bloom is not None:
+                self._add(self.bloom, jti)
+        # Once the blacklist row is visible, tell the other workers
+        transaction.on_commit(self.bump_epoch)
+
+    def stats(self):
+        return {
+            'checks': self.checks,
+            'databaseChecks': self.database_checks,
+            'entries': self.bloom.count if self.bloom else 0,
+            'authoritative': self.authoritative,
+        }
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class BloomRefreshToken(RefreshToken):
+    """RefreshToken whose blacklist check consults the Bloom filter first"""
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if blacklist_filter.authoritative and not blacklist_filter.might_contain(jti):
+            return
+        blacklist_filter.database_checks += 1
+        super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted refresh tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='How many tokens to delete per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        expired = OutstandingToken.objects.filter(expires_at__lte=now).order_by('id')
+
+        outstanding_deleted = 0
+        blacklisted_deleted = 0
+        while True:
+            # Small batches keep each DELETE short so logins and refreshes
+            # aren't stuck behind one huge transaction
+            ids = list(expired.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            blacklisted_deleted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+            outstanding_deleted += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {outstanding_deleted} expired outstanding tokens '
+            f'and {blacklisted_deleted} blacklisted tokens'
+        ))
@@ -17,12 +17,15 @@ class CustomUser(AbstractUser):
     first_name = models.CharField(max_length=150, blank=True, default="")
     last_name = models.CharField(max_length=150, blank=True, default="")
 
+    # Indexed because sign in looks users up by email (authentication.backends)
+    email = models.EmailField('email address', blank=True, db_index=True)
+
     # Add a name field to store the concatenated full name
     name = models.CharField(max_length=255, blank=True)
 
     age_group = models.CharField(max_length=10, choices=AGE_CHOICES, blank=True)
     is_superadmin = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     # Add these to fix the reverse accessor conflicts
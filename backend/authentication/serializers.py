@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from .blacklist import BloomRefreshToken
 from .models import CustomUser
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -88,3 +90,21 @@ class UserSerializer(serializers.ModelSerializer):
         Custom method to get a user's name for display, defaulting to email.
         """
         return obj.first_name if obj.first_name else obj.email
+
+
+class AdminUserSerializer(serializers.ModelSerializer):
+    """
+    Row shape for the SuperAdmin user listing and CSV export.
+    The listing only SELECTs these columns, so keep the two in step.
+    """
+
+    class Meta:
+        model = CustomUser
+        fields = ['id', 'username', 'email', 'name', 'first_name', 'last_name', 'age_group',
+                  'is_active', 'is_superuser', 'created_at', 'last_login']
+        read_only_fields = fields
+
+
+class BloomTokenRefreshSerializer(TokenRefreshSerializer):
+    """Token refresh whose blacklist check goes through the Bloom filter"""
+    token_class = BloomRefreshToken
@@ -1,3 +1,392 @@
-from django.test import TestCase
+"""
+Tests for the auth and SuperAdmin routes: query counts against a small
+and a large user base with the same expectations, plus email login, the
+JWT user cache, the token blacklist filter and bulk action safeguards.
+"""
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from stories.tests import LARGE_DATASET, SMALL_DATASET, seed_stories, seed_users
+from .backends import EmailBackend
+from .blacklist import blacklist_filter
+from .models import CustomUser
+
+PASSWORD = 'correct-horse-battery'
+
+
+class AuthRouteQueries:
+    dataset_size = SMALL_DATASET
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_stories(cls.dataset_size)
+        seed_users(cls.dataset_size)
+        cls.admin = CustomUser.objects.create_superuser(
+            username='admin@example.com', email='admin@example.com', password=PASSWORD,
+        )
+        cls.reader = CustomUser.objects.get(username='reader0')
+
+    def setUp(self):
+        # Admin stats are cached and the blacklist filter is per process;
+        # start every test cold so the counts don't depend on test order
+        cache.clear()
+        blacklist_filter.bloom = None
+        # With a shared epoch cache (LocMem stands in for redis here) the
+        # filter answers misses on its own
+        no_resync = override_settings(TOKEN_BLACKLIST_BLOOM_SYNC_SECONDS=3600, TOKEN_BLACKLIST_EPOCH_CACHE='default')
+        no_resync.enable()
+        self.addCleanup(no_resync.disable)
+        self.client.force_authenticate(self.admin)
+
+    def assertQueries(self, count, method, url, **kwargs):
+        with self.assertNumQueries(count):
+            response = getattr(self.client, method)(url, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+        return response
+
+    # SuperAdmin routes
+
+    def test_admin_users_list(self):
+        response = self.assertQueries(1, 'get', '/api/auth/admin/users/')
+        self.assertEqual(len(response.data['users']), min(self.dataset_size + 1, 20))
+
+    def test_admin_users_list_filtered(self):
+        self.assertQueries(1, 'get', '/api/auth/admin/users/?q=reader&is_active=true&created_after=2000-01-01')
+
+    def test_admin_users_export_streams_in_one_query(self):
+        self.assertQueries(1, 'get', '/api/auth/admin/users/export/')
+
+    async def test_admin_users_export_streams_under_asgi(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.admin).access_token))()
+        response = await self.async_client.get('/api/auth/admin/users/export/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), 1 + self.dataset_size + 1)
+
+    def test_admin_user_detail(self):
+        self.assertQueries(1, 'get', f'/api/auth/admin/users/{self.reader.id}/')
+
+    def test_admin_update_user(self):
+        self.assertQueries(2, 'put', f'/api/auth/admin/users/{self.reader.id}/update/',
+                           data={'is_active': False}, format='json')
+
+    def test_admin_delete_user(self):
+        # Fetch, then the delete cascade: groups, permissions, tokens, admin log, user
+        self.assertQueries(6, 'delete', f'/api/auth/admin/users/{self.reader.id}/delete/')
+
+    def test_bulk_deactivate_and_activate(self):
+        # A single UPDATE with the filters and exclusions in its WHERE
+        response = self.assertQueries(1, 'post', '/api/auth/admin/users/bulk/deactivate/',
+                                      data={'filter': {'q': 'reader'}}, format='json')
+        self.assertEqual(response.data['updated'], self.dataset_size)
+        self.assertQueries(1, 'post', '/api/auth/admin/users/bulk/activate/',
+                           data={'ids': [self.reader.id, self.admin.id]}, format='json')
+
+    def test_bulk_delete(self):
+        ids = list(CustomUser.objects.filter(username__startswith='reader').values_list('pk', flat=True)[:3])
+        # Group and permission links, admin log, token owners, then the users
+        # (plus the savepoint pair around them)
+        response = self.assertQueries(7, 'post', '/api/auth/admin/users/bulk/delete/',
+                                      data={'ids': ids + [self.admin.id]}, format='json')
+        self.assertEqual(response.data['deleted'], len(ids))
+        self.assertTrue(CustomUser.objects.filter(pk=self.admin.pk).exists())
+
+    def test_bulk_delete_by_filter(self):
+        # However many users match: no collecting, no 100-row batches
+        response = self.assertQueries(7, 'post', '/api/auth/admin/users/bulk/delete/',
+                                      data={'filter': {'q': 'reader'}}, format='json')
+        self.assertEqual(response.data['deleted'], self.dataset_size)
+        self.assertFalse(CustomUser.objects.filter(username__startswith='reader').exists())
+
+    def test_admin_stats(self):
+        # One aggregate over users, one over stories; then served from cache
+        self.assertQueries(2, 'get', '/api/auth/admin/stats/')
+        self.assertQueries(0, 'get', '/api/auth/admin/stats/')
+
+    def test_admin_auth_cache_stats(self):
+        self.assertQueries(0, 'get', '/api/auth/admin/auth-cache/')
+
+    def test_debug_users_table(self):
+        self.assertQueries(1, 'get', '/api/auth/admin/debug/users/')
+
+    # Authentication routes
+
+    def test_signup(self):
+        client = APIClient()
+        with self.assertNumQueries(3):
+            response = client.post('/api/auth/signup/', {
+                'username': 'new@example.com', 'email': 'new@example.com',
+                'password': 'Str0ng-pass!', 'password2': 'Str0ng-pass!',
+                'first_name': 'New', 'last_name': 'Reader', 'age_group': '7-12',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_signin(self):
+        client = APIClient()
+        # User lookup + outstanding refresh token row
+        with self.assertNumQueries(2):
+            response = client.post('/api/auth/signin/', {
+                'email': 'admin@example.com', 'password': PASSWORD,
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_rotates_and_blacklists(self):
+        client = APIClient()
+        refresh = str(RefreshToken.for_user(self.admin))
+        with self.assertNumQueries(7):
+            response = client.post('/api/auth/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # The old token is now known to the Bloom filter and the database
+        self.assertEqual(client.post('/api/auth/refresh/', {'refresh': refresh}, format='json').status_code, 401)
+
+    def test_logout(self):
+        refresh = RefreshToken.for_user(self.admin)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        # User, Bloom filter build (count + load), token lookups, blacklist insert
+        with self.assertNumQueries(8):
+            response = client.post('/api/auth/logout/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_with_jwt_caches_the_user(self):
+        refresh = RefreshToken.for_user(self.admin)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        with self.assertNumQueries(1):
+            self.assertEqual(client.get('/api/auth/user/profile/').status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/auth/user/profile/').status_code, 200)
+
+
+class SmallDatasetAuthQueryTests(AuthRouteQueries, APITestCase):
+    dataset_size = SMALL_DATASET
+
+
+class LargeDatasetAuthQueryTests(AuthRouteQueries, APITestCase):
+    dataset_size = LARGE_DATASET
+
+
+class EmailLoginTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='reader', email='reader@example.com', password=PASSWORD,
+        )
+
+    def signin(self, email, password):
+        return self.client.post('/api/auth/signin/', {'email': email, 'password': password}, format='json')
+
+    def test_signin_with_email(self):
+        response = self.signin('reader@example.com', PASSWORD)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['email'], 'reader@example.com')
+        self.assertIn('access', response.data)
+
+    def test_wrong_password_and_unknown_email(self):
+        for email, password in (('reader@example.com', 'wrong'), ('nobody@example.com', PASSWORD)):
+            with self.subTest(email=email):
+                response = self.signin(email, password)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response.data['message'], 'Invalid credentials')
+
+    def test_one_hash_per_attempt(self):
+        # Unknown emails still pay for one hash, so timing doesn't reveal accounts
+        for email in ('reader@example.com', 'nobody@example.com'):
+            with self.subTest(email=email), mock.patch(
+                'django.contrib.auth.base_user.make_password', wraps=make_password,
+            ) as hashed, mock.patch(
+                'django.contrib.auth.base_user.check_password', return_value=False,
+            ) as checked:
+                self.assertIsNone(authenticate(email=email, password='wrong'))
+                self.assertEqual(hashed.call_count + checked.call_count, 1)
+
+    def test_deactivated_account(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.signin('reader@example.com', PASSWORD)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['message'], 'User account is deactivated')
+        # A wrong password doesn't reveal that the account exists but is disabled
+        self.assertEqual(self.signin('reader@example.com', 'wrong').data['message'], 'Invalid credentials')
+
+    def test_needs_email_and_password(self):
+        backend = EmailBackend()
+        self.assertIsNone(backend.authenticate(None, username='reader', password=PASSWORD))
+        self.assertIsNone(backend.authenticate(None, email='reader@example.com'))
+
+
+class UserCacheInvalidationTests(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password=PASSWORD)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}',
+        )
+        self.assertEqual(self.profile().status_code, 200)
+
+    def profile(self):
+        return self.client.get('/api/auth/user/profile/')
+
+    def test_deactivate_is_seen_by_the_next_request(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.profile().status_code, 401)
+
+    def test_password_change_drops_the_cached_user(self):
+        self.user.set_password('another-horse-battery')
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.profile().status_code, 200)
+
+    def test_delete(self):
+        self.user.delete()
+        self.assertEqual(self.profile().status_code, 401)
+
+    def test_uninvalidated_entries_expire(self):
+        # update() skips the signals, like a change made by another worker
+        # would from this process's point of view
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.profile().status_code, 200)
+        later = time.time() + settings.JWT_USER_CACHE_TTL + 1
+        with mock.patch('authentication.authentication.time.time', return_value=later):
+            self.assertEqual(self.profile().status_code, 401)
+
+
+@override_settings(TOKEN_BLACKLIST_BLOOM_SYNC_SECONDS=3600)
+class BlacklistSyncTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        blacklist_filter.bloom = None
+        self.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password=PASSWORD)
+
+    def refresh(self, token):
+        return self.client.post('/api/auth/refresh/', {'refresh': str(token)}, format='json')
+
+    def blacklist_elsewhere(self, token):
+        """What another worker's logout leaves behind: the row, but nothing in our filter"""
+        outstanding = OutstandingToken.objects.get(jti=token['jti'])
+        return BlacklistedToken.objects.create(token=outstanding)
+
+    def test_filter_is_off_without_a_shared_cache(self):
+        token = RefreshToken.for_user(self.user)
+        self.blacklist_elsewhere(token)
+        # Just simplejwt's own lookup: no filter build or sync queries
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertFalse(any('token_blacklist_blacklistedtoken' in query['sql'] and 'COUNT' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertIsNone(blacklist_filter.bloom)
+
+        # Logging out doesn't build it either
+        other = RefreshToken.for_user(self.user)
+        other.blacklist()
+        self.assertIsNone(blacklist_filter.bloom)
+        self.assertEqual(self.refresh(other).status_code, 401)
+
+    @override_settings(TOKEN_BLACKLIST_EPOCH_CACHE='default')
+    def test_epoch_bump_syncs_other_workers(self):
+        token = RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(RefreshToken.for_user(self.user)).status_code, 200)
+        self.blacklist_elsewhere(token)
+        blacklist_filter.bump_epoch()
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    @override_settings(TOKEN_BLACKLIST_EPOCH_CACHE='default', TOKEN_BLACKLIST_BLOOM_SYNC_SECONDS=0)
+    def test_late_commits_are_picked_up(self):
+        late, newer = RefreshToken.for_user(self.user), RefreshToken.for_user(self.user)
+        blacklist_filter.might_contain('warm-up')
+        self.blacklist_elsewhere(newer)
+        blacklist_filter.might_contain('sync')
+        # Stamped before the row the last sync saw, committed after it
+        row = self.blacklist_elsewhere(late)
+        BlacklistedToken.objects.filter(pk=row.pk).update(
+            blacklisted_at=blacklist_filter.watermark - timedelta(seconds=5),
+        )
+        self.assertTrue(blacklist_filter.might_contain(late['jti']))
+        self.assertEqual(self.refresh(late).status_code, 401)
+
+
+class BulkActionSafeguardTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_users(3)
+        cls.admin = CustomUser.objects.create_superuser(
+            username='admin@example.com', email='admin@example.com', password=PASSWORD,
+        )
+        cls.other_admin = CustomUser.objects.create_superuser(
+            username='root@example.com', email='root@example.com', password=PASSWORD,
+        )
+        # Staff but not superuser: bulk actions may still touch it
+        cls.staff = CustomUser.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password=PASSWORD, is_staff=True,
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def post(self, action, body):
+        return self.client.post(f'/api/auth/admin/users/bulk/{action}/', body, format='json')
+
+    def test_unknown_or_empty_filters_are_rejected(self):
+        for body in ({'filter': {'typo': 1}}, {'filter': {'q': 'reader', 'typo': 1}},
+                     {'filter': {'q': ''}}, {'filter': {'q': '  ', 'age_group': None}}, {'filter': {}}, {}):
+            for action in ('delete', 'deactivate'):
+                with self.subTest(body=body, action=action):
+                    self.assertEqual(self.post(action, body).status_code, 400)
+        self.assertEqual(CustomUser.objects.count(), 6)
+        self.assertFalse(CustomUser.objects.filter(is_active=False).exists())
+
+    def test_superusers_and_self_are_never_touched(self):
+        everyone = {'filter': {'created_after': '2000-01-01'}}
+        self.assertEqual(self.post('deactivate', everyone).data['updated'], 4)
+        self.assertTrue(CustomUser.objects.get(pk=self.other_admin.pk).is_active)
+        self.assertTrue(CustomUser.objects.get(pk=self.admin.pk).is_active)
+
+        ids = {'ids': [self.admin.pk, self.other_admin.pk, self.staff.pk]}
+        self.assertEqual(self.post('delete', ids).data['deleted'], 1)
+        self.assertEqual(self.post('delete', everyone).data['deleted'], 3)
+        self.assertEqual(set(CustomUser.objects.values_list('pk', flat=True)), {self.admin.pk, self.other_admin.pk})
+
+    def test_deactivated_users_lose_cached_sessions(self):
+        reader = CustomUser.objects.get(username='reader0')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(reader).access_token}')
+        self.assertEqual(client.get('/api/auth/user/profile/').status_code, 200)
+        self.post('deactivate', {'filter': {'q': 'reader0'}})
+        self.assertEqual(client.get('/api/auth/user/profile/').status_code, 401)
+
+    def test_bulk_delete_clears_dependent_rows(self):
+        reader = CustomUser.objects.get(username='reader0')
+        reader.groups.add(Group.objects.create(name='editors'))
+        reader.user_permissions.add(Permission.objects.first())
+        LogEntry.objects.create(user=reader, action_flag=1, object_repr='story')
+        token = RefreshToken.for_user(reader)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.access_token}')
+        self.assertEqual(client.get('/api/auth/user/profile/').status_code, 200)
+
+        self.assertEqual(self.post('delete', {'ids': [reader.pk]}).data['deleted'], 1)
+        self.assertFalse(CustomUser.groups.through.objects.exists())
+        self.assertFalse(LogEntry.objects.exists())
+        self.assertIsNone(OutstandingToken.objects.get(jti=token['jti']).user)
+        # Dropped from the JWT user cache without a per-row signal
+        self.assertEqual(client.get('/api/auth/user/profile/').status_code, 401)
@@ -1,4 +1,5 @@
 from django.urls import path
+from rest_framework_simplejwt.views import TokenRefreshView
 from . import views
 from . import admin  # Import admin module
 
@@ -7,13 +8,19 @@ urlpatterns = [
     path('signup/', views.signup_view, name='signup'),
     path('signin/', views.signin_view, name='signin'),
     path('logout/', views.logout_view, name='logout'),
+    path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     # Admin endpoints (from admin.py)
     path('admin/users/', admin.admin_users_list, name='admin_users_list'),
+    path('admin/users/export/', admin.admin_users_export, name='admin_users_export'),
+    path('admin/users/bulk/activate/', admin.admin_bulk_activate, name='admin_bulk_activate'),
+    path('admin/users/bulk/deactivate/', admin.admin_bulk_deactivate, name='admin_bulk_deactivate'),
+    path('admin/users/bulk/delete/', admin.admin_bulk_delete, name='admin_bulk_delete'),
     path('admin/users/<int:user_id>/', admin.admin_user_detail, name='admin_user_detail'),
     path('admin/users/<int:user_id>/update/', admin.admin_update_user, name='admin_update_user'),
     path('admin/users/<int:user_id>/delete/', admin.admin_delete_user, name='admin_delete_user'),
     path('admin/stats/', admin.admin_stats, name='admin_stats'),
+    path('admin/auth-cache/', admin.admin_auth_cache_stats, name='admin_auth_cache_stats'),
     path('admin/debug/users/', admin.debug_users_table, name='debug_users_table'),
     # User Profile endpoint - FIXED
     path('user/profile/', views.UserProfileView.as_view(), name='user-profile'),
@@ -7,6 +7,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from .serializers import UserRegistrationSerializer, UserLoginSerializer, UserSerializer
 from .models import CustomUser
+from .blacklist import BloomRefreshToken
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -47,62 +48,33 @@ def signup_view(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def signin_view(request):
-    print("=== SIGNIN DEBUG ===")
-    print("Request data:", request.data)
-
     serializer = UserLoginSerializer(data=request.data)
 
     if serializer.is_valid():
         email = serializer.validated_data['email']
         password = serializer.validated_data['password']
 
-        print(f"Trying to authenticate email: {email}")
+        # authentication.backends.EmailBackend: one lookup, one password hash
+        user = authenticate(request, email=email, password=password)
 
-        try:
-            user = CustomUser.objects.get(email=email)
-            print(f"User found: {user.username}, active: {user.is_active}")
-
-            if not user.is_active:
-                print("User is not active")
+        if user is None:
+            if getattr(request, 'inactive_user', False):
                 return Response({
                     'message': 'User account is deactivated'
                 }, status=status.HTTP_401_UNAUTHORIZED)
+            return Response({
+                'message': 'Invalid credentials'
+            }, status=status.HTTP_401_UNAUTHORIZED)
 
-            authenticated_user = authenticate(username=email, password=password)
-            print(f"Authentication with email as username: {authenticated_user}")
-
-            if not authenticated_user:
-                authenticated_user = authenticate(username=user.username, password=password)
-                print(f"Authentication with username: {authenticated_user}")
-
-            if not authenticated_user:
-                if user.check_password(password):
-                    print("Password is correct, using user directly")
-                    authenticated_user = user
-                else:
-                    print("Password check failed")
-
-            if authenticated_user:
-                refresh = RefreshToken.for_user(authenticated_user)
+        refresh = RefreshToken.for_user(user)
 
-                return Response({
-                    'message': 'Login successful',
-                    'access': str(refresh.access_token),
-                    'refresh': str(refresh),
-                    'user': UserLoginSerializer(authenticated_user).data
-                }, status=status.HTTP_200_OK)
-            else:
-                print("Authentication failed - invalid credentials")
-                return Response({
-                    'message': 'Invalid credentials'
-                }, status=status.HTTP_401_UNAUTHORIZED)
-        except CustomUser.DoesNotExist:
-            print("User does not exist")
-            return Response({
-                'message': 'User does not exist'
-            }, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'message': 'Login successful',
+            'access': str(refresh.access_token),
+            'refresh': str(refresh),
+            'user': UserSerializer(user).data
+        }, status=status.HTTP_200_OK)
     else:
-        print("Serializer errors:", serializer.errors)
         return Response({
             'message': 'Invalid data',
             'errors': serializer.errors
@@ -112,7 +84,7 @@ def signin_view(request):
 def logout_view(request):
     try:
         refresh_token = request.data["refresh"]
-        token = RefreshToken(refresh_token)
+        token = BloomRefreshToken(refresh_token)
         token.blacklist()
         return Response({'message': 'Logout successful'}, status=status.HTTP_200_OK)
     except Exception as e:
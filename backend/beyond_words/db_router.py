@@ -0,0 +1,89 @@
+"""
+Optional read replica for the read-heavy story and analysis tables.
+
+With REPLICA_DATABASE_URL set, settings.py adds a ``replica`` database and
+PrimaryReplicaRouter sends reads of the ``stories`` and ``analysis`` apps
+there. Everything else - writes, auth/session/admin tables, anything
+inside a transaction - stays on ``default``. As soon as a request writes
+anything it is pinned to the primary for the rest of that request, so it
+always reads its own writes. Without a replica the router does nothing.
+
+The pin lives in a context variable that ReplicaPinMiddleware resets for
+every request, so it works the same for threaded and async workers.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+REPLICA_APPS = {'stories', 'analysis'}
+
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+
+
+def pin_to_primary():
+    """Send the rest of this request's reads to the primary"""
+    _pinned_to_primary.set(True)
+
+
+def is_pinned_to_primary():
+    return _pinned_to_primary.get()
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in REPLICA_APPS or not replica_configured():
+            return None
+        if _pinned_to_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        databases = {DEFAULT_DB_ALIAS, REPLICA_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # No opinion: `migrate` only runs against the primary anyway, and
+        # the test runner can then build both databases
+        return None
+
+
+class ReplicaPinMiddleware:
+    """Start every request unpinned and forget the pin afterwards"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pinned_to_primary.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned_to_primary.reset(token)
+
+    async def __acall__(self, request):
+        token = _pinned_to_primary.set(False)
+        try:
+            return await self.get_response(request)
+        finally:
+            _pinned_to_primary.reset(token)
@@ -0,0 +1,145 @@
+"""
+Hero video lookup and delivery.
+
+The files are found once (on first use, or by gunicorn.conf.py before the
+workers fork) and kept in a manifest, so the metadata endpoint never
+touches the filesystem. The videos themselves are streamed from disk a
+chunk at a time (under ASGI too) with HTTP Range support: browsers can
+start playing and seek without downloading the whole file. URLs carry a
+version derived from size and mtime, so responses can be cached for a
+year.
+"""
+import re
+from functools import lru_cache
+from hashlib import md5
+from pathlib import Path
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .streaming import streaming_body
+
+# Both spellings have been used for the file name
+VIDEO_NAMES = ('hero_video', 'hero-video')
+VIDEO_TYPES = {
+    'mp4': 'video/mp4',
+    'webm': 'video/webm',
+}
+CHUNK_SIZE = 64 * 1024
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _search_dirs():
+    dirs = [settings.STATIC_ROOT] if settings.STATIC_ROOT else []
+    dirs.extend(getattr(settings, 'STATICFILES_DIRS', []))
+    return [Path(directory) for directory in dirs]
+
+
+@lru_cache(maxsize=None)
+def hero_video_manifest():
+    """{format: {path, size, mtime, etag, content_type, url}} for the videos that exist"""
+    manifest = {}
+    for fmt, content_type in VIDEO_TYPES.items():
+        for directory in _search_dirs():
+            candidates = [directory / f'{name}.{fmt}' for name in VIDEO_NAMES]
+            found = next((path for path in candidates if path.is_file()), None)
+            if found is None:
+                continue
+            stat = found.stat()
+            version = md5(f'{stat.st_size}-{stat.st_mtime_ns}'.encode(), usedforsecurity=False).hexdigest()[:12]
+            manifest[fmt] = {
+                'path': str(found),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'etag': f'"{version}"',
+                'content_type': content_type,
+                'url': f"{reverse('hero-video-file', args=[fmt])}?v={version}",
+            }
+            break
+    return manifest
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single byte range, None for no/ignored range, False if unsatisfiable"""
+    match = _range_re.match(header.strip()) if header else None
+    if match is None:
+        # Missing, multi-range or another unit: answer with the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if size == 0:
+        return False
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _read_chunks(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def hero_video_file(request, fmt):
+    entry = hero_video_manifest().get(fmt)
+    if entry is None:
+        raise Http404('No hero video in that format')
+
+    size, etag = entry['size'], entry['etag']
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': http_date(entry['mtime']),
+        'Cache-Control': CACHE_CONTROL,
+    }
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponse(status=304)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    byte_range = _parse_range(request.headers.get('Range'), size)
+    # If-Range: only honour the range when the client's copy is still current
+    if_range = request.headers.get('If-Range')
+    if byte_range and if_range and if_range.strip() != etag:
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = max(0, end - start + 1)
+    body = _read_chunks(entry['path'], start, length) if request.method != 'HEAD' else iter(())
+    # Chunks are read on a thread under ASGI, so the file is never held whole
+    body = streaming_body(request, body, thread_sensitive=False)
+    response = StreamingHttpResponse(body, content_type=entry['content_type'], status=206 if byte_range else 200)
+    for name, value in headers.items():
+        response[name] = value
+    response['Content-Length'] = str(length)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
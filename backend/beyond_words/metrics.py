@@ -0,0 +1,337 @@
+"""
+Prometheus-style metrics without the prometheus_client dependency.
+
+MetricsMiddleware records, per route pattern (not per URL, to keep the
+label set small): request counts by status, a latency histogram and the
+number/time of SQL queries each request ran. Other modules add their own
+numbers with ``registry.inc()`` / ``registry.observe()`` (cache lookups,
+analysis stage durations), and pull-style counters that already exist
+elsewhere are added at snapshot time with ``register_collector()``.
+
+Every process keeps its metrics in memory. Under gunicorn each worker
+would only ever report its own share, so when METRICS_DIR is set each
+process also writes a snapshot file there (at most every
+METRICS_FLUSH_SECONDS, and on scrape) and the /metrics endpoint sums all
+of them. When a worker is gone (recycled, crashed) its last numbers are
+folded into one metrics-dead.json, so counters don't go backwards and the
+directory doesn't grow with every restart; gunicorn.conf.py clears it when
+the master starts.
+
+Outside DEBUG the endpoint only answers with METRICS_TOKEN set and sent.
+"""
+import fcntl
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+METRIC_HELP = {
+    'http_requests_total': ('counter', 'Requests handled, by route pattern, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Time spent producing the response'),
+    'http_request_db_queries': ('histogram', 'SQL queries run per request'),
+    'db_queries_total': ('counter', 'SQL queries run, by route pattern'),
+    'db_query_seconds_total': ('counter', 'Time spent in SQL queries, by route pattern'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result (hit/miss)'),
+    'analysis_stage_duration_seconds': ('histogram', 'Analysis job time waiting for a worker (queue) and running (compute)'),
+    'analysis_rejected_total': ('counter', 'Analysis requests turned away: pool full, or job="rate_limit" for the per-user limit'),
+    'analysis_ingest_total': ('counter', 'Stories analysed on ingest, by result (analyzed/failed)'),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.collectors = []
+        self._reset()
+        # Workers forked from a preloaded master must not inherit its
+        # numbers or its snapshot file name
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.pid = os.getpid()
+        self.path = None
+        self.last_flush = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        # bisect_left: a value equal to a bound belongs in that bucket (le)
+        index = bisect_left(buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [list(buckets), [0] * (len(buckets) + 1), 0.0, 0]
+            histogram[1][index] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def register_collector(self, collector):
+        """``collector()`` returns [(name, labels dict, value)] counters, read at snapshot time"""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        with self.lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [
+                [name, list(labels), bounds, list(counts), total, count]
+                for (name, labels), (bounds, counts, total, count) in self.histograms.items()
+            ]
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                counters.append([name, sorted(labels.items()), value])
+        return {'counters': counters, 'histograms': histograms}
+
+    # Sharing between processes
+
+    @property
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', '')
+
+    def flush(self):
+        """Write this process's snapshot to METRICS_DIR (no-op without one)"""
+        self.last_flush = time.monotonic()
+        if not self.directory:
+            return
+        directory = Path(self.directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        if self.path is None:
+            # pid + start time: a recycled worker reusing a pid gets its own file
+            self.path = directory / f'metrics-{self.pid}-{int(time.time() * 1000)}.json'
+        descriptor, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(tmp_path, self.path)
+
+    def maybe_flush(self):
+        if self.directory and time.monotonic() - self.last_flush >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5):
+            self.flush()
+
+    def collect_all(self):
+        """Snapshots of every process that wrote one (or just this one)"""
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        self.fold_dead_workers()
+        snapshots = []
+        for path in Path(self.directory).glob('metrics-*.json'):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue  # being replaced right now, or removed
+        return snapshots
+
+    def fold_dead_workers(self):
+        """Add the files of processes that no longer exist to metrics-dead.json and remove them"""
+        directory = Path(self.directory)
+        # Two workers scraping at once must not both fold the same file
+        with open(directory / '.fold.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead = [path for path in directory.glob('metrics-*.json') if not _process_alive(path)]
+            if not dead:
+                return
+            aggregate = directory / DEAD_WORKERS_FILE
+            snapshots = [_read(aggregate)] if aggregate.exists() else []
+            snapshots += [_read(path) for path in dead]
+            descriptor, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(_to_snapshot(*merge(snapshot for snapshot in snapshots if snapshot)), file)
+            os.replace(tmp_path, aggregate)
+            for path in dead:
+                path.unlink(missing_ok=True)
+
+
+DEAD_WORKERS_FILE = 'metrics-dead.json'
+
+
+def _read(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _process_alive(path):
+    """Whether the process that writes metrics-<pid>-<started>.json is still running"""
+    if path.name == DEAD_WORKERS_FILE:
+        return True
+    try:
+        pid = int(path.name.split('-')[1])
+    except (IndexError, ValueError):
+        return True
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # someone else's process
+    return True
+
+
+registry = Registry()
+register_collector = registry.register_collector
+
+
+def merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, bounds, counts, total, count in snapshot['histograms']:
+            key = name, tuple(map(tuple, labels))
+            if key not in histograms:
+                histograms[key] = [bounds, [0] * len(counts), 0.0, 0]
+            merged = histograms[key]
+            merged[1] = [a + b for a, b in zip(merged[1], counts)]
+            merged[2] += total
+            merged[3] += count
+    return counters, histograms
+
+
+def _to_snapshot(counters, histograms):
+    """The inverse of merge(), for writing merged numbers back to a file"""
+    return {
+        'counters': [[name, [list(pair) for pair in labels], value] for (name, labels), value in counters.items()],
+        'histograms': [
+            [name, [list(pair) for pair in labels], bounds, counts, total, count]
+            for (name, labels), (bounds, counts, total, count) in histograms.items()
+        ],
+    }
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def render(snapshots):
+    """Prometheus text exposition format (version 0.0.4)"""
+    counters, histograms = merge(snapshots)
+    families = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        families[name].append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+    for (name, labels), (bounds, counts, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket in zip(list(bounds) + ['+Inf'], counts):
+            cumulative += bucket
+            le = bound if bound == '+Inf' else _format_number(float(bound))
+            families[name].append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}')
+        families[name].append(f'{name}_sum{_format_labels(labels)} {_format_number(total)}')
+        families[name].append(f'{name}_count{_format_labels(labels)} {count}')
+
+    lines = []
+    for name in sorted(families):
+        kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(families[name])
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Scrape endpoint. Needs ``Authorization: Bearer <METRICS_TOKEN>`` when a
+    token is configured, and a token has to be configured unless DEBUG is on.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token and not settings.DEBUG:
+        return HttpResponseForbidden('Set METRICS_TOKEN to enable /metrics/')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden('Forbidden')
+    return HttpResponse(render(registry.collect_all()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    """Times every request and counts the SQL it runs (sync and async)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with self.counting_queries() as queries:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with self.counting_queries() as queries:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    @contextmanager
+    def counting_queries(self):
+        queries = [0, 0.0]
+
+        def count_queries(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - started
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count_queries))
+            yield queries
+
+    def record(self, request, response, elapsed, queries):
+        match = getattr(request, 'resolver_match', None)
+        route = f'/{match.route}' if match else 'unmatched'
+        method = request.method
+        registry.inc('http_requests_total', route=route, method=method, status=str(response.status_code))
+        registry.observe('http_request_duration_seconds', elapsed, route=route, method=method)
+        registry.observe('http_request_db_queries', queries[0], buckets=QUERY_COUNT_BUCKETS, route=route)
+        if queries[0]:
+            registry.inc('db_queries_total', queries[0], route=route)
+            registry.inc('db_query_seconds_total', queries[1], route=route)
+        registry.maybe_flush()
@@ -0,0 +1,222 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Brotli is used when the client accepts it and the ``brotli`` package is
+installed, otherwise gzip. Small bodies, media and responses that are
+already encoded (or partial, see Range requests) are left alone.
+
+BREACH: gzip output gets the same random-length filename padding as
+Django's GZipMiddleware. Brotli has no such field, so responses that
+carry secrets (the auth endpoints return tokens) are never compressed;
+see COMPRESSION_EXCLUDE_PATHS.
+
+The middleware works in both sync and async chains, and compresses async
+streaming bodies (the hero video and CSV export under ASGI) chunk by
+chunk without a thread hop. WhiteNoiseMiddleware below it is sync-only,
+so Django still adapts the chain around it once per request.
+"""
+import gzip
+import io
+import re
+import secrets
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+_accept_encoding_re = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*')
+
+
+def accepted_encodings(header):
+    """Return the encodings from an Accept-Encoding header that have q > 0"""
+    accepted = set()
+    for part in (header or '').split(','):
+        match = _accept_encoding_re.fullmatch(part)
+        if not match:
+            continue
+        name, quality = match.group(1).lower(), match.group(2)
+        try:
+            if quality is not None and float(quality) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name)
+    return accepted
+
+
+def choose_encoding(header):
+    """Pick the best encoding we support for this Accept-Encoding header"""
+    accepted = accepted_encodings(header)
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+# Same as GZipMiddleware.max_random_bytes
+MAX_RANDOM_BYTES = 100
+
+
+def _pad_gzip(compressed):
+    """Put a random-length filename in the gzip header, as django.utils.text.compress_string does"""
+    header = bytearray(compressed[:10])
+    header[3] = gzip.FNAME
+    filename = b'a' * secrets.randbelow(MAX_RANDOM_BYTES) + b'\x00'
+    return bytes(header) + filename + compressed[10:]
+
+
+def compress(body, encoding):
+    """Compress a complete body with the given encoding"""
+    if encoding == 'br':
+        return brotli.compress(
+            body,
+            mode=brotli.MODE_TEXT,
+            quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5),
+        )
+    return _pad_gzip(gzip.compress(body, compresslevel=getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), mtime=0))
+
+
+class StreamCompressor:
+    """Compresses a body handed over piece by piece: process() each chunk, then finish()"""
+
+    def __init__(self, encoding):
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(
+                mode=brotli.MODE_TEXT,
+                quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5),
+            )
+            self.gzip_file = None
+        else:
+            self.buffer = io.BytesIO()
+            # Random-length filename, as django.utils.text.compress_sequence does
+            filename = b'a' * secrets.randbelow(MAX_RANDOM_BYTES)
+            self.gzip_file = gzip.GzipFile(
+                filename=filename, mode='wb', fileobj=self.buffer, mtime=0,
+                compresslevel=getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6),
+            )
+
+    def _drain(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def process(self, item):
+        # No flush() per item: it ends the current block and costs ratio.
+        # The compressor emits output by itself once it has enough input.
+        if self.gzip_file is None:
+            return self.compressor.process(item)
+        self.gzip_file.write(item)
+        return self._drain()
+
+    def finish(self):
+        if self.gzip_file is None:
+            return self.compressor.finish()
+        self.gzip_file.close()
+        return self._drain()
+
+
+def compress_stream(sequence, encoding):
+    compressor = StreamCompressor(encoding)
+    for item in sequence:
+        chunk = compressor.process(item)
+        if chunk:
+            yield chunk
+    yield compressor.finish()
+
+
+async def acompress_stream(sequence, encoding):
+    compressor = StreamCompressor(encoding)
+    async for item in sequence:
+        chunk = compressor.process(item)
+        if chunk:
+            yield chunk
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Like django.middleware.gzip.GZipMiddleware, but also speaks brotli and
+    only compresses text-like content above COMPRESSION_MIN_SIZE bytes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def is_compressible(self, response):
+        if response.has_header('Content-Encoding'):
+            return False
+        # Partial content must keep byte offsets into the original body
+        if response.status_code == 206 or response.has_header('Content-Range'):
+            return False
+        content_type = response.get('Content-Type', '').lower()
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        if not response.streaming:
+            min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 500)
+            if len(response.content) < min_size:
+                return False
+        return True
+
+    def process_response(self, request, response):
+        if not self.is_compressible(response):
+            return response
+        if request.path.startswith(tuple(getattr(settings, 'COMPRESSION_EXCLUDE_PATHS', ()))):
+            return response
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            compressed = compress(response.content, encoding)
+            # Don't bother when compression doesn't actually help
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # The body changed, so a strong ETag no longer matches byte-for-byte
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+
+        response.headers['Content-Encoding'] = encoding
+        return response
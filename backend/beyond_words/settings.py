@@ -29,6 +29,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'stories',
     'analysis',
@@ -37,10 +38,19 @@ INSTALLED_APPS = [
 
 AUTH_USER_MODEL = 'authentication.CustomUser'
 
+# Email sign in for the API, username sign in for the Django admin
+AUTHENTICATION_BACKENDS = [
+    'authentication.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 # Updated middleware with whitenoise for static files
 MIDDLEWARE = [
+    'beyond_words.metrics.MetricsMiddleware',  # request/SQL metrics for /metrics/ (outermost so it times everything)
+    'beyond_words.db_router.ReplicaPinMiddleware',  # per-request read replica pinning
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'beyond_words.middleware.CompressionMiddleware',  # gzip/brotli for API responses
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add this for static files
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +91,13 @@ else:
         }
     }
 
+# Optional read replica for story/analysis reads (beyond_words.db_router).
+# Without REPLICA_DATABASE_URL the router leaves everything on default.
+REPLICA_DATABASE_URL = config('REPLICA_DATABASE_URL', default='')
+if REPLICA_DATABASE_URL:
+    DATABASES['replica'] = dj_database_url.parse(REPLICA_DATABASE_URL)
+DATABASE_ROUTERS = ['beyond_words.db_router.PrimaryReplicaRouter']
+
 # CORS settings - updated for production
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -98,13 +115,15 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'authentication.serializers.BloomTokenRefreshSerializer',
     'AUTH_HEADER_TYPES': ('Bearer',),
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
 }
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -114,6 +133,106 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20
 }
 
+# orjson backed renderer/parser - falls back to DRF's own JSON classes when
+# orjson isn't installed or FAST_JSON is switched off
+if config('FAST_JSON', default=True, cast=bool):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'beyond_words.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] = [
+        'beyond_words.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ]
+
+# Relevance ranked search (stories.pagination.RelevanceCursorPagination):
+# how many results are ranked at a time (deeper pages extend the cached
+# ranking by another block this size), and for how long it's kept (seconds)
+SEARCH_RANKING_LIMIT = config('SEARCH_RANKING_LIMIT', default=1000, cast=int)
+SEARCH_RANKING_CACHE_TTL = config('SEARCH_RANKING_CACHE_TTL', default=300, cast=int)
+
+# Optional cache shared by every worker process, e.g. redis://localhost:6379/0
+# (needs the redis package). It becomes the 'shared' cache alias; the
+# default cache stays per process.
+SHARED_CACHE_URL = config('SHARED_CACHE_URL', default='')
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+if SHARED_CACHE_URL:
+    CACHES['shared'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': SHARED_CACHE_URL}
+
+# Users resolved from JWT access tokens are cached per token id: in the
+# Django cache named by JWT_USER_CACHE_ALIAS (shared between workers) until
+# the token expires, or in a per-process LRU of JWT_USER_CACHE_SIZE entries
+# for at most JWT_USER_CACHE_TTL seconds (how long other workers may still
+# accept a user that was just deactivated)
+JWT_USER_CACHE_ALIAS = config('JWT_USER_CACHE_ALIAS', default='')
+JWT_USER_CACHE_SIZE = config('JWT_USER_CACHE_SIZE', default=10000, cast=int)
+JWT_USER_CACHE_TTL = config('JWT_USER_CACHE_TTL', default=30, cast=int)
+
+# Bloom filter in front of the refresh token blacklist (authentication.blacklist)
+TOKEN_BLACKLIST_BLOOM_CAPACITY = config('TOKEN_BLACKLIST_BLOOM_CAPACITY', default=100000, cast=int)
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = config('TOKEN_BLACKLIST_BLOOM_ERROR_RATE', default=0.001, cast=float)
+TOKEN_BLACKLIST_BLOOM_SYNC_SECONDS = config('TOKEN_BLACKLIST_BLOOM_SYNC_SECONDS', default=5, cast=float)
+# Each sync re-reads rows blacklisted this long before the newest one seen,
+# for transactions that committed late
+TOKEN_BLACKLIST_BLOOM_SYNC_OVERLAP = config('TOKEN_BLACKLIST_BLOOM_SYNC_OVERLAP', default=60, cast=float)
+# Cache alias shared by every worker (redis/memcached) carrying a "blacklist
+# changed" counter. The Bloom filter is only used with one; left empty,
+# every check simply asks the database (the LocMem default cache is per
+# process, so it can't stand in).
+TOKEN_BLACKLIST_EPOCH_CACHE = config('TOKEN_BLACKLIST_EPOCH_CACHE', default='shared' if SHARED_CACHE_URL else '')
+
+# Process pool for the async analysis views (analysis.executor): worker
+# processes (0 = run on a thread in the web process) and how many extra
+# jobs may wait for a worker before requests get a 503
+ANALYSIS_POOL_WORKERS = config('ANALYSIS_POOL_WORKERS', default=os.cpu_count() or 1, cast=int)
+ANALYSIS_QUEUE_LIMIT = config('ANALYSIS_QUEUE_LIMIT', default=32, cast=int)
+# Requests per user per minute to the /api/analysis/ endpoints (0 = no limit).
+# Counted in the default cache, so per process unless that cache is shared.
+ANALYSIS_RATE_LIMIT = config('ANALYSIS_RATE_LIMIT', default=60, cast=int)
+
+# Analysis of newly created stories (analysis.ingest): 'background' (a
+# thread in the process that created them), 'sync' or 'off', and how many
+# stories go to a worker at once
+ANALYZE_ON_INGEST = config('ANALYZE_ON_INGEST', default='background')
+ANALYZE_ON_INGEST_BATCH_SIZE = config('ANALYZE_ON_INGEST_BATCH_SIZE', default=20, cast=int)
+
+# How often each process brings its percentile arrays (analysis.percentiles)
+# up to date with StoryAnalysis (seconds)
+PERCENTILE_REFRESH_SECONDS = config('PERCENTILE_REFRESH_SECONDS', default=60, cast=float)
+# Each refresh also re-reads rows updated this long before the newest one
+# it has seen, for transactions that committed late (seconds)
+PERCENTILE_REFRESH_OVERLAP = config('PERCENTILE_REFRESH_OVERLAP', default=300, cast=float)
+
+# Where `manage.py build_feature_store` writes the memory-mapped feature
+# columns (analysis.feature_store). Must be shared by all workers.
+FEATURE_STORE_DIR = config('FEATURE_STORE_DIR', default=str(BASE_DIR / 'feature_store'))
+# Incremental builds re-read stories changed this long before the previous
+# build, for transactions that committed late (seconds)
+FEATURE_STORE_OVERLAP = config('FEATURE_STORE_OVERLAP', default=300, cast=float)
+
+# How long the SuperAdmin dashboard stats snapshot is reused (seconds)
+ADMIN_STATS_CACHE_TTL = config('ADMIN_STATS_CACHE_TTL', default=30, cast=int)
+
+# Metrics (beyond_words.metrics). With several worker processes set
+# METRICS_DIR so each one writes its numbers there for /metrics/ to add up.
+# The scraper must send METRICS_TOKEN as a Bearer token; with DEBUG off the
+# endpoint stays closed until a token is set.
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=float)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Response compression (beyond_words.middleware.CompressionMiddleware)
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=500, cast=int)
+COMPRESSION_GZIP_LEVEL = config('COMPRESSION_GZIP_LEVEL', default=6, cast=int)
+COMPRESSION_BROTLI_QUALITY = config('COMPRESSION_BROTLI_QUALITY', default=5, cast=int)
+# Never compressed: these responses carry tokens (BREACH)
+COMPRESSION_EXCLUDE_PATHS = [
+    path.strip() for path in config('COMPRESSION_EXCLUDE_PATHS', default='/api/auth/').split(',') if path.strip()
+]
+
 # Static files configuration for production
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
@@ -0,0 +1,41 @@
+"""
+StreamingHttpResponse bodies that stream under ASGI as well as WSGI.
+
+Under ASGI, Django 4.2 turns a plain iterator into a list (with
+sync_to_async(list)) before it sends the first byte, so a video or a CSV
+export would sit in memory whole. streaming_body() gives ASGI requests an
+async generator instead, which pulls one item at a time from the
+iterator on a worker thread. WSGI requests get the iterator unchanged.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+_DONE = object()
+
+
+def streaming_body(request, iterator, thread_sensitive=True):
+    """
+    ``iterator`` ready for StreamingHttpResponse. Pass thread_sensitive=False
+    when it touches nothing but files: it then doesn't queue behind
+    the sync views for Django's one thread-sensitive thread. Anything that
+    uses the database must keep to that thread.
+    """
+    # DRF wraps the HttpRequest
+    if not isinstance(getattr(request, '_request', request), ASGIRequest):
+        return iterator
+    return _pull(iter(iterator), thread_sensitive)
+
+
+async def _pull(iterator, thread_sensitive):
+    step = sync_to_async(next, thread_sensitive=thread_sensitive)
+    try:
+        while True:
+            item = await step(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # Client went away early: let a generator close its file or cursor
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=thread_sensitive)()
@@ -1,4 +1,3 @@
-import os
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf import settings
@@ -7,6 +6,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from django.http import HttpResponse
+from .hero_video import hero_video_file, hero_video_manifest
+from .metrics import metrics_view
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -32,19 +33,8 @@ from rest_framework.permissions import AllowAny
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_hero_video(request):
-    """Return the hero video URL from static files"""
-    video_path = os.path.join(settings.STATIC_ROOT, 'hero_video.mp4')
-    webm_path = os.path.join(settings.STATIC_ROOT, 'hero_video.webm')
-    
-    videos = {}
-    
-    # Check for MP4 video
-    if os.path.exists(video_path):
-        videos['mp4'] = f'{settings.STATIC_URL}hero_video.mp4'
-    
-    # Check for WebM video
-    if os.path.exists(webm_path):
-        videos['webm'] = f'{settings.STATIC_URL}hero_video.webm'
+    """Return the hero video URLs (from the manifest built once per process)"""
+    videos = {fmt: entry['url'] for fmt, entry in hero_video_manifest().items()}
     
     return Response({
         'videos': videos,
@@ -60,6 +50,8 @@ urlpatterns = [
     path('api/analysis/', include('analysis.urls')),
     path('api/auth/', include('authentication.urls')),
     path('api/hero-video/', get_hero_video, name='hero-video'),
+    path('api/hero-video/<str:fmt>/', hero_video_file, name='hero-video-file'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 # This is a critical line for serving static files in production on Render
@@ -0,0 +1,105 @@
+"""
+Gunicorn settings for the backend (picked up automatically when gunicorn
+is started from this directory: ``gunicorn beyond_words.asgi``).
+
+The workers are uvicorn's ASGI workers, so the async analysis views run
+on an event loop and hand the NLP work to the analysis process pool
+(analysis.executor) instead of blocking a request thread. The pool is
+sized so that all workers' pools together about match the CPU count.
+
+The app is imported and the NLP models (NLTK data, the VADER lexicon,
+the sklearn model) are warmed up once in the master before any worker is
+forked. Each worker then forks its pool straight away, so workers and
+pool processes all share those pages copy-on-write and are ready the
+moment they fork. gc.freeze() moves everything allocated so far out of
+the garbage collector's reach, so collections in the children don't
+touch (and thereby copy) the shared objects.
+
+`manage.py loadtest` reports the RSS and PSS of every server process.
+
+Every knob can be overridden from the environment.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+# 'config' is itself a gunicorn setting name, so decouple's helper is renamed
+from decouple import config as env
+
+# Workers write their metrics here so /metrics/ can add them all up
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'beyond-words-metrics'))
+
+wsgi_app = 'beyond_words.asgi:application'
+bind = f"0.0.0.0:{env('PORT', default='8000')}"
+
+workers = env('WEB_CONCURRENCY', default=os.cpu_count() or 1, cast=int)
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Each worker forks its own analysis pool. Split the CPUs between them
+# rather than giving every worker a pool the size of the box
+os.environ.setdefault('ANALYSIS_POOL_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+preload_app = True
+
+# A full analysis of a long story can take several seconds; don't kill the
+# worker mid-analysis, but don't let a stuck one hang around forever either
+timeout = env('GUNICORN_TIMEOUT', default=120, cast=int)
+graceful_timeout = env('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+keepalive = env('GUNICORN_KEEPALIVE', default=5, cast=int)
+
+# Recycle workers now and then to cap slow growth (NLTK/sklearn caches, fragmentation).
+# The jitter stops them all restarting at once. A recycled worker's pool goes
+# with it, but the replacement forks a new one from the warm master pages, so
+# nothing is imported or loaded again
+max_requests = env('GUNICORN_MAX_REQUESTS', default=1000, cast=int)
+max_requests_jitter = env('GUNICORN_MAX_REQUESTS_JITTER', default=100, cast=int)
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """Forget metrics left behind by a previous run of the server"""
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    """Fork this worker's analysis pool now, before the worker starts any threads"""
+    from analysis.executor import pool
+    pool.start('fork')
+
+
+def worker_exit(server, worker):
+    """Write the exiting worker's final numbers so its counters survive recycling"""
+    from analysis.executor import pool
+    from beyond_words.metrics import registry
+    pool.shutdown()
+    registry.flush()
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded and before the first fork"""
+    from django.db import connections
+    from django.urls import get_resolver
+
+    # Import every view module now instead of on each worker's first request
+    get_resolver().url_patterns
+
+    from beyond_words.hero_video import hero_video_manifest
+    hero_video_manifest()
+
+    # Load the models here once; workers and their pools inherit them
+    from analysis.executor import warm_up
+    try:
+        warm_up()
+    except LookupError as exc:
+        # The VADER and sklearn models are loaded by then all the same
+        server.log.warning('NLP warmup incomplete, NLTK data missing: %s', exc)
+
+    # Forked workers must not share the master's database sockets
+    connections.close_all()
+
+    gc.collect()
+    gc.freeze()
+    server.log.info('Preloaded app and NLP models; %d objects frozen', gc.get_freeze_count())
@@ -1,10 +1,10 @@
 from django.contrib import admin
-from .models import Story, StoryAnalysis, AuthorshipDetection
+from .models import Story, StoryAnalysis, AuthorshipDetection, SentimentArc, Term
 
 @admin.register(Story)
 class StoryAdmin(admin.ModelAdmin):
     list_display = ['title', 'source', 'age_group', 'created_at']
-    list_filter = ['source', 'age_group']
+    list_filter = ['source', 'age_group', 'safety_present', 'safety_severity', 'bias_present']
     search_fields = ['title', 'story']
 
 @admin.register(StoryAnalysis)
@@ -13,4 +13,13 @@ class StoryAnalysisAdmin(admin.ModelAdmin):
 
 @admin.register(AuthorshipDetection)
 class AuthorshipDetectionAdmin(admin.ModelAdmin):
-    list_display = ['story', 'predicted_source', 'confidence_score', 'created_at']
\ No newline at end of file
+    list_display = ['story', 'predicted_source', 'confidence_score', 'created_at']
+
+@admin.register(SentimentArc)
+class SentimentArcAdmin(admin.ModelAdmin):
+    list_display = ['story', 'analyzer_version', 'updated_at']
+
+@admin.register(Term)
+class TermAdmin(admin.ModelAdmin):
+    list_display = ['term', 'document_frequency']
+    search_fields = ['term']
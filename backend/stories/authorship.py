@@ -0,0 +1,72 @@
+"""
+The quick AI/Human heuristic behind StoryViewSet.detect_authorship.
+
+Kept free of Django and NLTK so the evaluation harness
+(``manage.py evaluate_authorship``) can run it in worker processes.
+"""
+
+PUNCTUATION = set('.,!?;:()[]"')
+
+
+def heuristic_authorship(text):
+    """
+    Score five AI indicators and predict from the total. Returns
+    {'predicted_source', 'confidence_score', 'features', 'ai_indicators'};
+    the confidence is deterministic here (the endpoint adds some jitter).
+    """
+    # Basic text metrics for authorship detection
+    words = text.split()
+    sentences = [s.strip() for s in text.split('.') if s.strip()]
+
+    word_count = len(words)
+    sentence_count = len(sentences)
+    avg_sentence_length = word_count / max(sentence_count, 1)
+
+    # Count repetitions of words longer than 2 characters
+    word_freq = {}
+    for word in words:
+        clean_word = word.lower().strip('.,!?";:()[]')
+        if len(clean_word) > 2:
+            word_freq[clean_word] = word_freq.get(clean_word, 0) + 1
+    total_words = len(word_freq)
+    repeated_words = sum(1 for freq in word_freq.values() if freq > 2)
+    repetition_score = repeated_words / max(total_words, 1)
+
+    punctuation_count = sum(1 for c in text if c in PUNCTUATION)
+    punctuation_ratio = punctuation_count / max(len(text), 1)
+
+    # Unique words / total words
+    complexity_score = len(set(words)) / max(len(words), 1)
+
+    # AI tends to have: lower repetition of content words, more consistent
+    # sentence lengths, more varied vocabulary, moderate punctuation, and
+    # (in this dataset) longer texts
+    indicators = {
+        'low_repetition': repetition_score < 0.15,
+        'consistent_length': 10 < avg_sentence_length < 20,
+        'high_complexity': complexity_score > 0.75,
+        'moderate_punctuation': 0.02 < punctuation_ratio < 0.08,
+        'longer_text': word_count > 200,
+    }
+    ai_score = sum(indicators.values())
+
+    if ai_score >= 3:
+        predicted_source = 'AI'
+        confidence = min(0.95, 0.6 + (ai_score * 0.1))
+    else:
+        predicted_source = 'Human'
+        confidence = min(0.95, 0.6 + ((5 - ai_score) * 0.1))
+
+    return {
+        'predicted_source': predicted_source,
+        'confidence_score': confidence,
+        'features': {
+            'repetition_score': repetition_score,
+            'avg_sentence_length': avg_sentence_length,
+            'complexity_score': complexity_score,
+            'punctuation_ratio': punctuation_ratio,
+            'word_count': word_count,
+            'sentence_count': sentence_count,
+        },
+        'ai_indicators': {**indicators, 'total_ai_score': ai_score},
+    }
@@ -0,0 +1,182 @@
+"""
+Near-duplicate detection for stories using MinHash signatures and
+locality sensitive hashing (LSH).
+
+Each story is reduced to a fixed size signature of NUM_PERM 32-bit minimum
+hashes over its word shingles. Two signatures agree in roughly the same
+fraction of positions as the Jaccard similarity of the shingle sets. The
+LSH index splits a signature into BANDS bands and only compares stories
+that share at least one identical band, so lookups touch a handful of
+candidates instead of the whole corpus.
+"""
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16  # 16 bands x 8 rows -> candidates from roughly 0.7 Jaccard upwards
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.7
+
+# Fixed seed so signatures stored in the database stay comparable
+_rng = np.random.RandomState(1337)
+_A = _rng.randint(1, 2 ** 63 - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+_B = _rng.randint(0, 2 ** 63 - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_EMPTY = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+
+_word_re = re.compile(r'\w+')
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = _word_re.findall(text.lower())
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def compute_signature(text):
+    """MinHash signature (uint32 array of length NUM_PERM) for a text"""
+    shingle_set = shingles(text or '')
+    if not shingle_set:
+        return _EMPTY.copy()
+
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode('utf-8')) for s in shingle_set),
+        dtype=np.uint64,
+        count=len(shingle_set),
+    )
+    # Multiply-shift hashing: ((a * x + b) mod 2^64) >> 32, one row per permutation.
+    # uint64 arithmetic wraps, which is exactly the mod 2^64 we want.
+    with np.errstate(over='ignore'):
+        permuted = (np.outer(_A, hashes) + _B[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def signature_to_bytes(signature):
+    return np.asarray(signature, dtype='<u4').tobytes()
+
+
+def signature_from_bytes(data):
+    return np.frombuffer(bytes(data), dtype='<u4')
+
+
+def estimate_similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class LSHIndex:
+    """In-memory banded LSH index of story signatures"""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.buckets = [defaultdict(list) for _ in range(BANDS)]
+        self.signatures = {}
+
+    @classmethod
+    def from_rows(cls, rows, threshold=DEFAULT_THRESHOLD):
+        """Build an index from (key, signature bytes) pairs"""
+        index = cls(threshold)
+        for key, data in rows:
+            index.add(key, signature_from_bytes(data))
+        return index
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _band_keys(self, signature):
+        for band in range(BANDS):
+            yield band, signature[band * ROWS:(band + 1) * ROWS].tobytes()
+
+    def add(self, key, signature):
+        self.signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self.buckets[band][band_key].append(key)
+
+    def candidates(self, signature):
+        found = set()
+        for band, band_key in self._band_keys(signature):
+            found.update(self.buckets[band].get(band_key, ()))
+        return found
+
+    def query(self, signature, exclude=None):
+        """(key, similarity) pairs above the threshold, most similar first"""
+        matches = []
+        for key in self.candidates(signature):
+            if key == exclude:
+                continue
+            similarity = estimate_similarity(signature, self.signatures[key])
+            if similarity >= self.threshold:
+                matches.append((key, similarity))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+
+    def clusters(self):
+        """Groups of keys that are (transitively) near-duplicates of each other"""
+        parent = {}
+
+        def find(key):
+            parent.setdefault(key, key)
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for key, signature in self.signatures.items():
+            for other, _ in self.query(signature, exclude=key):
+                parent[find(key)] = find(other)
+
+        groups = defaultdict(list)
+        for key in parent:
+            groups[find(key)].append(key)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def content_hash(text):
+    """SHA-256 of the exact text; analysis rows record it to notice later edits"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def backfill_signatures(batch_size=500):
+    """Compute and store signatures for stories that don't have one yet"""
+    from .models import Story
+
+    updated = 0
+    pending = Story.objects.filter(minhash__isnull=True).only('id', 'story').order_by('id')
+    while True:
+        # Re-query each time: the rows we just filled drop out of the filter
+        batch = list(pending[:batch_size])
+        if not batch:
+            return updated
+        for story in batch:
+            story.minhash = signature_to_bytes(compute_signature(story.story))
+        Story.objects.bulk_update(batch, ['minhash'])
+        updated += len(batch)
+
+
+def backfill_content_hashes(batch_size=500):
+    """Hash stories created without save() (bulk_create)"""
+    from .models import Story
+
+    updated = 0
+    pending = Story.objects.filter(content_hash='').only('id', 'story').order_by('id')
+    while True:
+        batch = list(pending[:batch_size])
+        if not batch:
+            return updated
+        for story in batch:
+            story.content_hash = content_hash(story.story)
+        Story.objects.bulk_update(batch, ['content_hash'])
+        updated += len(batch)
+
+
+def build_index(threshold=DEFAULT_THRESHOLD):
+    """LSH index over every stored story signature"""
+    from .models import Story
+
+    rows = Story.objects.filter(minhash__isnull=False).values_list('id', 'minhash')
+    return LSHIndex.from_rows(rows.iterator(chunk_size=2000), threshold)
@@ -0,0 +1,122 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from authentication.models import CustomUser
+from beyond_words import middleware
+from beyond_words.renderers import FastJSONRenderer, orjson
+from stories.models import Story
+from stories.views import StoryViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compare JSON rendering and response compression cost on the story list/detail routes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stories', type=int, default=100,
+                            help='Make sure at least this many stories exist (extra ones are rolled back)')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='How many times to render/compress each payload')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        # Everything created here (user, seeded stories) is thrown away again
+        with transaction.atomic():
+            payloads = self.collect_payloads(options['stories'])
+            transaction.set_rollback(True)
+
+        results = []
+        for route, data in payloads.items():
+            results.extend(self.bench_route(route, data, options['iterations']))
+
+        self.print_table(results)
+        if not orjson:
+            self.stdout.write(self.style.WARNING('orjson is not installed - FastJSONRenderer fell back to JSONRenderer'))
+        if middleware.brotli is None:
+            self.stdout.write(self.style.WARNING('brotli is not installed - br rows skipped'))
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json_path']}"))
+
+    def collect_payloads(self, min_stories):
+        """Seed stories if needed and fetch the serialized list/detail data"""
+        missing = min_stories - Story.objects.count()
+        if missing > 0:
+            # Reuse real story text where we have it so the compression numbers are honest
+            texts = list(Story.objects.values_list('story', flat=True)[:50]) or [
+                'Once upon a time a curious fox followed the river to a village of lanterns. ' * 40
+            ]
+            Story.objects.bulk_create([
+                Story(
+                    title=f'Benchmark story {i}',
+                    story=texts[i % len(texts)],
+                    source='AI' if i % 2 else 'Human',
+                    age_group='7-12',
+                )
+                for i in range(missing)
+            ])
+
+        user = CustomUser.objects.create_user(username='benchmark@example.com', email='benchmark@example.com')
+        factory = APIRequestFactory()
+
+        def fetch(action, url, **kwargs):
+            request = factory.get(url, SERVER_NAME='localhost')
+            force_authenticate(request, user=user)
+            response = StoryViewSet.as_view({'get': action})(request, **kwargs)
+            return response.data
+
+        story_id = Story.objects.values_list('id', flat=True).first()
+        return {
+            'list': fetch('list', '/api/stories/'),
+            'detail': fetch('retrieve', f'/api/stories/{story_id}/', pk=story_id),
+        }
+
+    def bench_route(self, route, data, iterations):
+        rows = []
+        baseline = None
+        for name, renderer in (('drf-json', JSONRenderer()), ('fast-json', FastJSONRenderer())):
+            body, cpu = self.timed(lambda: renderer.render(data), iterations)
+            baseline = baseline or (len(body), cpu)
+            rows.append(self.row(route, name, 'identity', len(body), cpu, baseline))
+
+        # Compress what the fast renderer produced, the way the middleware would
+        encodings = ['gzip'] + (['br'] if middleware.brotli is not None else [])
+        for encoding in encodings:
+            compressed, cpu = self.timed(lambda: middleware.compress(body, encoding), iterations)
+            rows.append(self.row(route, 'fast-json', encoding, len(compressed), cpu, baseline))
+        return rows
+
+    def timed(self, func, iterations):
+        result = func()
+        start = time.process_time()
+        for _ in range(iterations):
+            func()
+        return result, (time.process_time() - start) / iterations
+
+    def row(self, route, renderer, encoding, size, cpu, baseline):
+        base_size, base_cpu = baseline
+        return {
+            'route': route,
+            'renderer': renderer,
+            'encoding': encoding,
+            'bytes': size,
+            'bytes_saved_pct': round(100 * (1 - size / base_size), 1) if base_size else 0.0,
+            'cpu_ms': round(cpu * 1000, 3),
+            'render_cpu_saved_pct': round(100 * (1 - cpu / base_cpu), 1) if encoding == 'identity' and base_cpu else None,
+        }
+
+    def print_table(self, results):
+        header = f"{'route':<8}{'renderer':<11}{'encoding':<10}{'bytes':>10}{'saved':>9}{'cpu ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results:
+            self.stdout.write(
+                f"{row['route']:<8}{row['renderer']:<11}{row['encoding']:<10}"
+                f"{row['bytes']:>10}{row['bytes_saved_pct']:>8}%{row['cpu_ms']:>10}"
+            )
@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from stories.dedup import DEFAULT_THRESHOLD, backfill_signatures, build_index, estimate_similarity
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Report clusters of near-duplicate stories across the corpus (MinHash/LSH)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Estimated similarity at which two stories count as near-duplicates')
+        parser.add_argument('--json', dest='json_path', help='Also write the clusters to this file')
+
+    def handle(self, *args, **options):
+        filled = backfill_signatures()
+        if filled:
+            self.stdout.write(f'Computed signatures for {filled} stories')
+
+        index = build_index(options['threshold'])
+        clusters = index.clusters()
+        titles = Story.objects.only('id', 'title', 'source').in_bulk(
+            [story_id for cluster in clusters for story_id in cluster],
+        )
+
+        report = []
+        for cluster in clusters:
+            first = index.signatures[cluster[0]]
+            members = [{
+                'id': story_id,
+                'title': titles[story_id].title,
+                'source': titles[story_id].source,
+                'similarity_to_first': round(estimate_similarity(first, index.signatures[story_id]), 3),
+            } for story_id in cluster]
+            report.append(members)
+
+            self.stdout.write(self.style.WARNING(f'Cluster of {len(cluster)} stories:'))
+            for member in members:
+                self.stdout.write(
+                    f"  #{member['id']} [{member['source']}] {member['title']}"
+                    f" ({member['similarity_to_first']:.2f})"
+                )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(index)} stories checked, {len(clusters)} near-duplicate clusters found'
+        ))
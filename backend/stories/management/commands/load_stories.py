@@ -1,45 +1,116 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from analysis.ingest import analyze_stories, batch_ingest
 from stories.models import Story
+from stories.dedup import (
+    DEFAULT_THRESHOLD, backfill_signatures, build_index, compute_signature, signature_to_bytes,
+)
 import json
 import os
+import subprocess
+import sys
 
 class Command(BaseCommand):
     help = 'Load stories from ai_stories.json file'
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', type=str, help='Path to ai_stories.json file')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Estimated similarity at which a story counts as a near-duplicate')
+        parser.add_argument('--keep-duplicates', action='store_true',
+                            help='Load near-duplicates anyway (they are still reported)')
+        analysis = parser.add_mutually_exclusive_group()
+        analysis.add_argument('--defer-analysis', action='store_true',
+                              help='Analyse the new stories in a background process instead of waiting for it')
+        analysis.add_argument('--skip-analysis', action='store_true',
+                              help="Don't analyse the new stories (the analysis endpoints do it on demand)")
+        parser.add_argument('--analysis-workers', type=int, default=None,
+                            help='Worker processes for the analysis stage (default ANALYSIS_POOL_WORKERS)')
 
     def handle(self, *args, **options):
         file_path = options['file_path']
-        
+
         if not os.path.exists(file_path):
             self.stdout.write(
                 self.style.ERROR(f'File {file_path} does not exist')
             )
             return
-        
+
         with open(file_path, 'r', encoding='utf-8') as file:
             stories_data = json.load(file)
-        
+
+        # Near-duplicate check: every stored signature goes into an LSH index
+        # once, then each incoming story only looks at its bucket neighbours.
+        backfill_signatures()
+        index = build_index(options['threshold'])
+        titles = dict(Story.objects.values_list('title', 'id'))
+
         created_count = 0
-        for story_data in stories_data:
-            story, created = Story.objects.get_or_create(
-                title=story_data['title'],
-                defaults={
-                    'story': story_data['story'],
-                    'source': story_data['source'],
-                    'age_group': story_data['age_group'],
-                    'safety_violations': story_data.get('safety_violations', {}),
-                    'stereotypes_biases': story_data.get('stereotypes_biases', {})
-                }
-            )
-            
-            if created:
+        created_ids = []
+        duplicate_count = 0
+        # The new stories are analysed as one batch afterwards, not one by
+        # one from the post_save hook
+        with batch_ingest():
+            for story_data in stories_data:
+                if story_data['title'] in titles:
+                    continue
+
+                signature = compute_signature(story_data['story'])
+                duplicates = index.query(signature)
+                if duplicates:
+                    duplicate_count += 1
+                    original_id, similarity = duplicates[0]
+                    self.stdout.write(self.style.WARNING(
+                        f"Near-duplicate: '{story_data['title']}' matches story {original_id} "
+                        f"(similarity {similarity:.2f})"
+                        + ('' if options['keep_duplicates'] else ' - skipped')
+                    ))
+                    if not options['keep_duplicates']:
+                        continue
+
+                story = Story.objects.create(
+                    title=story_data['title'],
+                    story=story_data['story'],
+                    source=story_data['source'],
+                    age_group=story_data['age_group'],
+                    safety_violations=story_data.get('safety_violations', {}),
+                    stereotypes_biases=story_data.get('stereotypes_biases', {}),
+                    minhash=signature_to_bytes(signature),
+                )
+                index.add(story.id, signature)
+                titles[story.title] = story.id
                 created_count += 1
+                created_ids.append(story.id)
                 self.stdout.write(f'Created story: {story.title}')
-        
+
         self.stdout.write(
             self.style.SUCCESS(
                 f'Successfully loaded {created_count} stories from {file_path}'
+                f' ({duplicate_count} near-duplicates found)'
+            )
+        )
+        if created_ids:
+            self.analyze(created_ids, options)
+
+    def analyze(self, story_ids, options):
+        if options['skip_analysis']:
+            return
+        if options['defer_analysis']:
+            # Detached, so it carries on after this command has returned. It
+            # picks up every story still missing an analysis, these included.
+            command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'analyze_stories']
+            if options['analysis_workers'] is not None:
+                command.append(f"--workers={options['analysis_workers']}")
+            process = subprocess.Popen(
+                command, cwd=settings.BASE_DIR, start_new_session=True,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
             )
-        )
\ No newline at end of file
+            self.stdout.write(f'Analysing {len(story_ids)} stories in the background (pid {process.pid})')
+            return
+
+        summary = analyze_stories(story_ids, workers=options['analysis_workers'])
+        for story_id, error in summary['failed']:
+            self.stdout.write(self.style.WARNING(f'Analysis of story {story_id} failed: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Analysed {summary['analyzed']} new stories ({len(summary['failed'])} failed)"
+        ))
@@ -0,0 +1,446 @@
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from authentication.models import CustomUser
+from stories.dedup import compute_signature, signature_to_bytes
+from stories.models import Story
+
+LOADTEST_EMAIL = 'loadtest@example.com'
+LOADTEST_PASSWORD = 'loadtest-password'
+
+# Roughly what the frontend does: mostly browsing and searching
+DEFAULT_MIX = 'list=30,search=25,detail=25,similar=10,analyze=5,signin=5'
+ENDPOINTS = ('list', 'search', 'detail', 'similar', 'analyze', 'deep_analysis', 'signin')
+
+WORDS = (
+    'fox rabbit dragon princess castle forest river moon star garden lantern village '
+    'friend brave little curious happy sleepy tiny giant magic secret map treasure '
+    'boat storm rainbow owl bear kitten puppy school teacher grandmother winter summer '
+    'ran jumped laughed whispered found shared helped climbed dreamed sang wondered '
+    'under over across behind beside through'
+).split()
+# Some searches should find nothing, like real users mistyping
+MISSES = ['spaceship', 'volcano', 'pirate', 'zzzz']
+
+
+def make_story(rng):
+    sentences = []
+    for _ in range(rng.randint(10, 45)):
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 16)))
+        sentences.append(sentence.capitalize() + rng.choice('..!?'))
+    return ' '.join(sentences)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _proc_children():
+    """{pid: [child pids]} for every process, from /proc"""
+    children = defaultdict(list)
+    for entry in Path('/proc').iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # The command name may contain spaces and parentheses
+            stat = (entry / 'stat').read_text().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children[int(stat[1])].append(int(entry.name))
+    return children
+
+
+def _memory_kb(pid):
+    values = {}
+    try:
+        for line in Path(f'/proc/{pid}/smaps_rollup').read_text().splitlines():
+            name, _, rest = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                values[name] = int(rest.split()[0])
+    except (OSError, ValueError):
+        return None
+    return values if len(values) == 2 else None
+
+
+def server_memory(pid):
+    """
+    RSS and PSS of the server and every process under it (gunicorn: master,
+    workers, their analysis pools), or None off Linux. PSS splits shared
+    pages between the processes sharing them, so it shows what preloading
+    saves where RSS can't.
+    """
+    if not Path(f'/proc/{pid}/smaps_rollup').exists():
+        return None
+    children = _proc_children()
+    roles = ('master', 'worker', 'pool')
+    processes = []
+    pending = [(pid, 0)]
+    while pending:
+        current, depth = pending.pop()
+        values = _memory_kb(current)
+        if values is not None:
+            try:
+                command = Path(f'/proc/{current}/cmdline').read_bytes()
+            except OSError:
+                command = b''
+            role = 'helper' if b'resource_tracker' in command else roles[min(depth, len(roles) - 1)]
+            processes.append({
+                'pid': current, 'role': role,
+                'rss_mb': round(values['Rss'] / 1024, 1), 'pss_mb': round(values['Pss'] / 1024, 1),
+            })
+        pending.extend((child, depth + 1) for child in children.get(current, []))
+    return {
+        'processes': processes,
+        'rss_mb': round(sum(process['rss_mb'] for process in processes), 1),
+        'pss_mb': round(sum(process['pss_mb'] for process in processes), 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Start the app against a freshly seeded throwaway database and replay a mix of '
+        'list/search/detail/similar/analyze/signin traffic, reporting throughput and latency percentiles'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stories', type=int, default=500, help='How many stories to seed')
+        parser.add_argument('--concurrency', type=int, default=8, help='Simultaneous clients')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic (after warmup)')
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds of traffic not counted')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Endpoint weights, e.g. "{DEFAULT_MIX}". Also: deep_analysis '
+                                 '(/api/analysis/detailed/, needs NLTK data)')
+        parser.add_argument('--server', choices=['gunicorn', 'runserver'], default='gunicorn',
+                            help='How to run the app (gunicorn uses gunicorn.conf.py)')
+        parser.add_argument('--workers', type=int, help='gunicorn workers (default: gunicorn.conf.py)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for data and traffic')
+        parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+        parser.add_argument('--keep-db', action='store_true', help="Don't delete the seeded database")
+        # Internal: run inside the throwaway database by the parent process
+        parser.add_argument('--seed-only', action='store_true', help='(internal) seed the current database')
+
+    def handle(self, *args, **options):
+        if options['seed_only']:
+            self.seed(options['stories'], options['seed'])
+            return
+
+        mix = self.parse_mix(options['mix'])
+        workdir = Path(tempfile.mkdtemp(prefix='loadtest-'))
+        env = dict(
+            os.environ, DATABASE_URL=f"sqlite:///{workdir / 'loadtest.sqlite3'}", DEBUG='False',
+            # Its own metrics directory: gunicorn wipes METRICS_DIR on start, and
+            # the default one belongs to whatever server is running on this box
+            METRICS_DIR=str(workdir / 'metrics'),
+            # Every client shares one seeded user: the per-user limit would
+            # turn most analysis requests into 429s
+            ANALYSIS_RATE_LIMIT='0',
+        )
+        if options['workers']:
+            env['WEB_CONCURRENCY'] = str(options['workers'])
+
+        self.stdout.write(f'Seeding {options["stories"]} stories into {workdir}')
+        self.manage(env, 'migrate', '--noinput')
+        seeded = json.loads(self.manage(
+            env, 'loadtest', '--seed-only', '--stories', str(options['stories']), '--seed', str(options['seed']),
+        ).strip().splitlines()[-1])
+
+        port = self.free_port()
+        server = self.start_server(options['server'], port, env)
+        try:
+            self.wait_until_ready(port, server)
+            self.stdout.write(
+                f"Running {options['duration']:g}s at concurrency {options['concurrency']} "
+                f"against {options['server']} on port {port}"
+            )
+            samples, elapsed = self.run_traffic(port, mix, seeded, options)
+            memory = server_memory(server.pid)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            if not options['keep_db']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        report = self.build_report(samples, elapsed, options, mix)
+        report['memory'] = memory
+        self.print_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['json_path']}"))
+
+    def parse_mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in ENDPOINTS:
+                raise CommandError(f'Unknown endpoint "{name}" in --mix (choose from {", ".join(ENDPOINTS)})')
+            try:
+                mix[name] = float(weight)
+            except ValueError:
+                raise CommandError(f'Bad weight for "{name}" in --mix')
+        if not any(weight > 0 for weight in mix.values()):
+            raise CommandError('--mix needs at least one positive weight')
+        return mix
+
+    # Seeding (runs in a child process against the throwaway database)
+
+    def seed(self, count, seed):
+        rng = random.Random(seed)
+        age_groups = [value for value, _ in Story.AGE_CHOICES]
+        with transaction.atomic():
+            stories = []
+            for i in range(count):
+                text = make_story(rng)
+                stories.append(Story(
+                    title=f'{rng.choice(WORDS).capitalize()} and the {rng.choice(WORDS)} #{i}',
+                    story=text,
+                    source=rng.choice(['AI', 'Human']),
+                    age_group=rng.choice(age_groups),
+                    minhash=signature_to_bytes(compute_signature(text)),
+                ))
+            Story.objects.bulk_create(stories, batch_size=500)
+            CustomUser.objects.create_user(username=LOADTEST_EMAIL, email=LOADTEST_EMAIL, password=LOADTEST_PASSWORD)
+        # Last stdout line is read by the parent process
+        self.stdout.write(json.dumps({
+            'story_ids': list(Story.objects.values_list('id', flat=True)),
+            'terms': WORDS[:20] + MISSES,
+        }))
+
+    # Server management
+
+    def manage(self, env, *args):
+        result = subprocess.run(
+            [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), *args],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f'manage.py {args[0]} failed:\n{result.stderr}')
+        return result.stdout
+
+    def free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def start_server(self, kind, port, env):
+        if kind == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                       '--access-logfile', '/dev/null', 'beyond_words.asgi']
+        else:
+            command = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+        return subprocess.Popen(
+            command, env=env, cwd=settings.BASE_DIR,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def wait_until_ready(self, port, server, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('The server exited during startup')
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+                connection.request('GET', '/')
+                connection.getresponse().read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'The server did not come up within {timeout}s')
+
+    # Traffic
+
+    def run_traffic(self, port, mix, seeded, options):
+        token = self.sign_in(http.client.HTTPConnection('127.0.0.1', port, timeout=30))
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        samples = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+
+        start = time.monotonic()
+        measure_from = start + options['warmup']
+        stop_at = measure_from + options['duration']
+
+        def client(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            local_samples, local_errors = defaultdict(list), defaultdict(int)
+            while True:
+                now = time.monotonic()
+                if now >= stop_at:
+                    break
+                name = rng.choices(names, weights)[0]
+                method, path, body = self.build_request(name, rng, seeded)
+                began = time.perf_counter()
+                try:
+                    status = self.send(connection, method, path, body, token)
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                    status = None
+                latency = time.perf_counter() - began
+                if now < measure_from:
+                    continue
+                local_samples[name].append(latency)
+                if status is None or status >= 400:
+                    local_errors[name] += 1
+            connection.close()
+            with lock:
+                for name, values in local_samples.items():
+                    samples[name].extend(values)
+                for name, count in local_errors.items():
+                    errors[name] += count
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - measure_from
+        return {'latencies': samples, 'errors': errors}, elapsed
+
+    def build_request(self, name, rng, seeded):
+        story_id = rng.choice(seeded['story_ids'])
+        if name == 'list':
+            return 'GET', '/api/stories/', None
+        if name == 'search':
+            return 'GET', f"/api/stories/search/?q={rng.choice(seeded['terms'])}", None
+        if name == 'detail':
+            return 'GET', f'/api/stories/{story_id}/', None
+        if name == 'similar':
+            return 'GET', f'/api/stories/{story_id}/similar/', None
+        if name == 'analyze':
+            return 'POST', f'/api/stories/{story_id}/analyze/', {}
+        if name == 'deep_analysis':
+            return 'GET', f'/api/analysis/detailed/{story_id}/', None
+        return 'POST', '/api/auth/signin/', {'email': LOADTEST_EMAIL, 'password': LOADTEST_PASSWORD}
+
+    def send(self, connection, method, path, body, token):
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip, br'}
+        if token and not path.startswith('/api/auth/'):
+            headers['Authorization'] = f'Bearer {token}'
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def sign_in(self, connection):
+        body = json.dumps({'email': LOADTEST_EMAIL, 'password': LOADTEST_PASSWORD})
+        connection.request('POST', '/api/auth/signin/', body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = response.read()
+        connection.close()
+        if response.status != 200:
+            raise CommandError(f'Sign in failed with {response.status}: {data[:200]!r}')
+        return json.loads(data)['access']
+
+    # Reporting
+
+    def build_report(self, samples, elapsed, options, mix):
+        endpoints = {}
+        total = 0
+        total_errors = 0
+        for name in mix:
+            latencies = sorted(samples['latencies'].get(name, []))
+            errors = samples['errors'].get(name, 0)
+            total += len(latencies)
+            total_errors += errors
+            endpoints[name] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+                **{
+                    f'{label}_ms': round(value * 1000, 2) if value is not None else None
+                    for label, value in (
+                        ('p50', percentile(latencies, 50)),
+                        ('p95', percentile(latencies, 95)),
+                        ('p99', percentile(latencies, 99)),
+                        ('max', latencies[-1] if latencies else None),
+                    )
+                },
+            }
+        return {
+            'commit': self.git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'server': options['server'],
+            'concurrency': options['concurrency'],
+            'duration_s': round(elapsed, 2),
+            'stories': options['stories'],
+            'mix': mix,
+            'total': {
+                'requests': total,
+                'errors': total_errors,
+                'rps': round(total / elapsed, 2) if elapsed > 0 else None,
+            },
+            'endpoints': endpoints,
+        }
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_report(self, report):
+        header = f"{'endpoint':<15}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        def cell(value):
+            return f'{value:>9}' if value is not None else f"{'-':>9}"
+
+        for name, row in report['endpoints'].items():
+            self.stdout.write(
+                f"{name:<15}{row['requests']:>9}{row['errors']:>8}{cell(row['rps'])}"
+                f"{cell(row['p50_ms'])}{cell(row['p95_ms'])}{cell(row['p99_ms'])}{cell(row['max_ms'])}"
+            )
+        total = report['total']
+        self.stdout.write('-' * len(header))
+        self.stdout.write(f"{'total':<15}{total['requests']:>9}{total['errors']:>8}{cell(total['rps'])}")
+        if total['errors']:
+            self.stdout.write(self.style.WARNING(f"{total['errors']} requests failed"))
+
+        memory = report.get('memory')
+        if memory:
+            self.stdout.write('')
+            self.stdout.write(f"{'process':<15}{'count':>9}{'RSS MB':>10}{'PSS MB':>10}   (per process)")
+            for role in ('master', 'worker', 'pool', 'helper'):
+                rows = [process for process in memory['processes'] if process['role'] == role]
+                if rows:
+                    rss = sum(process['rss_mb'] for process in rows) / len(rows)
+                    pss = sum(process['pss_mb'] for process in rows) / len(rows)
+                    self.stdout.write(f'{role:<15}{len(rows):>9}{rss:>10.1f}{pss:>10.1f}')
+            self.stdout.write(f"{'all':<15}{len(memory['processes']):>9}{memory['rss_mb']:>10.1f}"
+                              f"{memory['pss_mb']:>10.1f}   (total)")
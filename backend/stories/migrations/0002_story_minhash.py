@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='minhash',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:31
+
+from django.db import migrations, models
+
+
+def populate_flag_columns(apps, schema_editor):
+    Story = apps.get_model('stories', 'Story')
+
+    def severity(value):
+        return str(value).strip().capitalize() if value else ''
+
+    batch = []
+    for story in Story.objects.only('id', 'safety_violations', 'stereotypes_biases').iterator(chunk_size=500):
+        safety = story.safety_violations if isinstance(story.safety_violations, dict) else {}
+        biases = story.stereotypes_biases if isinstance(story.stereotypes_biases, dict) else {}
+        story.safety_present = bool(safety.get('present'))
+        story.safety_severity = severity(safety.get('severity'))[:20]
+        story.safety_type = (safety.get('type') or '')[:100]
+        story.bias_present = bool(biases.get('present'))
+        story.bias_type = (biases.get('type') or '')[:100]
+        batch.append(story)
+
+    fields = ['safety_present', 'safety_severity', 'safety_type', 'bias_present', 'bias_type']
+    Story.objects.bulk_update(batch, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0002_story_minhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='bias_present',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='bias_type',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='safety_present',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='safety_severity',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='safety_type',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+        migrations.RunPython(populate_flag_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:56
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def populate_content_hash(apps, schema_editor):
+    Story = apps.get_model('stories', 'Story')
+
+    # 500 rows at a time, as stories.dedup.backfill_content_hashes does
+    pending = Story.objects.filter(content_hash='').only('id', 'story').order_by('id')
+    while True:
+        batch = list(pending[:500])
+        if not batch:
+            return
+        for story in batch:
+            story.content_hash = hashlib.sha256(story.story.encode('utf-8')).hexdigest()
+        Story.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0003_story_flag_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorshipdetection',
+            name='analyzer_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='authorshipdetection',
+            name='input_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='authorshipdetection',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='storyanalysis',
+            name='analyzer_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='storyanalysis',
+            name='input_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='storyanalysis',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        # Existing analysis rows keep version 0 and no input hash: nobody
+        # knows which code produced them, so they all count as stale
+        migrations.RunPython(populate_content_hash, migrations.RunPython.noop),
+    ]
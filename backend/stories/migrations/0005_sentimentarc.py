@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0004_analysis_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SentimentArc',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sentence_scores', models.JSONField(default=list)),
+                ('sentence_starts', models.JSONField(default=list)),
+                ('analyzer_version', models.PositiveIntegerField(default=0)),
+                ('input_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('story', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sentiment_arc', to='stories.story')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def clear_none_severity(apps, schema_editor):
+    # 0003 stored the data's string "None" as 'None' rather than ''
+    Story = apps.get_model('stories', 'Story')
+    Story.objects.filter(safety_severity__in=['None', 'Null', 'N/a']).update(safety_severity='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0006_vocabulary'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_none_severity, migrations.RunPython.noop),
+    ]
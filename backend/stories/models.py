@@ -1,6 +1,31 @@
 from django.db import models
 from django.contrib.auth.models import User
 import json
+from .dedup import compute_signature, content_hash, signature_to_bytes
+
+
+# Spellings of "no severity" in the source data
+EMPTY_SEVERITIES = {'', 'none', 'null', 'n/a'}
+
+
+def normalize_severity(value):
+    """'high' / 'HIGH' / 'High' -> 'High', missing or 'None' -> ''"""
+    text = str(value).strip() if value else ''
+    return '' if text.lower() in EMPTY_SEVERITIES else text.capitalize()
+
+
+def flag_columns(safety_violations, stereotypes_biases):
+    """The indexed flag columns for a story's safety/bias JSON blobs"""
+    safety = safety_violations if isinstance(safety_violations, dict) else {}
+    biases = stereotypes_biases if isinstance(stereotypes_biases, dict) else {}
+    return {
+        'safety_present': bool(safety.get('present')),
+        'safety_severity': normalize_severity(safety.get('severity'))[:20],
+        'safety_type': (safety.get('type') or '')[:100],
+        'bias_present': bool(biases.get('present')),
+        'bias_type': (biases.get('type') or '')[:100],
+    }
+
 
 class Story(models.Model):
     AGE_CHOICES = [
@@ -23,6 +48,19 @@ class Story(models.Model):
     
     safety_violations = models.JSONField(default=dict, blank=True)
     stereotypes_biases = models.JSONField(default=dict, blank=True)
+
+    # Denormalized from the two JSON fields above in save(), so flagged
+    # stories can be filtered through an index instead of decoding every row
+    safety_present = models.BooleanField(default=False, db_index=True)
+    safety_severity = models.CharField(max_length=20, blank=True, default='', db_index=True)
+    safety_type = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    bias_present = models.BooleanField(default=False, db_index=True)
+    bias_type = models.CharField(max_length=100, blank=True, default='', db_index=True)
+
+    # MinHash signature of the text (see stories.dedup) for near-duplicate checks
+    minhash = models.BinaryField(null=True, blank=True, editable=False)
+    # SHA-256 of the text, compared with the hash stored on the analysis rows
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
     
     class Meta:
         ordering = ['-created_at']
@@ -30,6 +68,37 @@ class Story(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded text so save() only re-hashes when it changes
+        instance._loaded_story = instance.__dict__.get('story')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+
+        flags = flag_columns(self.safety_violations, self.stereotypes_biases)
+        for name, value in flags.items():
+            setattr(self, name, value)
+        if update_fields is not None and {'safety_violations', 'stereotypes_biases'} & set(update_fields):
+            update_fields = kwargs['update_fields'] = set(update_fields) | set(flags)
+
+        text_loaded = 'story' in self.__dict__
+        text_changed = text_loaded and self.story != getattr(self, '_loaded_story', self.story)
+        if text_loaded and (self.minhash is None or text_changed):
+            self.minhash = signature_to_bytes(compute_signature(self.story))
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'minhash'}
+        # Hashing is cheap enough to redo rather than load a deferred field
+        if text_loaded and (text_changed or not self.__dict__.get('content_hash')):
+            self.content_hash = content_hash(self.story)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'content_hash'}
+        super().save(*args, **kwargs)
+        if text_loaded:
+            self._loaded_story = self.story
+
 class StoryAnalysis(models.Model):
     story = models.OneToOneField(Story, on_delete=models.CASCADE, related_name='analysis')
     word_count = models.IntegerField()
@@ -40,7 +109,12 @@ class StoryAnalysis(models.Model):
     sentiment_label = models.CharField(max_length=20)
     sentiment_score = models.FloatField()
     pos_distribution = models.JSONField()
+    # What produced this row: analysis.executor.STYLOMETRY_VERSION and the
+    # content_hash of the text analysed. Rows that no longer match are stale.
+    analyzer_version = models.PositiveIntegerField(default=0)
+    input_hash = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"Analysis for {self.story.title}"
@@ -50,7 +124,48 @@ class AuthorshipDetection(models.Model):
     predicted_source = models.CharField(max_length=10, choices=Story.SOURCE_CHOICES)
     confidence_score = models.FloatField()
     features = models.JSONField()
+    # Same as on StoryAnalysis, with AUTHORSHIP_VERSION
+    analyzer_version = models.PositiveIntegerField(default=0)
+    input_hash = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f"Authorship for {self.story.title}"
\ No newline at end of file
+        return f"Authorship for {self.story.title}"
+
+
+class SentimentArc(models.Model):
+    story = models.OneToOneField(Story, on_delete=models.CASCADE, related_name='sentiment_arc')
+    # Compound score of every sentence and the character offset it starts
+    # at (see analysis.sentiment_arc); windows and smoothing are derived
+    sentence_scores = models.JSONField(default=list)
+    sentence_starts = models.JSONField(default=list)
+    analyzer_version = models.PositiveIntegerField(default=0)
+    input_hash = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sentiment arc for {self.story.title}"
+
+
+class Term(models.Model):
+    """Corpus vocabulary: how many stories use each term (see analysis.vocabulary)"""
+    term = models.CharField(max_length=64, unique=True)
+    document_frequency = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.term
+
+
+class StoryTerms(models.Model):
+    story = models.OneToOneField(Story, on_delete=models.CASCADE, related_name='terms')
+    # {term: occurrences} of the story's text, kept so keywords and
+    # document frequency updates never re-tokenise it
+    counts = models.JSONField(default=dict)
+    token_count = models.PositiveIntegerField(default=0)
+    input_hash = models.CharField(max_length=64, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Terms of {self.story.title}"
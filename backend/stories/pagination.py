@@ -0,0 +1,231 @@
+"""
+Keyset pagination over relevance-ranked search results.
+
+DRF's CursorPagination can only page over real model fields, so it can't
+order by a computed relevance score. This paginator ranks the matching
+stories once, caches the (score, id) ranking for a short while and hands
+out cursors that point at a (score, id) position in it. Every page is a
+binary search into the cached ranking plus one ``id IN (...)`` query, so
+deep pages cost the same as the first one. Only the top
+SEARCH_RANKING_LIMIT results are ranked up front; paging past them
+extends the cached ranking by another block of that size with a SQL
+keyset condition on (score, id), so the full ranking is paid for once
+per block rather than once per page. A cursor more than a block past the
+cached window (the ranking expired under it) is read with the same
+keyset condition directly.
+"""
+import hashlib
+import json
+from base64 import b64decode, b64encode
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Length, Lower, Replace
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from beyond_words.metrics import registry
+
+TITLE_EXACT_WEIGHT = 10
+TITLE_MATCH_WEIGHT = 5
+
+
+def relevance_expression(query):
+    """
+    SQL expression scoring a story against a search term: a title match
+    counts for a lot, after that every occurrence in the text adds one.
+    """
+    term = query.lower()
+    occurrences = (
+        Length(Lower('story')) - Length(Replace(Lower('story'), Value(term)))
+    ) / len(term)
+    return (
+        Case(When(title__iexact=query, then=Value(TITLE_EXACT_WEIGHT)), default=Value(0))
+        + Case(When(title__icontains=query, then=Value(TITLE_MATCH_WEIGHT)), default=Value(0))
+        + occurrences
+    )
+
+
+def rank_queryset(queryset, query):
+    """Matching stories annotated with ``relevance``, best first"""
+    return (
+        queryset
+        .filter(Q(title__icontains=query) | Q(story__icontains=query))
+        .annotate(relevance=relevance_expression(query))
+        .order_by('-relevance', '-id')
+    )
+
+
+class RelevanceCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+    # Only the top of the ranking is cached - almost nobody reads further
+    ranking_limit = getattr(settings, 'SEARCH_RANKING_LIMIT', 1000)
+    ranking_ttl = getattr(settings, 'SEARCH_RANKING_CACHE_TTL', 300)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None, query=''):
+        """
+        ``queryset`` is the (filtered, possibly column-narrowed) story
+        queryset; ``query`` the search term to rank it by.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        ranked = rank_queryset(queryset, query)
+        cursor = self.decode_cursor(request)
+
+        ranking = self.get_ranking(ranked, request, query)
+        window = self.page_from_ranking(ranking, cursor)
+        if window is None:
+            ranking = self.extend_ranking(ranked, ranking)
+            window = self.page_from_ranking(ranking, cursor)
+        if window is None:
+            window = self.page_from_sql(ranked, cursor)
+        keys, self.has_next, self.has_previous = window
+
+        rows = queryset.in_bulk([story_id for _, story_id in keys])
+        page = []
+        for score, story_id in keys:
+            story = rows.get(story_id)
+            if story is not None:
+                story.relevance = score
+                page.append(story)
+
+        self.first_key = keys[0] if keys else None
+        self.last_key = keys[-1] if keys else None
+        return page
+
+    def get_ranking(self, ranked, request, query):
+        """The cached (score, id) ranking for this search, computing it on a miss"""
+        params = sorted(
+            (key, value) for key, value in request.query_params.items()
+            if key not in (self.cursor_query_param, 'fields', 'expand')
+        )
+        digest = hashlib.sha1(json.dumps([query, params]).encode('utf-8')).hexdigest()
+        cache_key = self.ranking_cache_key = f'search-ranking:{digest}'
+
+        ranking = cache.get(cache_key)
+        registry.inc('cache_requests_total', cache='search_ranking', result='miss' if ranking is None else 'hit')
+        if ranking is None:
+            rows = list(ranked.values_list('relevance', 'id')[:self.ranking_limit + 1])
+            complete = len(rows) <= self.ranking_limit
+            ranking = {'keys': [tuple(row) for row in rows[:self.ranking_limit]], 'complete': complete}
+            cache.set(cache_key, ranking, self.ranking_ttl)
+        return ranking
+
+    def extend_ranking(self, ranked, ranking):
+        """The next block of the ranking, after its last cached key"""
+        if ranking['complete']:
+            return ranking
+        block = max(self.ranking_limit, self.page_size)
+        rows = ranked
+        if ranking['keys']:
+            score, story_id = ranking['keys'][-1]
+            rows = ranked.filter(Q(relevance__lt=score) | Q(relevance=score, id__lt=story_id))
+        rows = list(rows.values_list('relevance', 'id')[:block + 1])
+        ranking = {
+            'keys': ranking['keys'] + [tuple(row) for row in rows[:block]],
+            'complete': len(rows) <= block,
+        }
+        cache.set(self.ranking_cache_key, ranking, self.ranking_ttl)
+        return ranking
+
+    def page_from_ranking(self, ranking, cursor):
+        """Slice a page out of the cached ranking, or None if it's past the cached window"""
+        keys = ranking['keys']
+        # The ranking is ordered by (score desc, id desc) so sort keys are negated
+        sort_keys = [(-score, -story_id) for score, story_id in keys]
+
+        reverse = False
+        if cursor is None:
+            start, end = 0, self.page_size
+        else:
+            score, story_id, reverse = cursor
+            position = (-score, -story_id)
+            if reverse:
+                end = bisect_left(sort_keys, position)
+                start = max(0, end - self.page_size)
+            else:
+                start = bisect_right(sort_keys, position)
+                end = start + self.page_size
+
+        # Going backwards from a cursor past the window there may be uncached
+        # rows between the window's end and the cursor
+        beyond = end >= len(keys) if reverse else end > len(keys)
+        if beyond and not ranking['complete']:
+            return None
+        return keys[start:end], end < len(keys), start > 0
+
+    def page_from_sql(self, ranked, cursor):
+        """Keyset read straight from the database for pages beyond the cache"""
+        if cursor is None:
+            keys = [tuple(row) for row in ranked.values_list('relevance', 'id')[:self.page_size + 1]]
+            return keys[:self.page_size], len(keys) > self.page_size, False
+
+        score, story_id, reverse = cursor
+        if reverse:
+            rows = ranked.filter(
+                Q(relevance__gt=score) | Q(relevance=score, id__gt=story_id)
+            ).order_by('relevance', 'id')
+        else:
+            rows = ranked.filter(
+                Q(relevance__lt=score) | Q(relevance=score, id__lt=story_id)
+            )
+        keys = [tuple(row) for row in rows.values_list('relevance', 'id')[:self.page_size + 1]]
+        has_more = len(keys) > self.page_size
+        keys = keys[:self.page_size]
+        if reverse:
+            return list(reversed(keys)), True, has_more
+        return keys, has_more, True
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data = json.loads(b64decode(encoded.encode('ascii')).decode('ascii'))
+            return int(data['s']), int(data['i']), bool(data.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, key, reverse):
+        score, story_id = key
+        data = {'s': score, 'i': story_id}
+        if reverse:
+            data['r'] = 1
+        encoded = b64encode(json.dumps(data).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return self.encode_cursor(self.last_key, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first_key is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.first_key, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
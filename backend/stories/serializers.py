@@ -1,17 +1,63 @@
 from rest_framework import serializers
-from .models import Story
+from .models import Story, StoryAnalysis, AuthorshipDetection
+
+class StoryAnalysisSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StoryAnalysis
+        exclude = ['id', 'story', 'input_hash']
+
+class AuthorshipDetectionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AuthorshipDetection
+        exclude = ['id', 'story', 'input_hash']
 
 class StorySerializer(serializers.ModelSerializer):
+    # Related rows that can be pulled in with ?expand=analysis,authorship
+    EXPANDABLE_FIELDS = {
+        'analysis': StoryAnalysisSerializer,
+        'authorship': AuthorshipDetectionSerializer,
+    }
+    PREVIEW_FIELD = 'story_preview'
+    # Bookkeeping columns that are never part of the API
+    INTERNAL_FIELDS = ['minhash', 'content_hash']
+
     class Meta:
         model = Story
-        fields = '__all__'
-        
+        exclude = ['minhash', 'content_hash']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The view passes the parsed ?fields= / ?expand= through the context.
+        # With many=True this only runs once for the child serializer, so the
+        # pruning cost is paid per request, not per row.
+        requested = self.context.get('fields')
+        expand = self.context.get('expand') or []
+
+        for name in expand:
+            self.fields[name] = self.EXPANDABLE_FIELDS[name](read_only=True, allow_null=True)
+
+        self.include_preview = requested is None or self.PREVIEW_FIELD in requested
+        if requested is not None:
+            keep = set(requested) | set(expand)
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+
+    @classmethod
+    def available_fields(cls):
+        """All names accepted by ?fields= (model fields plus the preview)"""
+        return [
+            field.name for field in Story._meta.concrete_fields if field.name not in cls.INTERNAL_FIELDS
+        ] + [cls.PREVIEW_FIELD]
+
     def to_representation(self, instance):
         """Custom representation to format the output"""
         data = super().to_representation(instance)
         # Format the story preview for list views
-        if len(data.get('story', '')) > 200:
-            data['story_preview'] = data['story'][:200] + '...'
-        else:
-            data['story_preview'] = data['story']
-        return data
\ No newline at end of file
+        if self.include_preview:
+            text = instance.story or ''
+            if len(text) > 200:
+                data['story_preview'] = text[:200] + '...'
+            else:
+                data['story_preview'] = text
+        return data
@@ -1,3 +1,590 @@
-from django.test import TestCase
+"""
+Tests for the story routes and the project-wide plumbing that lives next
+to them: compression, search pagination, metrics, dedup, replica routing
+and the loadtest helpers.
 
-# Create your tests here.
+The route tests run against a small and a large dataset with the same
+expected number of queries, so anything that starts issuing a query per
+row (a missing select_related, a serializer touching a relation, ...)
+fails here instead of in production.
+"""
+import asyncio
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient, APITestCase
+
+from authentication.models import CustomUser
+from beyond_words import metrics, middleware
+from beyond_words.db_router import PrimaryReplicaRouter, ReplicaPinMiddleware, is_pinned_to_primary
+from analysis.executor import AUTHORSHIP_VERSION, STYLOMETRY_VERSION
+from .management.commands.loadtest import percentile
+from .dedup import LSHIndex, compute_signature, content_hash, estimate_similarity, signature_from_bytes
+from .pagination import RelevanceCursorPagination
+from .models import AuthorshipDetection, Story, StoryAnalysis, normalize_severity
+
+SMALL_DATASET = 3
+# Larger than a page (PAGE_SIZE=20) so pagination and per-row work both show up
+LARGE_DATASET = 120
+
+
+def seed_stories(count):
+    """``count`` stories, each with a current analysis and authorship row"""
+    text = 'The little fox ran home through the forest. ' * 20
+    text_hash = content_hash(text)
+    Story.objects.bulk_create([
+        Story(
+            title=f'The fox and the lantern {i}',
+            story=text,
+            source='AI' if i % 2 else 'Human',
+            age_group='7-12' if i % 3 else '4-6',
+            content_hash=text_hash,
+        )
+        for i in range(count)
+    ])
+    story_ids = list(Story.objects.values_list('id', flat=True))
+    StoryAnalysis.objects.bulk_create([
+        StoryAnalysis(
+            story_id=story_id, word_count=160, sentence_count=20, ttr=0.05,
+            flesch_kincaid_grade=2.0, ari_score=1.5, sentiment_label='neutral',
+            sentiment_score=0.0, pos_distribution=[],
+            analyzer_version=STYLOMETRY_VERSION, input_hash=text_hash,
+        )
+        for story_id in story_ids
+    ])
+    AuthorshipDetection.objects.bulk_create([
+        AuthorshipDetection(
+            story_id=story_id, predicted_source='AI', confidence_score=0.7, features={},
+            analyzer_version=AUTHORSHIP_VERSION, input_hash=text_hash,
+        )
+        for story_id in story_ids
+    ])
+    return story_ids
+
+
+def seed_users(count):
+    """``count`` regular users (no usable password - hashing them would dominate the test time)"""
+    CustomUser.objects.bulk_create([
+        CustomUser(username=f'reader{i}', email=f'reader{i}@example.com', password='!', age_group='7-12')
+        for i in range(count)
+    ])
+
+
+class StoryRouteQueries:
+    """Mixed into a TestCase together with a dataset size"""
+
+    dataset_size = SMALL_DATASET
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.story_ids = seed_stories(cls.dataset_size)
+        cls.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password='pw')
+
+    def setUp(self):
+        # Search rankings are cached between requests
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def assertQueries(self, count, method, url, **kwargs):
+        with self.assertNumQueries(count):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content[:500])
+        return response
+
+    def test_list(self):
+        response = self.assertQueries(1, 'get', '/api/stories/')
+        self.assertEqual(len(response.data['results']), min(self.dataset_size, 20))
+
+    def test_list_expanded_relations_are_joined(self):
+        response = self.assertQueries(1, 'get', '/api/stories/?expand=analysis,authorship')
+        self.assertIn('analysis', response.data['results'][0])
+        self.assertIn('authorship', response.data['results'][0])
+
+    def test_list_sparse_fields(self):
+        self.assertQueries(1, 'get', '/api/stories/?fields=id,title,story_preview')
+
+    def test_list_filters(self):
+        self.assertQueries(1, 'get', '/api/stories/?source=AI&safety_present=false&severity=none')
+
+    def test_list_next_page(self):
+        first = self.assertQueries(1, 'get', '/api/stories/')
+        if first.data['next']:
+            self.assertQueries(1, 'get', first.data['next'])
+
+    def test_detail(self):
+        self.assertQueries(1, 'get', f'/api/stories/{self.story_ids[0]}/')
+
+    def test_detail_expanded(self):
+        self.assertQueries(1, 'get', f'/api/stories/{self.story_ids[0]}/?expand=analysis,authorship')
+
+    def test_by_age_group(self):
+        self.assertQueries(1, 'get', '/api/stories/by_age_group/?age_group=7-12')
+
+    def test_sources(self):
+        self.assertQueries(1, 'get', '/api/stories/sources/')
+
+    def test_search_ranks_then_fetches_page(self):
+        self.assertQueries(2, 'get', '/api/stories/search/?q=fox')
+
+    def test_search_reuses_cached_ranking(self):
+        first = self.assertQueries(2, 'get', '/api/stories/search/?q=fox')
+        self.assertQueries(1, 'get', '/api/stories/search/?q=fox')
+        if first.data['next']:
+            self.assertQueries(1, 'get', first.data['next'])
+
+    def test_search_without_query(self):
+        self.assertQueries(1, 'get', '/api/stories/search/')
+
+    def test_similar(self):
+        self.assertQueries(2, 'get', f'/api/stories/{self.story_ids[0]}/similar/')
+
+    def test_analyze(self):
+        self.assertQueries(1, 'post', f'/api/stories/{self.story_ids[0]}/analyze/')
+
+    def test_detect_authorship(self):
+        self.assertQueries(1, 'post', f'/api/stories/{self.story_ids[0]}/detect_authorship/')
+
+
+class SmallDatasetStoryQueryTests(StoryRouteQueries, APITestCase):
+    dataset_size = SMALL_DATASET
+
+
+class LargeDatasetStoryQueryTests(StoryRouteQueries, APITestCase):
+    dataset_size = LARGE_DATASET
+
+
+class ProjectRouteQueryTests(APITestCase):
+    """Routes defined directly in beyond_words/urls.py"""
+
+    def test_api_root(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/').status_code, 200)
+
+    def test_hero_video(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/hero-video/').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_metrics_scrape(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE http_request_duration_seconds histogram', response.content)
+        self.assertIn(b'http_requests_total{method="GET",route="/",status="200"}', response.content)
+
+    def test_hero_video_ranges(self):
+        url = self.client.get('/api/hero-video/').data['videos']['mp4']
+        with self.assertNumQueries(0):
+            full = self.client.get(url)
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(full['Accept-Ranges'], 'bytes')
+        body = b''.join(full.streaming_content)
+        self.assertEqual(len(body), int(full['Content-Length']))
+
+        partial = self.client.get(url, HTTP_RANGE='bytes=1-')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(b''.join(partial.streaming_content), body[1:])
+        self.assertEqual(partial['Content-Range'], f'bytes 1-{len(body) - 1}/{len(body)}')
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(body)}-').status_code, 416)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=full['ETag']).status_code, 304)
+
+    async def test_hero_video_streams_under_asgi(self):
+        url = (await self.async_client.get('/api/hero-video/')).json()['videos']['mp4']
+        with mock.patch('beyond_words.hero_video.CHUNK_SIZE', 1):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            # An async body: Django would otherwise read the whole file into a list first
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum(map(len, chunks)), int(response['Content-Length']))
+
+
+class CompressionTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_stories(5)
+        cls.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password='Str0ng-pass!')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def get(self, accept_encoding):
+        return self.client.get('/api/stories/', HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_gzip_is_padded(self):
+        with mock.patch.object(middleware, 'brotli', None):
+            response = self.get('gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response.content[3] & gzip.FNAME)  # random-length filename
+        self.assertEqual(json.loads(gzip.decompress(response.content))['results'][0]['title'].split()[0], 'The')
+
+    @skipUnless(middleware.brotli, 'brotli not installed')
+    def test_brotli_preferred(self):
+        response = self.get('gzip;q=0.8, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('results', json.loads(middleware.brotli.decompress(response.content)))
+
+        chunks = [b'{"story": "The little fox ran home."}' * 50] * 3
+        streamed = b''.join(middleware.compress_stream(iter(chunks), 'br'))
+        self.assertEqual(middleware.brotli.decompress(streamed), b''.join(chunks))
+
+    def test_refused_or_unknown_encodings(self):
+        for header in ('', 'identity', 'gzip;q=0, br;q=0', 'compress'):
+            with self.subTest(header=header), mock.patch.object(middleware, 'brotli', None):
+                response = self.get(header)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertIn('results', response.json())
+
+    async def test_async_streams_are_compressed(self):
+        async def rows():
+            for _ in range(3):
+                yield b'title,words\n' * 100
+
+        async def get_response(request):
+            return StreamingHttpResponse(rows(), content_type='text/csv')
+
+        compression = middleware.CompressionMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(compression))
+        with mock.patch.object(middleware, 'brotli', None):
+            response = await compression(RequestFactory().get('/export/', HTTP_ACCEPT_ENCODING='gzip, br'))
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertTrue(response.is_async)
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertTrue(body[3] & gzip.FNAME)
+        self.assertEqual(gzip.decompress(body), b'title,words\n' * 300)
+
+    def test_auth_responses_are_not_compressed(self):
+        response = self.client.post('/api/auth/signin/', {
+            'email': 'reader@example.com', 'password': 'Str0ng-pass!',
+        }, format='json', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(response.content), settings.COMPRESSION_MIN_SIZE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class SearchPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Scores from 1 to 5 occurrences, so most ranks are ties broken by id
+        Story.objects.bulk_create([
+            Story(title=f'Story {i}', story='The fox ran. ' * (i % 5 + 1), source='AI', age_group='7-12')
+            for i in range(45)
+        ] + [
+            Story(title='The fox tale', story='A tale.', source='AI', age_group='7-12'),
+            Story(title='Fox', story='A fox.', source='AI', age_group='7-12'),
+            Story(title='Owl', story='No match here.', source='AI', age_group='7-12'),
+        ])
+        cls.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def expected_order(self):
+        scored = []
+        for story in Story.objects.all():
+            score = story.story.lower().count('fox')
+            if story.title.lower() == 'fox':
+                score += 10
+            if 'fox' in story.title.lower():
+                score += 5
+            if score:
+                scored.append((score, story.id))
+        return [story_id for _, story_id in sorted(scored, reverse=True)]
+
+    def walk(self, url):
+        """Follow next links to the end, then previous links back; returns both page lists"""
+        forward = []
+        while url:
+            data = self.client.get(url).json()
+            forward.append([story['id'] for story in data['results']])
+            last, url = data, data['next']
+        backward = [forward[-1]]
+        url = last['previous']
+        while url:
+            data = self.client.get(url).json()
+            backward.insert(0, [story['id'] for story in data['results']])
+            url = data['previous']
+        return forward, backward
+
+    def test_pages_follow_the_relevance_order(self):
+        forward, backward = self.walk('/api/stories/search/?q=fox&fields=id')
+        self.assertEqual([len(page) for page in forward], [20, 20, 7])
+        self.assertEqual(sum(forward, []), self.expected_order())
+        self.assertEqual(backward, forward)
+
+    def test_pages_past_the_cached_window_match(self):
+        cached, _ = self.walk('/api/stories/search/?q=fox&fields=id')
+        cache.clear()
+        with mock.patch.object(RelevanceCursorPagination, 'ranking_limit', 10):
+            from_sql, backward = self.walk('/api/stories/search/?q=fox&fields=id')
+        self.assertEqual(sum(from_sql, []), sum(cached, []))
+        self.assertEqual(sum(backward, []), sum(cached, []))
+
+    def test_deep_pages_extend_the_cached_ranking(self):
+        with mock.patch.object(RelevanceCursorPagination, 'ranking_limit', 10), \
+                mock.patch.object(RelevanceCursorPagination, 'page_from_sql') as page_from_sql:
+            forward, backward = self.walk('/api/stories/search/?q=fox&fields=id')
+            # The walk cached the whole ranking block by block: rows only now
+            next_url = self.client.get('/api/stories/search/?q=fox&fields=id').json()['next']
+            with self.assertNumQueries(1):
+                response = self.client.get(next_url)
+        page_from_sql.assert_not_called()
+        self.assertEqual(sum(forward, []), self.expected_order())
+        self.assertEqual(backward, forward)
+        self.assertEqual(response.json()['results'], [{'id': story_id} for story_id in forward[1]])
+
+    def test_cursor_is_stable_across_new_rows(self):
+        first = self.client.get('/api/stories/search/?q=fox&fields=id').json()
+        seen = [story['id'] for story in first['results']]
+        # A new top result, and the cached ranking gone: the cursor still
+        # continues right after the last row of page one
+        Story.objects.create(title='Fox', story='fox ' * 50, source='AI', age_group='7-12')
+        cache.clear()
+        second = self.client.get(first['next']).json()
+        ids = [story['id'] for story in second['results']]
+        self.assertFalse(set(ids) & set(seen))
+        self.assertEqual(ids, [i for i in self.expected_order() if i not in seen][1:21])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/stories/search/?q=fox&cursor=nope').status_code, 404)
+
+
+class LoadtestPercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 11))
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertEqual(percentile(values, 100), 10)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertIsNone(percentile([], 50))
+
+    def test_exact_ranks_are_not_rounded_up(self):
+        # Exact ranks stay put; round(x + 0.5) moved some of them up one (99.5 -> 100)
+        self.assertEqual(percentile([1, 2], 25), 1)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_token_required_without_debug(self):
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics/').status_code, 200)
+        with override_settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer nope').status_code, 403)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+
+    def test_dead_workers_fold_into_one_file(self):
+        def dead_pid():
+            process = subprocess.Popen([sys.executable, '-c', ''])
+            process.wait()
+            return process.pid
+
+        def write(directory, pid, started, value):
+            snapshot = {
+                'counters': [['test_total', [['kind', 'a']], value]],
+                'histograms': [['test_seconds', [], [1.0], [value, 0], value / 2, value]],
+            }
+            (Path(directory) / f'metrics-{pid}-{started}.json').write_text(json.dumps(snapshot))
+
+        registry = metrics.Registry()
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            write(directory, dead_pid(), 1, 2)
+            write(directory, dead_pid(), 2, 3)
+            write(directory, os.getppid(), 3, 5)  # still running
+            counters, histograms = metrics.merge(registry.collect_all())
+            self.assertEqual(counters['test_total', (('kind', 'a'),)], 10)
+            self.assertEqual(histograms['test_seconds', ()][1], [10, 0])
+            self.assertCountEqual([path.name for path in Path(directory).glob('metrics-*.json')], [
+                'metrics-dead.json', f'metrics-{os.getppid()}-3.json', registry.path.name,
+            ])
+
+            # Later deaths add to the same file, and nothing is counted twice
+            write(directory, dead_pid(), 4, 1)
+            counters, _ = metrics.merge(registry.collect_all())
+            self.assertEqual(counters['test_total', (('kind', 'a'),)], 11)
+            self.assertEqual(len(list(Path(directory).glob('metrics-*.json'))), 3)
+
+    def test_async_requests_are_counted(self):
+        async def view(request):
+            return HttpResponse('ok')
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        before = metrics.registry.counters[metrics._key(
+            'http_requests_total', {'route': 'unmatched', 'method': 'GET', 'status': '200'})]
+        response = asyncio.run(middleware(RequestFactory().get('/nowhere/')))
+        self.assertEqual(response.content, b'ok')
+        after = metrics.registry.counters[metrics._key(
+            'http_requests_total', {'route': 'unmatched', 'method': 'GET', 'status': '200'})]
+        self.assertEqual(after, before + 1)
+
+
+class SeverityTests(SimpleTestCase):
+    def test_normalize_severity(self):
+        self.assertEqual(normalize_severity('HIGH '), 'High')
+        for empty in (None, '', 'None', 'none', 'null'):
+            with self.subTest(value=empty):
+                self.assertEqual(normalize_severity(empty), '')
+
+    def test_flag_columns_on_save(self):
+        for severity, expected in (('HIGH', 'High'), ('None', '')):
+            story = Story(title='Fox', story='A fox.', source='AI', age_group='7-12',
+                          safety_violations={'present': True, 'severity': severity})
+            with mock.patch.object(Story, 'save_base'):
+                story.save()
+            self.assertEqual(story.safety_severity, expected)
+
+
+FOX = ('The little fox ran home through the snowy forest, past the frozen river and the old mill, '
+       'where the miller waved at him and his sister laughed at the falling snow. ') * 3
+OWL = ('An owl in the tall oak counted the stars every night and told the sleepy rabbits '
+       'stories about the moon, the wind and the faraway sea. ') * 3
+
+
+class DedupTests(APITestCase):
+    def test_signatures_estimate_similarity(self):
+        fox = compute_signature(FOX)
+        self.assertEqual(estimate_similarity(fox, compute_signature(FOX)), 1.0)
+        self.assertGreater(estimate_similarity(fox, compute_signature(FOX.replace('mill', 'barn', 1))), 0.7)
+        self.assertLess(estimate_similarity(fox, compute_signature(OWL)), 0.2)
+
+    def test_lsh_query_and_clusters(self):
+        index = LSHIndex()
+        index.add(1, compute_signature(FOX))
+        index.add(2, compute_signature(OWL))
+        index.add(3, compute_signature(FOX.replace('mill', 'barn', 1)))
+        self.assertEqual([key for key, _ in index.query(compute_signature(FOX), exclude=1)], [3])
+        self.assertEqual(index.clusters(), [[1, 3]])
+
+    def test_signature_follows_the_text(self):
+        story = Story.objects.create(title='Fox', story=FOX, source='AI', age_group='7-12')
+        self.assertEqual(estimate_similarity(signature_from_bytes(story.minhash), compute_signature(FOX)), 1.0)
+        story.story = OWL
+        story.save()
+        story.refresh_from_db()
+        self.assertEqual(estimate_similarity(signature_from_bytes(story.minhash), compute_signature(OWL)), 1.0)
+
+    def test_signature_and_hashes_are_not_in_the_api(self):
+        story = Story.objects.get(id=seed_stories(1)[0])
+        self.client.force_authenticate(CustomUser.objects.create_user(
+            username='reader', email='reader@example.com', password='pw',
+        ))
+        data = self.client.get(f'/api/stories/{story.id}/', {'expand': 'analysis,authorship'}).data
+        self.assertNotIn('minhash', data)
+        self.assertNotIn('content_hash', data)
+        self.assertNotIn('input_hash', data['analysis'])
+        self.assertNotIn('input_hash', data['authorship'])
+        self.assertNotIn(story.content_hash, json.dumps(data, default=str))
+        for field in ('minhash', 'content_hash'):
+            self.assertEqual(self.client.get('/api/stories/', {'fields': f'title,{field}'}).status_code, 400)
+
+    @override_settings(ANALYZE_ON_INGEST='off')
+    def test_load_stories_skips_near_duplicates(self):
+        Story.objects.create(title='Fox', story=FOX, source='AI', age_group='7-12')
+        incoming = [
+            {'title': 'Fox again', 'story': FOX.replace('mill', 'barn', 1), 'source': 'Human', 'age_group': '7-12'},
+            {'title': 'Owl', 'story': OWL, 'source': 'Human', 'age_group': '7-12'},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stories.json')
+            with open(path, 'w') as file:
+                json.dump(incoming, file)
+            call_command('load_stories', path, '--skip-analysis', stdout=StringIO())
+            self.assertEqual(sorted(Story.objects.values_list('title', flat=True)), ['Fox', 'Owl'])
+
+            call_command('load_stories', path, '--skip-analysis', '--keep-duplicates', stdout=StringIO())
+            self.assertTrue(Story.objects.filter(title='Fox again').exists())
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    router = PrimaryReplicaRouter()
+
+    def with_replica(self):
+        return mock.patch.dict(settings.DATABASES, {'replica': settings.DATABASES['default']})
+
+    def test_no_replica_leaves_reads_alone(self):
+        with mock.patch.dict(settings.DATABASES):
+            settings.DATABASES.pop('replica', None)
+            self.assertIsNone(self.router.db_for_read(Story))
+
+    def test_story_reads_go_to_replica_until_a_write(self):
+        def view(request):
+            self.assertEqual(self.router.db_for_read(Story), 'replica')
+            self.assertEqual(self.router.db_for_read(StoryAnalysis), 'replica')
+            self.assertIsNone(self.router.db_for_read(CustomUser))
+            self.assertEqual(self.router.db_for_write(Story), 'default')
+            self.assertEqual(self.router.db_for_read(Story), 'default')
+            return 'response'
+
+        pinned_before = is_pinned_to_primary()
+        with self.with_replica():
+            self.assertEqual(ReplicaPinMiddleware(view)(None), 'response')
+        # The pin ends with the request
+        self.assertEqual(is_pinned_to_primary(), pinned_before)
+
+    def test_async_requests(self):
+        async def view(request):
+            self.assertFalse(is_pinned_to_primary())
+            self.router.db_for_write(Story)
+            self.assertTrue(is_pinned_to_primary())
+            return 'response'
+
+        middleware = ReplicaPinMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.with_replica():
+            self.assertEqual(asyncio.run(middleware(None)), 'response')
+
+
+@skipUnless('replica' in settings.DATABASES, 'set REPLICA_DATABASE_URL (e.g. a second SQLite file) to run')
+@override_settings(ANALYZE_ON_INGEST='off')
+class ReplicaRoutingIntegrationTests(TransactionTestCase):
+    """
+    Run with two SQLite files standing in for primary and replica:
+    DATABASE_URL=sqlite:///primary.sqlite3 REPLICA_DATABASE_URL=sqlite:///replica.sqlite3 python manage.py test stories
+    Nothing replicates between them, which makes it obvious where each read went.
+    """
+
+    # The runner collects `databases` even from skipped classes
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        Story.objects.using('default').create(title='On the primary', story='a', source='AI', age_group='7-12')
+        Story.objects.using('replica').create(title='On the replica', story='b', source='AI', age_group='7-12')
+
+    def test_list_reads_from_replica(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        titles = [story['title'] for story in client.get('/api/stories/').data['results']]
+        self.assertEqual(titles, ['On the replica'])
+
+    def test_reads_after_a_write_use_the_primary(self):
+        def view(request):
+            before = list(Story.objects.values_list('title', flat=True))
+            Story.objects.create(title='Written now', story='c', source='Human', age_group='7-12')
+            after = set(Story.objects.values_list('title', flat=True))
+            return before, after
+
+        before, after = ReplicaPinMiddleware(view)(None)
+        self.assertEqual(before, ['On the replica'])
+        self.assertEqual(after, {'On the primary', 'Written now'})
@@ -5,9 +5,11 @@ from rest_framework import viewsets, filters
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from django.db.models import Q
-from .models import Story, StoryAnalysis, AuthorshipDetection
+from rest_framework.exceptions import ValidationError
+from .authorship import heuristic_authorship
+from .models import Story, StoryAnalysis, AuthorshipDetection, normalize_severity
 from .serializers import StorySerializer
+from .pagination import RelevanceCursorPagination
 
 class StoryViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -21,12 +23,17 @@ class StoryViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = ['created_at', 'title']
     ordering = ['-created_at']
 
+    # Actions that serialize stories and so honour ?fields= / ?expand=
+    SPARSE_ACTIONS = {'list', 'retrieve', 'by_age_group', 'search', 'similar'}
+    # Always fetched: the primary key and the cursor pagination ordering column
+    REQUIRED_COLUMNS = ['id', 'created_at']
+
     def get_queryset(self):
         """
         Optimized queryset - don't load all stories at once
         """
         # START with an efficient base query
-        queryset = Story.objects.select_related().order_by('-created_at')
+        queryset = Story.objects.order_by('-created_at')
         
         # Apply filters at database level
         age_group = self.request.query_params.get('age_group', None)
@@ -36,15 +43,95 @@ class StoryViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(age_group=age_group)
         if source is not None:
             queryset = queryset.filter(source=source)
+
+        # Safety / bias filters hit the indexed flag columns, not the JSON blobs
+        safety_present = self.request.query_params.get('safety_present', None)
+        severity = self.request.query_params.get('severity', None)
+        bias_type = self.request.query_params.get('bias_type', None)
+
+        if safety_present is not None:
+            queryset = queryset.filter(safety_present=self._parse_bool_param('safety_present', safety_present))
+        if severity is not None:
+            queryset = queryset.filter(safety_severity=normalize_severity(severity))
+        if bias_type is not None:
+            queryset = queryset.filter(bias_type=bias_type)
+
+        if self.action in ('list', 'retrieve'):
+            queryset = self.narrow_queryset(queryset)
             
         return queryset
 
+    def _parse_bool_param(self, name, value):
+        lowered = value.strip().lower()
+        if lowered in ('true', '1', 'yes'):
+            return True
+        if lowered in ('false', '0', 'no'):
+            return False
+        raise ValidationError({name: 'Expected true or false'})
+
+    def _parse_list_param(self, name, allowed):
+        """Split a comma separated query param, rejecting unknown names"""
+        raw = self.request.query_params.get(name)
+        if raw is None:
+            return None
+        values = [value.strip() for value in raw.split(',') if value.strip()]
+        unknown = [value for value in values if value not in allowed]
+        if unknown:
+            raise ValidationError({
+                name: f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}"
+            })
+        return values
+
+    def get_requested_fields(self):
+        """Fields from ?fields=, or None when every field was asked for"""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = self._parse_list_param(
+                'fields', StorySerializer.available_fields()
+            )
+        return self._requested_fields
+
+    def get_expansions(self):
+        """Related rows from ?expand= (analysis, authorship)"""
+        if not hasattr(self, '_expansions'):
+            self._expansions = self._parse_list_param(
+                'expand', list(StorySerializer.EXPANDABLE_FIELDS)
+            ) or []
+        return self._expansions
+
+    def narrow_queryset(self, queryset):
+        """
+        Only SELECT the columns the client asked for and join the expanded
+        relations in the same query, so neither the DB nor the serializer
+        does work for data that is thrown away.
+        """
+        fields = self.get_requested_fields()
+        expand = self.get_expansions()
+
+        if fields is not None:
+            columns = set(self.REQUIRED_COLUMNS)
+            columns.update(f for f in fields if f != StorySerializer.PREVIEW_FIELD)
+            if StorySerializer.PREVIEW_FIELD in fields:
+                columns.add('story')
+            queryset = queryset.only(*columns)
+        else:
+            queryset = queryset.defer(*StorySerializer.INTERNAL_FIELDS)
+        if expand:
+            queryset = queryset.select_related(*expand)
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.SPARSE_ACTIONS:
+            context['fields'] = self.get_requested_fields()
+            context['expand'] = self.get_expansions()
+        return context
+
     @action(detail=False, methods=['get'])
     def by_age_group(self, request):
         """Get stories filtered by age group"""
         age_group = request.query_params.get('age_group')
         if age_group:
-            stories = self.get_queryset().filter(age_group=age_group)
+            stories = self.narrow_queryset(self.get_queryset().filter(age_group=age_group))
             
             # Use pagination for this endpoint too
             page = self.paginate_queryset(stories)
@@ -69,13 +156,17 @@ class StoryViewSet(viewsets.ReadOnlyModelViewSet):
         """Search stories by title or content - OPTIMIZED"""
         query = request.query_params.get('q', '')
         
-        if not query.strip():
-            # Don't load ALL stories, let pagination handle it
-            stories = self.get_queryset()
-        else:
-            stories = Story.objects.filter(
-                Q(title__icontains=query) | Q(story__icontains=query)
-            ).order_by('-created_at')
+        if query.strip():
+            # Ranked by relevance with a (score, id) keyset cursor
+            paginator = RelevanceCursorPagination()
+            page = paginator.paginate_queryset(
+                self.narrow_queryset(self.get_queryset()), request, view=self, query=query.strip()
+            )
+            serializer = self.get_serializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        # Don't load ALL stories, let pagination handle it
+        stories = self.narrow_queryset(self.get_queryset())
         
         # Use pagination for search results too
         page = self.paginate_queryset(stories)
@@ -92,10 +183,10 @@ class StoryViewSet(viewsets.ReadOnlyModelViewSet):
         try:
             story = self.get_object()
             # Simple similarity: same age group and source, exclude current story
-            similar = Story.objects.filter(
+            similar = self.narrow_queryset(Story.objects.filter(
                 age_group=story.age_group,
                 source=story.source
-            ).exclude(id=story.id)[:3]
+            ).exclude(id=story.id))[:3]
             
             serializer = self.get_serializer(similar, many=True)
             return Response(serializer.data)
@@ -153,92 +244,12 @@ class StoryViewSet(viewsets.ReadOnlyModelViewSet):
         """Detect authorship (AI vs Human) for a story"""
         try:
             story = self.get_object()
-            text = story.story
-            
-            # Basic text metrics for authorship detection
-            words = text.split()
-            sentences = [s.strip() for s in text.split('.') if s.strip()]
-            
-            # Calculate features
-            word_count = len(words)
-            sentence_count = len(sentences)
-            avg_sentence_length = word_count / max(sentence_count, 1)
-            
-            # Count repetitions (simple approach)
-            word_freq = {}
-            for word in words:
-                clean_word = word.lower().strip('.,!?";:()[]')
-                if len(clean_word) > 2:  # Only count words longer than 2 characters
-                    word_freq[clean_word] = word_freq.get(clean_word, 0) + 1
-            
-            # Calculate repetition score differently
-            total_words = len([w for w in word_freq.keys() if len(w) > 2])
-            repeated_words = sum(1 for freq in word_freq.values() if freq > 2)
-            repetition_score = repeated_words / max(total_words, 1)
-            
-            # Punctuation ratio
-            punctuation_count = len([c for c in text if c in '.,!?;:()[]"'])
-            punctuation_ratio = punctuation_count / len(text)
-            
-            # Complexity score (unique words / total words)
-            complexity_score = len(set(words)) / len(words)
-            
-            # Improved prediction logic based on AI characteristics
-            ai_score = 0
-            
-            # AI tends to have:
-            # 1. Lower repetition of content words
-            if repetition_score < 0.15:
-                ai_score += 1
-                
-            # 2. More consistent sentence lengths
-            if 10 < avg_sentence_length < 20:
-                ai_score += 1
-                
-            # 3. Higher complexity (more varied vocabulary)
-            if complexity_score > 0.75:
-                ai_score += 1
-                
-            # 4. Moderate punctuation usage
-            if 0.02 < punctuation_ratio < 0.08:
-                ai_score += 1
-                
-            # 5. Longer texts tend to be AI generated in your dataset
-            if word_count > 200:
-                ai_score += 1
-                
-            # Predict based on score
-            if ai_score >= 3:
-                predicted_source = 'AI'
-                confidence = min(0.95, 0.6 + (ai_score * 0.1))
-            else:
-                predicted_source = 'Human'
-                confidence = min(0.95, 0.6 + ((5 - ai_score) * 0.1))
-            
+            authorship_data = heuristic_authorship(story.story)
+
             # Add some randomness to make it more realistic
             import random
-            confidence = max(0.6, min(0.95, confidence + random.uniform(-0.1, 0.1)))
-            
-            authorship_data = {
-                'predicted_source': predicted_source,
-                'confidence_score': confidence,
-                'features': {
-                    'repetition_score': repetition_score,
-                    'avg_sentence_length': avg_sentence_length,
-                    'complexity_score': complexity_score,
-                    'punctuation_ratio': punctuation_ratio,
-                    'word_count': word_count,
-                    'sentence_count': sentence_count
-                },
-                'ai_indicators': {
-                    'low_repetition': repetition_score < 0.15,
-                    'consistent_length': 10 < avg_sentence_length < 20,
-                    'high_complexity': complexity_score > 0.75,
-                    'moderate_punctuation': 0.02 < punctuation_ratio < 0.08,
-                    'longer_text': word_count > 200,
-                    'total_ai_score': ai_score
-                }
-            }
+            confidence = authorship_data['confidence_score']
+            authorship_data['confidence_score'] = max(0.6, min(0.95, confidence + random.uniform(-0.1, 0.1)))
             
             return Response(authorship_data)
             
@@ -28,6 +28,10 @@ export const apiCall = async (endpoint, options = {}) => {
         if (refreshResponse.ok) {
           const data = await refreshResponse.json();
           localStorage.setItem('access_token', data.access);
+          // Refresh tokens rotate: the one just sent is blacklisted now
+          if (data.refresh) {
+            localStorage.setItem('refresh_token', data.refresh);
+          }
           
           // Retry original request
           config.headers.Authorization = `Bearer ${data.access}`;